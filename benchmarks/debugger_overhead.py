@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""Measures what the debugger costs compared to running a program natively.
+
+Every workload is run natively and under Debugger.start_debugging in every
+mode, and the best time of several runs is kept. Only the workload itself is
+timed; instrumenting the main script is reported separately as
+instrumentation_seconds. The imports workload spends its time importing and
+instrumenting modules, so its seconds are reported as import_seconds too.
+
+Usage: ./benchmarks/debugger_overhead.py [--repeat N] [--scale N]
+       [--backend bytecode|monitoring] [--output FILE]
+"""
+import argparse
+import importlib
+import io
+import json
+import platform
+import tempfile
+import time
+import sys
+import os
+from contextlib import redirect_stdout, redirect_stderr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.debugger as debugger
+import core.tracingBackends as tracingBackends
+
+DEFAULT_REPEAT = 3
+DEFAULT_SCALE = 1
+PACKAGE_NAME = 'bench_package'
+HOT_LINE_MARK = '# hot'
+COLD_LINE_MARK = '# cold'
+
+TIMER_TEMPLATE = '''
+import time as _time
+_start = _time.perf_counter()
+main()
+print(_time.perf_counter() - _start)
+'''
+
+NEVER_CALLED = '''
+def never_called():
+    return None  {}
+'''.format(COLD_LINE_MARK)
+
+LOOPS = '''
+def main():
+    total = 0
+    for i in range({iterations}):
+        total += i % 7  {hot}
+    return total
+'''
+
+RECURSION = '''
+def fib(n):
+    if n < 2:  {hot}
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+def main():
+    return fib({argument})
+'''
+
+DEEP_RECURSION = '''
+import sys
+sys.setrecursionlimit(10000)
+
+
+def depth(n):
+    if n == 0:  {hot}
+        return 0
+    return depth(n - 1) + 1
+
+
+def main():
+    for _ in range({repeat}):
+        depth({depth})
+'''
+
+IMPORTS = '''
+def main():
+{imports}
+'''
+
+MODULE = '''
+VALUE = {index}
+
+
+def function_{index}(x):
+    return x + VALUE
+'''
+
+
+def create_loops(directory, scale):
+    return LOOPS.format(iterations=100000 * scale, hot=HOT_LINE_MARK)
+
+
+def create_recursion(directory, scale):
+    return RECURSION.format(argument=18 + scale, hot=HOT_LINE_MARK)
+
+
+def create_deep_recursion(directory, scale):
+    return DEEP_RECURSION.format(repeat=20 * scale, depth=2000,
+                                 hot=HOT_LINE_MARK)
+
+
+def create_imports(directory, scale):
+    package = os.path.join(directory, PACKAGE_NAME)
+    os.makedirs(package, exist_ok=True)
+    with open(os.path.join(package, '__init__.py'), 'w') as f:
+        f.write('')
+    names = []
+    for index in range(50 * scale):
+        name = 'module_{}'.format(index)
+        with open(os.path.join(package, name + '.py'), 'w') as f:
+            f.write(MODULE.format(index=index))
+        names.append(name)
+    imports = ['    import {}.{}'.format(PACKAGE_NAME, name)
+               for name in names]
+    imports[0] += '  ' + HOT_LINE_MARK
+    return IMPORTS.format(imports='\n'.join(imports))
+
+
+def create_big_function(directory, scale):
+    lines = ['def main():', '    x = 0']
+    for index in range(2000):
+        lines.append('    x = x + {}'.format(index))
+    lines[-1] += '  ' + HOT_LINE_MARK
+    lines.append('    return x')
+    body = '\n'.join(lines)
+    calls = '\n\n\n_main = main\n\n\ndef main():\n'
+    calls += '    for _ in range({}):\n'.format(20 * scale)
+    calls += '        _main()\n'
+    return body + calls
+
+
+WORKLOADS = {
+    'loops': create_loops,
+    'recursion': create_recursion,
+    'deep_recursion': create_deep_recursion,
+    'imports': create_imports,
+    'big_function': create_big_function,
+}
+
+# name -> (debug mode, breakpoint, breakpoint condition, instrumentation)
+MODES = {
+    'step': (debugger.DebugMode.StepMode, None, None,
+             debugger.InstrumentationMode.EveryLine),
+    'breakpoint_no_hits': (debugger.DebugMode.BreakpointMode, COLD_LINE_MARK,
+                           None, debugger.InstrumentationMode.EveryLine),
+    'conditional': (debugger.DebugMode.BreakpointMode, HOT_LINE_MARK,
+                    'False', debugger.InstrumentationMode.EveryLine),
+    'breakpoint_no_hits_breakpoints_only': (
+        debugger.DebugMode.BreakpointMode, COLD_LINE_MARK, None,
+        debugger.InstrumentationMode.BreakpointsOnly),
+    'conditional_breakpoints_only': (
+        debugger.DebugMode.BreakpointMode, HOT_LINE_MARK, 'False',
+        debugger.InstrumentationMode.BreakpointsOnly),
+}
+
+BACKENDS = {
+    'bytecode': debugger.TracingBackendType.Bytecode,
+    'monitoring': debugger.TracingBackendType.Monitoring,
+}
+
+
+def write_workload(directory, name, scale):
+    source = WORKLOADS[name](directory, scale) + NEVER_CALLED + \
+        TIMER_TEMPLATE
+    filename = os.path.join(directory, name + '.py')
+    with open(filename, 'w') as f:
+        f.write(source)
+    return filename, source
+
+
+def find_line(source, mark):
+    for line_number, line in enumerate(source.splitlines(), 1):
+        if line.endswith(mark):
+            return line_number
+    raise LookupError(mark)
+
+
+def forget_package():
+    for name in [name for name in sys.modules
+                 if name == PACKAGE_NAME or
+                 name.startswith(PACKAGE_NAME + '.')]:
+        del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def get_elapsed(stdout, stderr):
+    lines = stdout.getvalue().split()
+    if stderr.getvalue() or not lines:
+        raise RuntimeError(stderr.getvalue() or 'Workload printed nothing')
+    return float(lines[-1])
+
+
+def run_native(filename, source, directory, trace=None):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    code = compile(source, filename, 'exec')
+    sys.path.insert(0, directory)
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            sys.settrace(trace)
+            try:
+                exec(code, {'__name__': '__main__'})
+            finally:
+                sys.settrace(None)
+    finally:
+        sys.path.remove(directory)
+        forget_package()
+    return get_elapsed(stdout, stderr)
+
+
+def count_lines(filename, source, directory):
+    lines = 0
+
+    def trace(frame, event, arg):
+        nonlocal lines
+        if frame.f_code.co_filename.startswith(directory):
+            if event == 'line':
+                lines += 1
+            return trace
+        return None
+
+    run_native(filename, source, directory, trace)
+    return lines
+
+
+def run_debugged(filename, source, directory, mode, backend):
+    debug_mode, mark, condition, instrumentation_mode = MODES[mode]
+    debugger_instance = debugger.Debugger()
+    if mark is not None:
+        debugger_instance.add_breakpoint(filename, find_line(source, mark),
+                                         condition)
+
+    def interface():
+        if debug_mode == debugger.DebugMode.StepMode:
+            debugger_instance.make_step()
+        else:
+            debugger_instance.continue_until_breakpoint()
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    try:
+        debugger_instance.start_debugging(
+            interface, filename, debug_mode, stdout, stderr,
+            new_wd=directory, instrumentation_mode=instrumentation_mode,
+            tracing_backend=backend)
+    finally:
+        forget_package()
+    return get_elapsed(stdout, stderr)
+
+
+def measure_instrumentation(filename, source, mode, backend):
+    instrumentation_mode = MODES[mode][3]
+    tracing_backend = tracingBackends.create_backend(
+        backend, debugger.Debugger(),
+        instrumentation_mode=instrumentation_mode)
+    start = time.perf_counter()
+    tracing_backend.load_code(source, filename)
+    return time.perf_counter() - start
+
+
+def best_of(repeat, function, *args):
+    return min(function(*args) for _ in range(repeat))
+
+
+def run_workload(directory, name, modes, backend, repeat, scale):
+    filename, source = write_workload(directory, name, scale)
+    lines = count_lines(filename, source, directory)
+    native = best_of(repeat, run_native, filename, source, directory)
+    results = {
+        'lines': lines,
+        'native_seconds': native,
+        'modes': dict(),
+    }
+    for mode in modes:
+        seconds = best_of(repeat, run_debugged, filename, source, directory,
+                          mode, backend)
+        results['modes'][mode] = {
+            'seconds': seconds,
+            'slowdown': seconds / native if native else None,
+            'per_line_overhead_ns':
+                (seconds - native) * 1e9 / lines if lines else None,
+            'instrumentation_seconds': best_of(
+                repeat, measure_instrumentation, filename, source, mode,
+                backend),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--scale', type=int, default=DEFAULT_SCALE)
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        default='bytecode')
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS),
+                        default=list(WORKLOADS))
+    parser.add_argument('--modes', nargs='+', choices=list(MODES),
+                        default=list(MODES))
+    parser.add_argument('--output', help='write the report to this file')
+    args = parser.parse_args()
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'backend': args.backend,
+        'repeat': args.repeat,
+        'scale': args.scale,
+        'workloads': dict(),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.workloads:
+            report['workloads'][name] = run_workload(
+                directory, name, args.modes, BACKENDS[args.backend],
+                args.repeat, args.scale)
+    if 'imports' in report['workloads']:
+        imports = report['workloads']['imports']
+        report['import_seconds'] = {'native': imports['native_seconds']}
+        for mode, result in imports['modes'].items():
+            report['import_seconds'][mode] = result['seconds']
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
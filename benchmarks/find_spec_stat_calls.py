@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Counts file system calls made by DebugFinder.find_spec per import.
+
+Usage: ./benchmarks/find_spec_stat_calls.py [number of modules]
+"""
+import json
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.debuggerLoader import DebugFinder
+
+DEFAULT_MODULES_COUNT = 100
+
+
+class CallCounter:
+    def __init__(self, *names):
+        self.names = names
+        self.counts = dict.fromkeys(names, 0)
+        self.originals = dict()
+
+    def __enter__(self):
+        for name in self.names:
+            self.originals[name] = getattr(os, name)
+            setattr(os, name, self.wrap(name, self.originals[name]))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for name, original in self.originals.items():
+            setattr(os, name, original)
+        return False
+
+    def wrap(self, name, function):
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+
+def measure(finder, names):
+    with CallCounter('stat', 'listdir') as counter:
+        for name in names:
+            finder.find_spec(name, None)
+    return {name: count / len(names)
+            for name, count in counter.counts.items()}
+
+
+def create_modules(directory, modules_count):
+    names = []
+    for index in range(modules_count):
+        name = 'bench_module_{}'.format(index)
+        with open(os.path.join(directory, name + '.py'), 'w') as f:
+            f.write('a = {}\n'.format(index))
+        names.append(name)
+    return names
+
+
+def main():
+    modules_count = DEFAULT_MODULES_COUNT
+    if len(sys.argv) > 1:
+        modules_count = int(sys.argv[1])
+    with tempfile.TemporaryDirectory() as directory:
+        names = create_modules(directory, modules_count)
+        sys.path.append(directory)
+        try:
+            finder = DebugFinder()
+            missing_names = ['missing_{}'.format(name) for name in names]
+            results = {
+                'sys_path_entries': len(sys.path) + 1,
+                'modules': modules_count,
+                'first_import': measure(finder, names[:1]),
+                'imports': measure(finder, names[1:] or names),
+                'missing_modules': measure(finder, missing_names),
+            }
+        finally:
+            sys.path.remove(directory)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
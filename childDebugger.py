@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""Runs a child process of a debugged program under the debugger.
+
+Started by core.childProcesses in place of the script, -m module or -c code
+of a Python child process; the parent session address is taken from the
+PYTHON_DEBUGGER_PARENT environment variable.
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import core.childProcesses as childProcesses
+
+
+if __name__ == '__main__':
+    childProcesses.main(sys.argv[1:])
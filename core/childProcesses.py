@@ -0,0 +1,490 @@
+import importlib.util
+import json
+import multiprocessing.spawn
+import queue
+import re
+import runpy
+import socket
+import subprocess
+import tempfile
+import threading
+import sys
+import os
+import core.debugger as debugger
+from core.sourceCache import source_cache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+PARENT_ADDRESS_VARIABLE = 'PYTHON_DEBUGGER_PARENT'
+CHILD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.path.pardir, 'childDebugger.py')
+PYTHON_EXECUTABLE_PATTERN = re.compile(r'^python[0-9.]*(\.exe)?$')
+# Interpreter options taking a value in the next argument
+OPTIONS_WITH_VALUE = ('-W', '-X', '--check-hash-based-pycs')
+
+# Debugger of this process whose children are debugged
+active_debugger = None
+# Spec of the module a child run with -m runs as __main__
+main_module_spec = None
+parent_address = None
+previous_address = None
+fork_hook_registered = False
+original_popen_init = subprocess.Popen.__init__
+original_get_command_line = multiprocessing.spawn.get_command_line
+original_run_path = runpy.run_path
+
+
+class Connection:
+    """JSON messages, one per line, over a socket"""
+
+    def __init__(self, connection_socket):
+        self.socket = connection_socket
+        self.reader = connection_socket.makefile('r', encoding='utf-8')
+        self.writer = connection_socket.makefile('w', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.writer.write(json.dumps(message) + '\n')
+                self.writer.flush()
+                return True
+            except (OSError, ValueError):
+                self.closed = True
+                return False
+
+    def receive(self):
+        try:
+            line = self.reader.readline()
+        except (OSError, ValueError):
+            line = ''
+        if not line:
+            self.closed = True
+            return None
+        return json.loads(line)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            # Wakes up a thread blocked in receive, it holds the reader
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        for stream in (self.writer, self.reader, self.socket):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+
+
+def get_breakpoint_specs(debugger_instance):
+    return [[bp.filename, bp.line_number, bp.condition, bp.ignore_count,
+             bp.every_nth_hit, bp.log_message]
+            for bp in list(debugger_instance.get_all_breakpoints().values())]
+
+
+def set_breakpoints(debugger_instance, specs):
+    specs = {(spec[0], spec[1]): spec for spec in specs}
+    breakpoints = debugger_instance.get_all_breakpoints()
+    for key, bp in list(breakpoints.items()):
+        spec = specs.get(key)
+        if spec is None or spec != [bp.filename, bp.line_number, bp.condition,
+                                    bp.ignore_count, bp.every_nth_hit,
+                                    bp.log_message]:
+            debugger_instance.remove_breakpoint(*key)
+    for key, spec in specs.items():
+        if key not in breakpoints:
+            debugger_instance.add_breakpoint(*spec)
+
+
+class ChildProcess:
+    """A debugged child process, as seen by the parent session"""
+
+    def __init__(self, pid, argv, connection):
+        self.pid = pid
+        self.argv = argv
+        self.connection = connection
+        # The last 'stopped' message while the child waits for a command
+        self.stop = None
+
+    @property
+    def is_stopped(self):
+        return self.stop is not None
+
+    def send_command(self, command):
+        self.stop = None
+        self.connection.send({'type': 'command', 'command': command})
+
+    def continue_until_breakpoint(self):
+        self.send_command('continue')
+
+    def make_step(self):
+        self.send_command('step')
+
+    def step_over(self):
+        self.send_command('step_over')
+
+
+class ChildProcessServer:
+    """Parent side of child process debugging.
+
+    Child processes connect to a local socket, receive the breakpoints of
+    the session and report every stop. on_child_stopped is called on a
+    server thread with the ChildProcess, which waits until one of its
+    commands is sent. Without on_child_stopped children never stop.
+    """
+
+    def __init__(self, debugger_instance, on_child_stopped=None,
+                 on_child_exited=None):
+        self.debugger = debugger_instance
+        self.on_child_stopped = on_child_stopped
+        self.on_child_exited = on_child_exited
+        self.socket = socket.create_server(('127.0.0.1', 0))
+        self.address = '{}:{}'.format(*self.socket.getsockname()[:2])
+        self.children = dict()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def start(self):
+        thread = threading.Thread(target=self.accept_children)
+        thread.daemon = True
+        thread.start()
+        install_child_process_hooks(self.address, self.debugger)
+
+    def accept_children(self):
+        while not self.closed:
+            try:
+                child_socket, _ = self.socket.accept()
+            except OSError:
+                break
+            thread = threading.Thread(target=self.serve_child,
+                                      args=(Connection(child_socket),))
+            thread.daemon = True
+            thread.start()
+
+    def serve_child(self, connection):
+        hello = connection.receive()
+        if hello is None or hello.get('type') != 'hello':
+            connection.close()
+            return
+        child = ChildProcess(hello['pid'], hello.get('argv'), connection)
+        with self.lock:
+            self.children[child.pid] = child
+        connection.send({'type': 'breakpoints',
+                         'breakpoints': get_breakpoint_specs(self.debugger)})
+        while True:
+            message = connection.receive()
+            if message is None:
+                break
+            if message.get('type') == 'stopped':
+                child.stop = message
+                if self.on_child_stopped is None:
+                    child.continue_until_breakpoint()
+                else:
+                    self.on_child_stopped(child)
+        with self.lock:
+            self.children.pop(child.pid, None)
+        connection.close()
+        if self.on_child_exited is not None:
+            self.on_child_exited(child)
+
+    def get_children(self):
+        with self.lock:
+            return list(self.children.values())
+
+    def breakpoints_changed(self):
+        specs = get_breakpoint_specs(self.debugger)
+        for child in self.get_children():
+            child.connection.send({'type': 'breakpoints',
+                                   'breakpoints': specs})
+
+    def close(self):
+        self.closed = True
+        uninstall_child_process_hooks()
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+        for child in self.get_children():
+            child.connection.close()
+
+
+class ParentConnection:
+    """Child side: reports stops to the parent session and waits for its
+    commands. Breakpoint changes are applied as soon as they arrive."""
+
+    def __init__(self, address, debugger_instance, skip_first_stop=False):
+        self.debugger = debugger_instance
+        self.skip_first_stop = skip_first_stop
+        self.commands = queue.Queue()
+        host, port = address.rsplit(':', 1)
+        self.connection = Connection(
+            socket.create_connection((host, int(port))))
+        self.connection.send({'type': 'hello', 'pid': os.getpid(),
+                              'argv': sys.argv})
+        message = self.connection.receive()
+        if message is not None and message.get('type') == 'breakpoints':
+            set_breakpoints(debugger_instance, message['breakpoints'])
+        thread = threading.Thread(target=self.receive_messages)
+        thread.daemon = True
+        thread.start()
+
+    def receive_messages(self):
+        while True:
+            message = self.connection.receive()
+            if message is None:
+                self.commands.put(None)
+                return
+            if message.get('type') == 'breakpoints':
+                set_breakpoints(self.debugger, message['breakpoints'])
+            elif message.get('type') == 'command':
+                self.commands.put(message['command'])
+
+    def on_stop(self):
+        # Runs on the stopped thread of the child
+        if self.skip_first_stop:
+            self.skip_first_stop = False
+            self.debugger.continue_until_breakpoint()
+            return
+        stack = [[frame.f_code.co_name, frame.f_code.co_filename,
+                  frame.f_lineno]
+                 for frame in self.debugger.current_stacktrace or []]
+        if stack:
+            stack[0][2] = self.debugger.get_line_number()
+        sent = self.connection.send({
+            'type': 'stopped',
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'filename': self.debugger.get_filename(),
+            'line': self.debugger.get_line_number(),
+            'function': self.debugger.get_function_name(),
+            'stack': stack,
+        })
+        command = self.commands.get() if sent else None
+        if command == 'step':
+            self.debugger.make_step()
+        elif command == 'step_over':
+            self.debugger.step_over()
+        else:
+            # Also when the parent is gone, the child runs to its end
+            self.debugger.continue_until_breakpoint()
+
+    def close(self):
+        self.connection.close()
+
+
+def is_python_executable(path):
+    path = os.fspath(path)
+    try:
+        if os.path.samefile(path, sys.executable):
+            return True
+    except (OSError, TypeError, ValueError):
+        pass
+    return PYTHON_EXECUTABLE_PATTERN.match(os.path.basename(path)) is not None
+
+
+def get_child_command(args):
+    # [python, options, script | -m module | -c code, arguments] becomes
+    # [python, options, CHILD_SCRIPT, script | -m module | -c code,
+    #  arguments]. Anything else is returned unchanged.
+    if isinstance(args, (str, bytes)) or not args:
+        return args
+    args = list(args)
+    if not all(isinstance(arg, (str, bytes, os.PathLike)) for arg in args):
+        return args
+    args = [os.fsdecode(arg) for arg in args]
+    if not is_python_executable(args[0]):
+        return args
+    index = 1
+    while index < len(args) and args[index].startswith('-') and \
+            args[index] not in ('-m', '-c', '-'):
+        if args[index] in OPTIONS_WITH_VALUE:
+            index += 1
+        elif args[index].startswith('--'):
+            return args
+        index += 1
+    if index >= len(args) or args[index] == '-':
+        return args
+    if args[index] in ('-m', '-c') and index + 1 >= len(args):
+        return args
+    return args[:index] + [CHILD_SCRIPT] + args[index:]
+
+
+def debugged_popen_init(self, args, *other_args, **kwargs):
+    if kwargs.get('executable') is None and not kwargs.get('shell'):
+        args = get_child_command(args)
+    if kwargs.get('env') is not None and parent_address is not None:
+        # Like os.environ, an environment of its own leads the children to
+        # the parent session
+        kwargs['env'] = {**kwargs['env'],
+                         PARENT_ADDRESS_VARIABLE: parent_address}
+    original_popen_init(self, args, *other_args, **kwargs)
+
+
+def debugged_get_command_line(**kwargs):
+    return get_child_command(original_get_command_line(**kwargs))
+
+
+def after_fork_in_child():
+    if active_debugger is not None and active_debugger.backend is not None:
+        attach_forked_child(active_debugger, parent_address)
+
+
+def install_child_process_hooks(address, debugger_instance):
+    global active_debugger, parent_address, previous_address
+    global fork_hook_registered
+    if active_debugger is None:
+        previous_address = os.environ.get(PARENT_ADDRESS_VARIABLE)
+        subprocess.Popen.__init__ = debugged_popen_init
+        multiprocessing.spawn.get_command_line = debugged_get_command_line
+    if not fork_hook_registered and hasattr(os, 'register_at_fork'):
+        # Fork hooks can not be unregistered, active_debugger turns it off
+        os.register_at_fork(after_in_child=after_fork_in_child)
+        fork_hook_registered = True
+    active_debugger = debugger_instance
+    parent_address = address
+    os.environ[PARENT_ADDRESS_VARIABLE] = address
+
+
+def uninstall_child_process_hooks():
+    global active_debugger, parent_address
+    if active_debugger is None:
+        return
+    subprocess.Popen.__init__ = original_popen_init
+    multiprocessing.spawn.get_command_line = original_get_command_line
+    if previous_address is None:
+        os.environ.pop(PARENT_ADDRESS_VARIABLE, None)
+    else:
+        os.environ[PARENT_ADDRESS_VARIABLE] = previous_address
+    active_debugger = None
+    parent_address = None
+
+
+def attach_forked_child(debugger_instance, address):
+    # Only the forking thread exists in the child, and locks held by other
+    # threads at fork time are never released
+    thread_id = threading.get_ident()
+    thread = debugger_instance.threads.get(thread_id)
+    debugger_instance.threads = {thread_id: thread} if thread else dict()
+    if thread is not None:
+        thread.debug_mode = debugger.DebugMode.BreakpointMode
+        thread.debugger_state = debugger.DebuggerState.Running
+        thread.is_paused = False
+    debugger_instance.main_thread_id = thread_id
+    debugger_instance.selected_thread_id = thread_id
+    debugger_instance.stopped_thread_id = None
+    debugger_instance.command_condition = threading.Condition()
+    debugger_instance.log_buffer.lock = threading.Lock()
+    # Parent session objects like GUI output widgets do not work here
+    debugger_instance.child_processes = None
+    debugger_instance.after_debug_func = None
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    try:
+        parent_connection = ParentConnection(address, debugger_instance)
+    except OSError:
+        debugger_instance.current_debug_interface = \
+            debugger_instance.continue_until_breakpoint
+        return
+    debugger_instance.current_debug_interface = parent_connection.on_stop
+
+
+def run_path_instrumented(path, init_globals=None, run_name=None):
+    # Replaces runpy.run_path in spawned children, so the main module of
+    # the parent program is instrumented when multiprocessing imports it
+    backend = active_debugger.backend if active_debugger else None
+    if backend is None:
+        return original_run_path(path, init_globals, run_name)
+    path = os.path.abspath(os.fspath(path))
+    code = backend.load_code(source_cache.get_source(path), path)
+    module_globals = dict(init_globals or dict())
+    module_globals.update({'__name__': run_name or '<run_path>',
+                           '__file__': path,
+                           '__loader__': None,
+                           '__package__': None,
+                           '__spec__': None})
+    module_globals.update(backend.get_globals())
+    exec(code, module_globals)
+    return module_globals
+
+
+def find_main_spec(module_name):
+    # Like runpy, a package runs its __main__ submodule
+    try:
+        spec = importlib.util.find_spec(module_name)
+        if spec is not None and spec.submodule_search_locations is not None:
+            spec = importlib.util.find_spec(module_name + '.__main__')
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.origin is None:
+        return None
+    return spec
+
+
+def main(arguments):
+    """Runs a child program given as script, -m module or -c code"""
+    global main_module_spec
+    address = os.environ.get(PARENT_ADDRESS_VARIABLE)
+    program_file = None
+    spec = None
+    if arguments[0] == '-m':
+        sys.path[0] = os.getcwd()
+        spec = find_main_spec(arguments[1])
+        if spec is None:
+            print('No module named {}'.format(arguments[1]), file=sys.stderr)
+            sys.exit(1)
+        file, program_arguments = spec.origin, arguments[2:]
+    elif arguments[0] == '-c':
+        sys.path[0] = os.getcwd()
+        with tempfile.NamedTemporaryFile('w', suffix='.py',
+                                         delete=False) as program_file:
+            program_file.write(arguments[1])
+        file, program_arguments = program_file.name, arguments[2:]
+    else:
+        file = os.path.abspath(arguments[0])
+        sys.path[0] = os.path.dirname(file)
+        program_arguments = arguments[1:]
+
+    debugger_instance = debugger.Debugger()
+    parent_connection = None
+    if address is not None:
+        try:
+            parent_connection = ParentConnection(address, debugger_instance,
+                                                 skip_first_stop=True)
+        except OSError:
+            pass
+    try:
+        if parent_connection is None:
+            # The parent session is gone or unknown, the program runs
+            # undebugged
+            sys.argv = [file, *program_arguments]
+            if spec is not None:
+                runpy.run_module(spec.name, run_name='__main__',
+                                 alter_sys=True)
+            else:
+                runpy.run_path(file, run_name='__main__')
+            return
+        # Grandchildren report to the same parent session
+        install_child_process_hooks(address, debugger_instance)
+        runpy.run_path = run_path_instrumented
+        main_module_spec = spec
+        try:
+            debugger_instance.start_debugging(
+                parent_connection.on_stop, file,
+                debugger.DebugMode.BreakpointMode,
+                stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin,
+                arguments=program_arguments)
+        finally:
+            main_module_spec = None
+            runpy.run_path = original_run_path
+            uninstall_child_process_hooks()
+            parent_connection.close()
+    finally:
+        if program_file is not None:
+            os.remove(program_file.name)
+    # The parent sees the exit status of the program, not of the debugger
+    sys.exit(debugger_instance.exit_code)
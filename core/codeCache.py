@@ -0,0 +1,119 @@
+import hashlib
+import importlib.util
+import marshal
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+# Increase when instrumented code produced by modify_code changes
+CACHE_FORMAT_VERSION = 2
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache',
+                                       'python-debugger')
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+CACHE_SUFFIX = '.pyc'
+
+
+class CodeCache:
+    """Instrumented code objects stored on disk, like __pycache__.
+
+    Entries are keyed by source hash, file name, Python version and
+    instrumentation key. When the cache grows over max_size the least
+    recently used entries are removed.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY,
+                 max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.current_size = None
+
+    def get_key(self, source, filename, instrumentation_key):
+        if isinstance(source, str):
+            source = source.encode('utf-8', 'surrogatepass')
+        key = hashlib.sha256(source)
+        key.update(repr((os.path.abspath(filename),
+                         sys.implementation.cache_tag,
+                         importlib.util.MAGIC_NUMBER,
+                         CACHE_FORMAT_VERSION,
+                         instrumentation_key)).encode('utf-8'))
+        return key.hexdigest()
+
+    def get_path(self, filename, key):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        return os.path.join(self.directory, '{}.{}.{}{}'.format(
+            name, sys.implementation.cache_tag, key, CACHE_SUFFIX))
+
+    def load(self, filename, key):
+        path = self.get_path(filename, key)
+        try:
+            with open(path, 'rb') as f:
+                value = marshal.load(f)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def store(self, filename, key, value):
+        try:
+            data = marshal.dumps(value)
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(dir=self.directory,
+                                                     suffix='.tmp')
+            try:
+                with os.fdopen(descriptor, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, self.get_path(filename, key))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except (OSError, ValueError):
+            return
+        if self.current_size is not None:
+            self.current_size += len(data)
+        self.evict()
+
+    def get_entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as directory:
+                for entry in directory:
+                    if entry.name.endswith(CACHE_SUFFIX):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size,
+                                        entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def evict(self):
+        if self.current_size is not None and \
+                self.current_size <= self.max_size:
+            return
+        entries = self.get_entries()
+        self.current_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.current_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.current_size -= size
+
+    def clear(self):
+        for _, _, path in self.get_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.current_size = 0
+
+    def get_statistics(self):
+        return {'hits': self.hits, 'misses': self.misses}
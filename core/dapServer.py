@@ -0,0 +1,613 @@
+import asyncio
+import io
+import json
+import re
+import threading
+import sys
+import os
+import core.debugger as debugger
+from core.moduleFilter import ModuleFilter
+from core.variables import (CONTAINER_TYPES, get_children, get_child_count,
+                            get_scope_names, get_value_repr, has_children)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+HIT_CONDITION_PATTERN = re.compile(r'^(>=|>|%)?\s*(\d+)$')
+
+CAPABILITIES = {
+    'supportsConfigurationDoneRequest': True,
+    'supportsConditionalBreakpoints': True,
+    'supportsDataBreakpoints': True,
+    'supportsHitConditionalBreakpoints': True,
+    'supportsLogPoints': True,
+    'supportsTerminateRequest': True,
+    'supportsVariablePaging': True,
+}
+
+INSTRUMENTATION_MODES = {
+    'everyLine': debugger.InstrumentationMode.EveryLine,
+    'breakpointsOnly': debugger.InstrumentationMode.BreakpointsOnly,
+}
+
+
+class DapError(Exception):
+    pass
+
+
+async def read_message(reader):
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.decode('ascii').strip()
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        elif headers:
+            break
+    try:
+        body = await reader.readexactly(int(headers['content-length']))
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(body.decode('utf-8'))
+
+
+def encode_message(message):
+    body = json.dumps(message).encode('utf-8')
+    return b'Content-Length: %d\r\n\r\n' % len(body) + body
+
+
+def parse_hit_condition(hit_condition):
+    # 'N' and '>=N' stop from the Nth hit on, '>N' after the Nth hit and
+    # '%N' on every Nth hit. Returns (ignore_count, every_nth_hit)
+    if not hit_condition or not hit_condition.strip():
+        return 0, None
+    match = HIT_CONDITION_PATTERN.match(hit_condition.strip())
+    if match is None:
+        raise ValueError('Unsupported hit condition: ' + hit_condition)
+    operator, count = match.group(1), int(match.group(2))
+    if operator == '%':
+        return 0, count
+    if operator == '>':
+        return count, None
+    return max(count - 1, 0), None
+
+
+class OutputStream:
+    def __init__(self, session, category):
+        self.session = session
+        self.category = category
+
+    def write(self, text):
+        if text and not self.session.terminating:
+            self.session.send_event_threadsafe(
+                'output', {'category': self.category, 'output': text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class DapSession:
+    """One Debug Adapter Protocol client driving one Debugger.
+
+    Requests are handled on the asyncio loop. The debuggee runs on its own
+    thread and reports stops, output and its exit through
+    send_event_threadsafe. Frames and variables are only inspected while
+    the debuggee waits for a command.
+    """
+
+    def __init__(self, reader, writer, debugger_instance=None):
+        self.reader = reader
+        self.writer = writer
+        self.debugger = debugger_instance or debugger.Debugger()
+        self.loop = None
+        self.sequence = 0
+        self.finished = False
+        self.launch_arguments = None
+        self.configuration_done = False
+        self.debuggee = None
+        self.stop_on_entry = False
+        self.entry_pending = True
+        self.pause_requested = False
+        # thread id -> reason of its next stop, the default is 'breakpoint'
+        self.stop_reasons = dict()
+        self.is_stopped = False
+        self.terminating = False
+        self.references = dict()
+        self.frames = dict()
+        self.handlers = {
+            'initialize': self.initialize,
+            'launch': self.launch,
+            'setBreakpoints': self.set_breakpoints,
+            'setExceptionBreakpoints': self.set_exception_breakpoints,
+            'dataBreakpointInfo': self.data_breakpoint_info,
+            'setDataBreakpoints': self.set_data_breakpoints,
+            'configurationDone': self.configuration_done_request,
+            'threads': self.threads,
+            'stackTrace': self.stack_trace,
+            'scopes': self.scopes,
+            'variables': self.variables,
+            'evaluate': self.evaluate,
+            'continue': self.continue_request,
+            'next': self.next_request,
+            'stepIn': self.step_in,
+            'stepOut': self.step_out,
+            'pause': self.pause,
+            'terminate': self.terminate,
+            'disconnect': self.disconnect,
+        }
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            while not self.finished:
+                message = await read_message(self.reader)
+                if message is None:
+                    break
+                if message.get('type') == 'request':
+                    self.handle_request(message)
+                await self.writer.drain()
+        finally:
+            self.finished = True
+            self.terminate_debuggee()
+
+    def handle_request(self, request):
+        handler = self.handlers.get(request.get('command'))
+        response = {
+            'type': 'response',
+            'request_seq': request.get('seq'),
+            'command': request.get('command'),
+            'success': True,
+        }
+        try:
+            if handler is None:
+                raise DapError('Unsupported command: {}'.format(
+                    request.get('command')))
+            response['body'] = handler(request.get('arguments') or dict())
+        except DapError as e:
+            response['success'] = False
+            response['message'] = str(e)
+        except Exception as e:
+            response['success'] = False
+            response['message'] = '{}: {}'.format(type(e).__name__, e)
+        self.send(response)
+        if response['success'] and request.get('command') == 'initialize':
+            self.send_event('initialized')
+
+    def send(self, message):
+        if self.writer.is_closing():
+            return
+        self.sequence += 1
+        message['seq'] = self.sequence
+        self.writer.write(encode_message(message))
+
+    def send_event(self, event, body=None):
+        message = {'type': 'event', 'event': event}
+        if body is not None:
+            message['body'] = body
+        self.send(message)
+
+    def send_event_threadsafe(self, event, body=None):
+        try:
+            self.loop.call_soon_threadsafe(self.send_event, event, body)
+        except RuntimeError:
+            # The loop is closed, nobody is listening any more
+            pass
+
+    def initialize(self, arguments):
+        return dict(CAPABILITIES)
+
+    def launch(self, arguments):
+        program = arguments.get('program')
+        if not program or not os.path.isfile(program):
+            raise DapError('Program not found: {}'.format(program))
+        if arguments.get('instrumentation', 'everyLine') \
+                not in INSTRUMENTATION_MODES:
+            raise DapError('Unknown instrumentation: {}'.format(
+                arguments['instrumentation']))
+        self.launch_arguments = arguments
+        self.stop_on_entry = bool(arguments.get('stopOnEntry', False))
+        if arguments.get('stopAllThreads', True):
+            self.debugger.set_thread_stop_mode(
+                debugger.ThreadStopMode.StopAll)
+        else:
+            self.debugger.set_thread_stop_mode(
+                debugger.ThreadStopMode.StopOne)
+        if self.configuration_done:
+            self.start_debuggee()
+        return dict()
+
+    def configuration_done_request(self, arguments):
+        self.configuration_done = True
+        if self.launch_arguments is not None:
+            self.start_debuggee()
+        return dict()
+
+    def start_debuggee(self):
+        arguments = self.launch_arguments
+        program = os.path.abspath(arguments['program'])
+        program_arguments = arguments.get('args') or []
+        if isinstance(program_arguments, str):
+            program_arguments = program_arguments.split()
+        module_filter = ModuleFilter(arguments.get('includeModules'),
+                                     arguments.get('excludeModules'))
+        self.debuggee = threading.Thread(
+            target=self.debugger.start_debugging,
+            args=(self.on_stop, program, debugger.DebugMode.BreakpointMode),
+            kwargs={
+                'stdout': OutputStream(self, 'stdout'),
+                'stderr': OutputStream(self, 'stderr'),
+                'stdin': io.StringIO(),
+                'after_debug_func': self.on_exit,
+                'new_wd': arguments.get('cwd') or os.path.dirname(program),
+                'arguments': program_arguments,
+                'instrumentation_mode': INSTRUMENTATION_MODES[
+                    arguments.get('instrumentation', 'everyLine')],
+                'log_output': OutputStream(self, 'console'),
+                'module_filter': module_filter,
+            })
+        self.debuggee.daemon = True
+        self.debuggee.start()
+
+    def on_stop(self):
+        # Runs on the debuggee thread
+        if self.terminating:
+            raise SystemExit
+        thread_id = threading.get_ident()
+        reason = self.stop_reasons.pop(thread_id, 'breakpoint')
+        if self.entry_pending:
+            self.entry_pending = False
+            if not self.stop_on_entry:
+                self.debugger.continue_until_breakpoint()
+                return
+            reason = 'entry'
+        elif self.pause_requested:
+            self.pause_requested = False
+            reason = 'pause'
+        elif self.debugger.threads[thread_id].changed_watchpoints:
+            reason = 'data breakpoint'
+        try:
+            self.loop.call_soon_threadsafe(self.stopped, reason, thread_id)
+        except RuntimeError:
+            pass
+
+    def on_exit(self):
+        # Runs on the debuggee thread
+        self.send_event_threadsafe('exited',
+                                   {'exitCode': self.debugger.exit_code})
+        self.send_event_threadsafe('terminated')
+
+    def stopped(self, reason, thread_id):
+        self.is_stopped = True
+        self.send_event('stopped', {
+            'reason': reason,
+            'threadId': thread_id,
+            'allThreadsStopped': (self.debugger.thread_stop_mode ==
+                                  debugger.ThreadStopMode.StopAll),
+        })
+
+    def resume(self, reason, command):
+        if not self.is_stopped:
+            raise DapError('Program is not stopped')
+        self.is_stopped = False
+        self.references.clear()
+        self.frames.clear()
+        self.stop_reasons[self.debugger.stopped_thread_id] = reason
+        command()
+
+    def terminate_debuggee(self):
+        if self.debuggee is None or not self.debuggee.is_alive():
+            return
+        # The next line executed by the program raises SystemExit
+        self.terminating = True
+        if self.is_stopped:
+            self.is_stopped = False
+            self.debugger.make_step()
+        self.debugger.pause()
+
+    def set_breakpoints(self, arguments):
+        filename = os.path.abspath(arguments['source']['path'])
+        for line_number in list(self.debugger.get_breakpoint_lines(filename)):
+            self.debugger.remove_breakpoint(filename, line_number)
+        results = []
+        for source_breakpoint in arguments.get('breakpoints', []):
+            line_number = source_breakpoint['line']
+            result = {'verified': True, 'line': line_number}
+            try:
+                ignore_count, every_nth_hit = parse_hit_condition(
+                    source_breakpoint.get('hitCondition'))
+                self.debugger.add_breakpoint(
+                    filename, line_number,
+                    source_breakpoint.get('condition') or None,
+                    ignore_count, every_nth_hit,
+                    source_breakpoint.get('logMessage'))
+            except (SyntaxError, ValueError) as e:
+                result['verified'] = False
+                result['message'] = str(e)
+            except LookupError:
+                result['verified'] = False
+                result['message'] = 'Breakpoint is already set'
+            results.append(result)
+        return {'breakpoints': results}
+
+    def data_breakpoint_info(self, arguments):
+        # Variables of a scope are watched by name, children of other values
+        # have no expression. Without variablesReference the name is an
+        # expression.
+        name = arguments['name']
+        reference = arguments.get('variablesReference')
+        if reference is not None and not self.references.get(
+                reference, (None, False))[1]:
+            return {'dataId': None,
+                    'description': 'Only variables of a scope can be watched'}
+        try:
+            compile(name, '<watchpoint>', 'eval')
+        except SyntaxError as e:
+            return {'dataId': None, 'description': str(e)}
+        return {'dataId': name, 'description': name,
+                'accessTypes': ['write'], 'canPersist': True}
+
+    def set_data_breakpoints(self, arguments):
+        for watchpoint in list(self.debugger.get_watchpoints()):
+            self.debugger.remove_watchpoint(watchpoint.expression)
+        results = []
+        for data_breakpoint in arguments.get('breakpoints', []):
+            result = {'verified': True}
+            try:
+                self.debugger.add_watchpoint(data_breakpoint['dataId'])
+            except SyntaxError as e:
+                result['verified'] = False
+                result['message'] = str(e)
+            except LookupError:
+                result['verified'] = False
+                result['message'] = 'Data breakpoint is already set'
+            results.append(result)
+        return {'breakpoints': results}
+
+    def set_exception_breakpoints(self, arguments):
+        return {'breakpoints': []}
+
+    def threads(self, arguments):
+        return {'threads': [{'id': thread.thread_id, 'name': thread.name}
+                            for thread in self.debugger.get_threads()]}
+
+    def get_frames(self, thread_id=None):
+        if not self.is_stopped:
+            raise DapError('Program is running')
+        if thread_id is not None:
+            thread = self.debugger.threads.get(thread_id)
+            if thread is None or not (
+                    thread.is_paused or
+                    thread_id == self.debugger.stopped_thread_id):
+                raise DapError('Thread is running: {}'.format(thread_id))
+            self.debugger.select_thread(thread_id)
+        return list(self.debugger.current_stacktrace or [])
+
+    def get_frame(self, frame_id):
+        if frame_id is None:
+            frames = self.get_frames()
+            if not frames:
+                raise DapError('No frames')
+            return frames[0]
+        if not self.is_stopped or frame_id not in self.frames:
+            raise DapError('Unknown frame: {}'.format(frame_id))
+        return self.frames[frame_id]
+
+    def get_frame_id(self, frame):
+        # Ids are valid until the program continues
+        for frame_id, known_frame in self.frames.items():
+            if known_frame is frame:
+                return frame_id
+        frame_id = len(self.frames) + 1
+        self.frames[frame_id] = frame
+        return frame_id
+
+    def stack_trace(self, arguments):
+        frames = self.get_frames(arguments.get('threadId'))
+        start = arguments.get('startFrame', 0)
+        levels = arguments.get('levels') or len(frames)
+        stack_frames = []
+        for index in range(start, min(start + levels, len(frames))):
+            frame = frames[index]
+            filename = frame.f_code.co_filename
+            stack_frame = {
+                'id': self.get_frame_id(frame),
+                'name': frame.f_code.co_name,
+                'line': (self.debugger.get_line_number() if index == 0
+                         else frame.f_lineno),
+                'column': 1,
+            }
+            if not filename.startswith('<'):
+                stack_frame['source'] = {
+                    'name': os.path.basename(filename),
+                    'path': os.path.abspath(filename),
+                }
+            stack_frames.append(stack_frame)
+        return {'stackFrames': stack_frames, 'totalFrames': len(frames)}
+
+    def add_reference(self, value, is_scope=False):
+        reference = len(self.references) + 1
+        self.references[reference] = (value, is_scope)
+        return reference
+
+    def scopes(self, arguments):
+        frame = self.get_frame(arguments['frameId'])
+        scopes = []
+        if frame.f_locals is not frame.f_globals:
+            scopes.append({
+                'name': 'Locals',
+                'variablesReference': self.add_reference(frame.f_locals,
+                                                         True),
+                'expensive': False,
+            })
+        scopes.append({
+            'name': 'Globals',
+            'variablesReference': self.add_reference(frame.f_globals, True),
+            'expensive': False,
+        })
+        return {'scopes': scopes}
+
+    def get_variable(self, name, value):
+        variable = {
+            'name': name,
+            'value': get_value_repr(value),
+            'type': type(value).__name__,
+            'variablesReference': (self.add_reference(value)
+                                   if has_children(value) else 0),
+        }
+        if isinstance(value, CONTAINER_TYPES):
+            # Clients page the children of containers
+            variable['indexedVariables'] = get_child_count(value)
+        return variable
+
+    def variables(self, arguments):
+        if not self.is_stopped:
+            raise DapError('Program is running')
+        reference = arguments['variablesReference']
+        if reference not in self.references:
+            raise DapError('Unknown variables reference: {}'.format(
+                reference))
+        value, is_scope = self.references[reference]
+        start = arguments.get('start', 0)
+        count = arguments.get('count') or None
+        if is_scope:
+            # Names the backend injects into the program are not shown
+            hidden = set()
+            if self.debugger.backend is not None:
+                hidden = set(self.debugger.backend.get_globals())
+            names = get_scope_names(value, hidden)
+            stop = None if count is None else start + count
+            children = [(name, value[name]) for name in names[start:stop]]
+        else:
+            children = get_children(value, start, count)
+        return {'variables': [self.get_variable(name, child)
+                              for name, child in children]}
+
+    def evaluate(self, arguments):
+        frame_id = arguments.get('frameId')
+        frame = self.get_frame(frame_id)
+        dicts = (frame.f_globals, frame.f_locals)
+        expression = arguments['expression']
+        try:
+            code = compile(expression, '<evaluate>', 'eval')
+        except SyntaxError:
+            if arguments.get('context') != 'repl':
+                raise
+            self.debugger.exec_code(expression, dicts)
+            return {'result': '', 'variablesReference': 0}
+        try:
+            value = eval(code, *dicts)
+        except BaseException as e:
+            raise DapError('{}: {}'.format(type(e).__name__, e))
+        variable = self.get_variable('', value)
+        return {'result': variable['value'], 'type': variable['type'],
+                'variablesReference': variable['variablesReference']}
+
+    def continue_request(self, arguments):
+        self.resume('breakpoint', self.debugger.continue_until_breakpoint)
+        return {'allThreadsContinued': True}
+
+    def next_request(self, arguments):
+        self.resume('step', self.debugger.step_over)
+        return dict()
+
+    def step_in(self, arguments):
+        self.resume('step', self.debugger.make_step)
+        return dict()
+
+    def step_out(self, arguments):
+        self.resume('step', self.debugger.step_out)
+        return dict()
+
+    def pause(self, arguments):
+        # Stops on the next instrumented line
+        if not self.is_stopped:
+            self.pause_requested = True
+            self.debugger.pause()
+        return dict()
+
+    def terminate(self, arguments):
+        self.terminate_debuggee()
+        return dict()
+
+    def disconnect(self, arguments):
+        self.terminate_debuggee()
+        self.finished = True
+        return dict()
+
+
+async def serve_tcp(host, port, on_listening=None):
+    """Serves a single client connecting to host:port"""
+    done = asyncio.Event()
+
+    async def on_connection(reader, writer):
+        try:
+            await DapSession(reader, writer).run()
+        finally:
+            writer.close()
+            done.set()
+
+    server = await asyncio.start_server(on_connection, host, port)
+    if on_listening is not None:
+        on_listening(server.sockets[0].getsockname())
+    async with server:
+        await done.wait()
+
+
+class StdioWriter:
+    """Blocking writer for stdout, pipe transports do not support files"""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.closed = False
+
+    def write(self, data):
+        self.stdout.write(data)
+        self.stdout.flush()
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def feed_stdin(loop, reader, stdin):
+    # Runs on its own thread, reading stdin is blocking on every platform
+    while True:
+        data = stdin.read1(65536)
+        if not data:
+            break
+        try:
+            loop.call_soon_threadsafe(reader.feed_data, data)
+        except RuntimeError:
+            # The loop is closed, the session is over
+            return
+    try:
+        loop.call_soon_threadsafe(reader.feed_eof)
+    except RuntimeError:
+        pass
+
+
+async def serve_stdio(stdin=None, stdout=None):
+    """Serves a client talking on stdin and stdout"""
+    # Binary streams are saved before the program redirects sys.stdin and
+    # sys.stdout
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    reader = asyncio.StreamReader()
+    stdin_thread = threading.Thread(
+        target=feed_stdin, args=(asyncio.get_running_loop(), reader, stdin))
+    stdin_thread.daemon = True
+    stdin_thread.start()
+    writer = StdioWriter(stdout)
+    try:
+        await DapSession(reader, writer).run()
+    finally:
+        writer.close()
@@ -1,11 +1,25 @@
+import asyncio
+import ast
+import copy
 import inspect
 import collections
+import dis
+import gc
+import types
+import threading
 from bytecode import Instr, Bytecode
 from enum import Enum
 from contextlib import redirect_stdout, redirect_stderr
 from utils.utils import (change_working_directory, change_sys_arguments,
                          redirect_stdin)
-import core.debuggerLoader as debuggerLoader
+import core.childProcesses as childProcesses
+import core.recording as recording
+from core.lineCoverage import LineCoverage
+from core.lineProfiler import LineProfiler
+import core.tracingBackends as tracingBackends
+from core.sampler import Sampler
+from core.logBuffer import LogBuffer
+from core.sourceCache import source_cache
 import sys
 import os
 
@@ -14,10 +28,38 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
 
 
 class Breakpoint:
-    def __init__(self, filename, line_number, condition=None):
+    def __init__(self, filename, line_number, condition=None, ignore_count=0,
+                 every_nth_hit=None, log_message=None):
         self.filename = filename
         self.line_number = line_number
         self.condition = condition
+        self.ignore_count = ignore_count
+        self.every_nth_hit = every_nth_hit
+        self.log_message = log_message
+        self.hit_count = 0
+        if ignore_count < 0 or (every_nth_hit is not None and
+                                every_nth_hit < 1):
+            raise ValueError('Wrong hit counts')
+        # Raises SyntaxError when the breakpoint is created, not when hit
+        self.compiled_condition = None
+        if condition is not None:
+            self.compiled_condition = compile(
+                condition, '<breakpoint condition>', 'eval')
+        # Logpoints do not stop, their message is an f-string
+        self.compiled_log_message = None
+        if log_message is not None:
+            self.compiled_log_message = compile(
+                'f' + repr(log_message), '<logpoint>', 'eval')
+
+    def register_hit(self):
+        # Called once the condition holds, like hitCondition in the Debug
+        # Adapter Protocol: hits where it is false are not counted
+        self.hit_count += 1
+        counted_hits = self.hit_count - self.ignore_count
+        if counted_hits <= 0:
+            return False
+        return (self.every_nth_hit is None or
+                counted_hits % self.every_nth_hit == 0)
 
     def __eq__(self, other):
         return ((self.filename, self.line_number, self.condition) ==
@@ -27,6 +69,98 @@ class Breakpoint:
         return hash((self.filename, self.line_number, self.condition))
 
 
+class Watchpoint:
+    """Stops when the value of an expression changes.
+
+    The expression is evaluated only on lines of code objects that use one
+    of its names, a change made anywhere else is seen on the next such
+    line. The value is compared with the one of the last evaluation in the
+    same context, by identity and then by equality; lists, dicts, sets and
+    bytearrays are kept as shallow copies so changes in place are seen too.
+    The first value in a context is not a change.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        # Raises SyntaxError when the watchpoint is created, not when hit
+        self.compiled_expression = compile(expression, '<watchpoint>',
+                                           'eval')
+        self.names = get_expression_names(expression)
+        self.context_names = get_context_names(expression)
+        # {ids of the context objects: (context objects, last value)}
+        self.values = dict()
+        # {id(frame): keys of the values of its local variables}, frames
+        # are not kept alive and are forgotten when they return
+        self.frame_keys = dict()
+        # The last change
+        self.value = None
+        self.old_value = None
+
+    def check(self, frame):
+        try:
+            value = eval(self.compiled_expression,
+                         frame.f_globals, frame.f_locals)
+        except BaseException:
+            # Not defined here, or not yet
+            return False
+        if type(value) in COPIED_TYPES:
+            value = copy.copy(value)
+        context, uses_frame = self.get_context(frame)
+        key = tuple(map(id, context))
+        if uses_frame:
+            key += (id(frame),)
+        entry = self.values.get(key)
+        if entry is not None and is_same_value(value, entry[1]):
+            return False
+        if entry is None:
+            if len(self.values) >= MAX_WATCHPOINT_CONTEXTS:
+                # The context changed the longest ago starts over
+                del self.values[next(iter(self.values))]
+            if uses_frame:
+                self.frame_keys.setdefault(id(frame), set()).add(key)
+        # The context objects are kept so their ids are not reused
+        self.values.pop(key, None)
+        self.values[key] = (context, value)
+        if entry is None:
+            return False
+        self.old_value, self.value = entry[1], value
+        return True
+
+    def get_context(self, frame):
+        # What the values of the names belong to: the object of watched
+        # attributes and subscripts, the call of a local variable and the
+        # globals of the others. self.count of two instances, or a local of
+        # two calls, are different values. A call is its code object, and
+        # the id of its frame in the key.
+        code = frame.f_code
+        local_variables = frame.f_locals
+        context = []
+        uses_frame = False
+        for name, is_object in self.context_names:
+            if is_object:
+                context.append(local_variables.get(
+                    name, frame.f_globals.get(name)))
+            elif (name in code.co_varnames or name in code.co_cellvars or
+                    name in code.co_freevars):
+                context.append(code)
+                uses_frame = True
+            else:
+                context.append(frame.f_globals)
+        return tuple(context), uses_frame
+
+    def forget_frames(self, frames):
+        # The frames returned, their ids can be reused by new calls
+        for frame in frames:
+            for key in self.frame_keys.pop(id(frame), ()):
+                self.values.pop(key, None)
+
+    def __eq__(self, other):
+        return self.expression == other.expression
+
+    def __hash__(self):
+        return hash(self.expression)
+
+
 class DebugMode(Enum):
     StepMode = 1
     BreakpointMode = 2
@@ -37,111 +171,539 @@ class DebuggerState(Enum):
     Stopped = 2
 
 
+class InstrumentationMode(Enum):
+    EveryLine = 1
+    BreakpointsOnly = 2
+
+
+class TracingBackendType(Enum):
+    Bytecode = 1
+    Monitoring = 2
+    Sampling = 3
+
+
+class ThreadStopMode(Enum):
+    StopAll = 1
+    StopOne = 2
+
+
+class ThreadState:
+    """Stepping state and call stack of one debuggee thread"""
+
+    def __init__(self, thread_id, name, debug_mode=DebugMode.BreakpointMode,
+                 debugger_state=DebuggerState.Running, start_frame=None):
+        self.thread_id = thread_id
+        self.name = name
+        self.debug_mode = debug_mode
+        self.debugger_state = debugger_state
+        self.is_paused = False
+        self.frame = None
+        self.line_number = None
+        self.frame_stack = []
+        self.frame_indexes = dict()
+        self.start_frame = start_frame
+        self.stacktrace = None
+        # Step over and step out stop in one of step_frames or once the
+        # stack is shallower than step_depth. Stepping through coroutines
+        # follows frames and one asyncio task, coroutines of other tasks
+        # run in between.
+        self.step_frames = None
+        self.step_depth = None
+        self.step_task = None
+        self.event_loop = None
+        # Watchpoints whose value changed on the line the thread stopped at
+        self.changed_watchpoints = []
+
+
+class AsyncTask:
+    """An asyncio task of a stopped thread and the frame it is at"""
+
+    def __init__(self, task, frame, is_current=False):
+        self.task = task
+        self.name = task.get_name()
+        self.frame = frame
+        self.is_current = is_current
+
+
 class Debugger:
     def __init__(self):
-        self.current_debugger_state = DebuggerState.Stopped
-        self.current_debug_mode = DebugMode.StepMode
         self.breakpoints = dict()
+        self.breakpoint_lines = collections.defaultdict(set)
+        self.code_has_breakpoints = dict()
+        self.watchpoints = []
+        self.code_watchpoints = dict()
         self.current_debug_interface = None
-        self.current_program_frame = None
-        self.current_stacktrace = None
+        self.threads = dict()
+        self.main_thread_id = None
+        # The thread talking to the interface, commands are sent to it
+        self.stopped_thread_id = None
+        # The thread whose frames are inspected
+        self.selected_thread_id = None
+        self.thread_stop_mode = ThreadStopMode.StopAll
         self.after_debug_func = None
-        self.step_over_marker = []
-        self.start_stacktrace_len = 0
-
-    def debug(self):
-        self.current_program_frame = inspect.currentframe().f_back
-        self.current_stacktrace = self.get_stacktrace()
-        if (self.current_debug_mode == DebugMode.StepMode or
-                self.should_stop_on_breakpoint()):
-            self.current_debugger_state = DebuggerState.Stopped
-        if self.current_debugger_state == DebuggerState.Stopped:
+        self.backend = None
+        self.child_processes = None
+        self.recorder = None
+        self.line_coverage = None
+        self.line_profiler = None
+        self.sampler = None
+        # Coverage and profiling runs only count lines, nothing stops
+        self.headless = False
+        # Exit status of the last run, as the interpreter would give it
+        self.exit_code = None
+        self.command_condition = threading.Condition()
+        self.log_buffer = LogBuffer()
+
+    def debug(self, line_number=None):
+        self.debug_frame(inspect.currentframe().f_back, line_number)
+
+    def debug_frame(self, frame, line_number=None):
+        # Backends pass the line number when they know it: f_lineno is
+        # computed from the line table, which takes longer the further the
+        # frame is into its code
+        if self.line_coverage is not None:
+            self.line_coverage.hit(
+                frame.f_code,
+                frame.f_lineno if line_number is None else line_number)
+        if self.line_profiler is not None:
+            self.line_profiler.line(
+                frame,
+                frame.f_lineno if line_number is None else line_number)
+        if self.headless:
+            return
+        thread = self.threads.get(threading.get_ident())
+        if thread is None:
+            thread = self.add_thread(frame)
+        thread.frame = frame
+        thread.line_number = line_number
+        thread.stacktrace = None
+        if not thread.frame_stack or thread.frame_stack[-1] is not frame:
+            self.update_frame_stack(frame, thread)
+        if self.recorder is not None:
+            self.recorder.record_line(
+                thread, frame.f_lineno if line_number is None else line_number)
+        if (self.stopped_thread_id is not None and
+                self.stopped_thread_id != thread.thread_id and
+                self.thread_stop_mode == ThreadStopMode.StopAll):
+            self.wait_while_other_thread_stopped(thread)
+        if self.watchpoints and self.check_watchpoints(thread):
+            thread.debugger_state = DebuggerState.Stopped
+        if ((thread.debug_mode == DebugMode.StepMode and
+             self.is_in_step_task(thread)) or
+                ((thread.step_frames is not None or
+                  thread.step_depth is not None) and
+                 self.is_step_finished(thread)) or
+                self.should_stop_on_breakpoint(thread)):
+            thread.debugger_state = DebuggerState.Stopped
+        if thread.debugger_state == DebuggerState.Stopped:
+            self.stop(thread)
+
+    def add_thread(self, frame):
+        current_thread = threading.current_thread()
+        thread = ThreadState(current_thread.ident, current_thread.name,
+                             start_frame=get_thread_start_frame(frame))
+        # The interface goes through the threads while the program runs
+        with self.command_condition:
+            self.threads[thread.thread_id] = thread
+        return thread
+
+    def stop(self, thread):
+        # One thread talks to the interface at a time, others hitting a
+        # breakpoint meanwhile wait for their turn
+        with self.command_condition:
+            while self.stopped_thread_id not in (None, thread.thread_id):
+                self.command_condition.wait()
+            self.stopped_thread_id = thread.thread_id
+            self.selected_thread_id = thread.thread_id
+        try:
+            thread.event_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            thread.event_loop = None
+        if self.backend:
+            self.backend.stop()
+        try:
+            self.log_buffer.flush()
             self.current_debug_interface()
-        while self.current_debugger_state == DebuggerState.Stopped:
-            pass
-
-    def get_stacktrace(self):
-        stack = collections.deque()
-        current_frame = inspect.currentframe().f_back.f_back
-        stack.append(current_frame)
-        while current_frame.f_back is not None:
-            current_frame = current_frame.f_back
-            stack.append(current_frame)
-        remove_last_n_from(stack, self.start_stacktrace_len)
-        return stack
-
-    def get_start_stacktrace_len(self):
-        counter = 0
-        current_frame = inspect.currentframe().f_back
-        counter += 1
-        while current_frame.f_back is not None:
-            current_frame = current_frame.f_back
-            counter += 1
-        return counter
-
-    def should_stop_on_breakpoint(self):
-        line_num = self.get_line_number()
-        filename = self.get_filename()
-        function_name = self.get_function_name()
-        if (filename, function_name) in self.step_over_marker:
-            self.step_over_marker = []
+            self.wait_for_command(thread)
+        finally:
+            thread.changed_watchpoints = []
+            with self.command_condition:
+                self.stopped_thread_id = None
+                self.command_condition.notify_all()
+        if self.backend:
+            self.backend.resume()
+        if self.line_profiler is not None:
+            self.line_profiler.restart_timer()
+
+    def wait_while_other_thread_stopped(self, thread):
+        with self.command_condition:
+            thread.is_paused = True
+            while self.stopped_thread_id not in (None, thread.thread_id):
+                self.command_condition.wait()
+            thread.is_paused = False
+        if self.line_profiler is not None:
+            self.line_profiler.restart_timer()
+
+    def wait_for_command(self, thread=None):
+        thread = thread or self.get_command_thread()
+        with self.command_condition:
+            while thread.debugger_state == DebuggerState.Stopped:
+                self.command_condition.wait()
+
+    def post_command(self, debug_mode, step_frames=None, step_depth=None,
+                     step_task=None):
+        with self.command_condition:
+            thread = self.get_command_thread()
+            thread.debug_mode = debug_mode
+            thread.step_frames = step_frames
+            thread.step_depth = step_depth
+            thread.step_task = step_task
+            thread.debugger_state = DebuggerState.Running
+            self.command_condition.notify_all()
+
+    def is_in_step_task(self, thread):
+        task = thread.step_task
+        if task is None:
+            return True
+        if task.done():
+            # The followed task is over, stepping goes on anywhere
+            thread.step_task = None
             return True
-        if (line_num in self.breakpoints and
-                filename in self.breakpoints[line_num]):
-            if self.breakpoints[line_num][filename].condition is not None:
+        return asyncio.current_task() is task
+
+    def is_step_finished(self, thread):
+        # The stack is kept up to date on calls and returns, so stepping
+        # over a call costs a comparison per line. A step in a task that is
+        # done goes on anywhere, like a return to the caller.
+        if ((thread.step_frames is not None and
+             thread.frame in thread.step_frames) or
+                (thread.step_depth is not None and
+                 len(thread.frame_stack) < thread.step_depth) or
+                (thread.step_task is not None and thread.step_task.done())):
+            thread.step_frames = None
+            thread.step_depth = None
+            thread.step_task = None
+            return True
+        return False
+
+    def get_command_thread(self):
+        return self.threads.get(self.stopped_thread_id) or \
+            self.get_selected_thread()
+
+    def get_selected_thread(self):
+        return self.threads.get(self.selected_thread_id)
+
+    def select_thread(self, thread_id):
+        if thread_id not in self.threads:
+            raise LookupError(thread_id)
+        self.selected_thread_id = thread_id
+
+    def get_threads(self):
+        alive_threads = {thread.ident for thread in threading.enumerate()}
+        with self.command_condition:
+            for thread_id in [thread_id for thread_id in self.threads
+                              if thread_id not in alive_threads]:
+                del self.threads[thread_id]
+            return list(self.threads.values())
+
+    def set_thread_stop_mode(self, thread_stop_mode):
+        self.thread_stop_mode = ThreadStopMode(thread_stop_mode)
+
+    def pause(self):
+        # Every thread stops on its next instrumented line
+        with self.command_condition:
+            threads = list(self.threads.values())
+        for thread in threads:
+            thread.step_task = None
+            thread.debug_mode = DebugMode.StepMode
+
+    @property
+    def current_program_frame(self):
+        thread = self.get_selected_thread()
+        return thread.frame if thread else None
+
+    @property
+    def current_debug_mode(self):
+        thread = self.get_command_thread()
+        return thread.debug_mode if thread else None
+
+    def update_frame_stack(self, frame, thread=None):
+        # Frames are matched against the previous stack, so only frames that
+        # were called or returned from since the previous line are walked
+        thread = thread or self.get_selected_thread()
+        new_frames = []
+        current_frame = frame
+        while (current_frame is not None and
+               current_frame is not thread.start_frame and
+               current_frame not in thread.frame_indexes):
+            new_frames.append(current_frame)
+            current_frame = current_frame.f_back
+        if current_frame in thread.frame_indexes:
+            index = thread.frame_indexes[current_frame] + 1
+        else:
+            index = 0
+        returned_frames = thread.frame_stack[index:]
+        for returned_frame in returned_frames:
+            del thread.frame_indexes[returned_frame]
+        del thread.frame_stack[index:]
+        if returned_frames and self.watchpoints:
+            for watchpoint in self.watchpoints:
+                watchpoint.forget_frames(returned_frames)
+        for new_frame in reversed(new_frames):
+            thread.frame_indexes[new_frame] = len(thread.frame_stack)
+            thread.frame_stack.append(new_frame)
+
+    def clear_frame_stack(self):
+        with self.command_condition:
+            threads = list(self.threads.values())
+        for thread in threads:
+            for watchpoint in self.watchpoints:
+                watchpoint.forget_frames(thread.frame_stack)
+            thread.frame_stack = []
+            thread.frame_indexes = dict()
+            thread.stacktrace = None
+
+    def get_stack_depth(self):
+        thread = self.get_selected_thread()
+        return len(thread.frame_stack) if thread else 0
+
+    @property
+    def current_stacktrace(self):
+        thread = self.get_selected_thread()
+        if thread is None:
+            return None
+        if thread.stacktrace is None and thread.frame_stack:
+            thread.stacktrace = self.get_stacktrace(thread)
+        return thread.stacktrace
+
+    def get_stacktrace(self, thread=None):
+        thread = thread or self.get_selected_thread()
+        return collections.deque(reversed(thread.frame_stack))
+
+    def should_stop_on_breakpoint(self, thread=None):
+        thread = thread or self.get_selected_thread()
+        frame = thread.frame
+        code = frame.f_code
+        # Keyed by id: hashing a code object hashes all of its constants.
+        # The code object is kept in the value so its id is not reused.
+        cached = self.code_has_breakpoints.get(id(code))
+        if cached is None:
+            lines = self.get_breakpoint_lines(code.co_filename)
+            cached = (code, bool(lines and lines & get_own_lines(code)))
+            self.code_has_breakpoints[id(code)] = cached
+        if not cached[1]:
+            return False
+        line_number = thread.line_number
+        if line_number is None:
+            line_number = frame.f_lineno
+        current_breakpoint = self.breakpoints.get(
+            (code.co_filename, line_number))
+        if current_breakpoint is not None:
+            compiled_condition = current_breakpoint.compiled_condition
+            if compiled_condition is not None:
                 try:
-                    return eval(self.breakpoints[line_num][filename].condition,
-                                *self.get_globals_and_locals())
+                    if not eval(compiled_condition,
+                                frame.f_globals, frame.f_locals):
+                        return False
                 except BaseException:
+                    if current_breakpoint.compiled_log_message is not None:
+                        # A logpoint never stops, the error is logged
+                        self.log_buffer.append('{}:{}: {}'.format(
+                            current_breakpoint.filename,
+                            current_breakpoint.line_number,
+                            sys.exc_info()[1]))
+                        return False
                     # If condition was not correct (ie raise BaseException)
                     print("Condition was wrong. Stopping.", file=sys.stderr)
                     return True
+            if not current_breakpoint.register_hit():
+                return False
+            if current_breakpoint.compiled_log_message is not None:
+                self.log(current_breakpoint, frame)
+                return False
             return True
         return False
 
+    def get_code_watchpoints(self, code):
+        # Watchpoints that can be evaluated in code: it uses one of their
+        # names. Keyed by id like code_has_breakpoints.
+        cached = self.code_watchpoints.get(id(code))
+        if cached is None or cached[0] is not code:
+            code_names = get_code_names(code)
+            cached = (code, [watchpoint for watchpoint in self.watchpoints
+                             if watchpoint.names & code_names])
+            self.code_watchpoints[id(code)] = cached
+        return cached[1]
+
+    def check_watchpoints(self, thread=None):
+        # Runs on every line while there are watchpoints, code using none of
+        # their names costs a dict lookup
+        thread = thread or self.get_selected_thread()
+        frame = thread.frame
+        cached = self.code_watchpoints.get(id(frame.f_code))
+        if cached is None or cached[0] is not frame.f_code:
+            code_watchpoints = self.get_code_watchpoints(frame.f_code)
+        else:
+            code_watchpoints = cached[1]
+        if not code_watchpoints:
+            return False
+        changed_watchpoints = [watchpoint for watchpoint in code_watchpoints
+                               if watchpoint.check(frame)]
+        if changed_watchpoints:
+            thread.changed_watchpoints = changed_watchpoints
+        return bool(changed_watchpoints)
+
+    def log(self, logpoint, frame=None):
+        frame = frame or self.current_program_frame
+        try:
+            message = eval(logpoint.compiled_log_message,
+                           frame.f_globals, frame.f_locals)
+        except BaseException:
+            message = '{}:{}: {}'.format(logpoint.filename,
+                                         logpoint.line_number,
+                                         sys.exc_info()[1])
+        self.log_buffer.append(message)
+
     def get_code_context(self):
-        filename, line_number, __, __, __ = inspect.getframeinfo(
-            self.current_program_frame)
-        with open(filename, 'r') as f:
-            lines = f.read()
-        return lines, line_number
+        return source_cache.get_source(self.get_filename()), \
+            self.get_line_number()
 
     def get_globals_and_locals(self):
         return (self.current_program_frame.f_globals,
                 self.current_program_frame.f_locals)
 
     def set_debug_mode(self, new_mode):
-        self.current_debug_mode = DebugMode(new_mode)
+        self.get_command_thread().debug_mode = DebugMode(new_mode)
 
     def get_debug_mode(self):
         return self.current_debug_mode
 
-    def add_breakpoint(self, filename, line_number, condition=None):
-        if line_number not in self.breakpoints:
-            self.breakpoints[line_number] = dict()
-        if filename in self.breakpoints[line_number]:
+    def add_breakpoint(self, filename, line_number, condition=None,
+                       ignore_count=0, every_nth_hit=None, log_message=None):
+        new_breakpoint = Breakpoint(filename, line_number, condition,
+                                    ignore_count, every_nth_hit, log_message)
+        if (filename, line_number) in self.breakpoints:
             raise LookupError
-        self.breakpoints[line_number][filename] = Breakpoint(
-            filename, line_number, condition)
+        self.breakpoints[(filename, line_number)] = new_breakpoint
+        self.breakpoint_lines[filename].add(line_number)
+        self.code_has_breakpoints.clear()
+        if self.backend:
+            self.backend.breakpoints_changed(filename, line_number)
+        if self.child_processes:
+            self.child_processes.breakpoints_changed()
 
     def remove_breakpoint(self, filename, line_number):
-        if (line_number in self.breakpoints and
-                filename in self.breakpoints[line_number]):
-            del self.breakpoints[line_number][filename]
+        if (filename, line_number) in self.breakpoints:
+            del self.breakpoints[(filename, line_number)]
+            self.breakpoint_lines[filename].discard(line_number)
+            if not self.breakpoint_lines[filename]:
+                del self.breakpoint_lines[filename]
+            self.code_has_breakpoints.clear()
+            if self.backend:
+                self.backend.breakpoints_changed(filename, line_number)
+            if self.child_processes:
+                self.child_processes.breakpoints_changed()
+
+    def add_watchpoint(self, expression):
+        new_watchpoint = Watchpoint(expression)
+        if new_watchpoint in self.watchpoints:
+            raise LookupError
+        self.watchpoints.append(new_watchpoint)
+        self.code_watchpoints.clear()
+        if self.backend:
+            self.backend.watchpoints_changed()
+
+    def remove_watchpoint(self, expression):
+        for watchpoint in self.watchpoints:
+            if watchpoint.expression == expression:
+                self.watchpoints.remove(watchpoint)
+                self.code_watchpoints.clear()
+                if self.backend:
+                    self.backend.watchpoints_changed()
+                return
+
+    def get_watchpoints(self):
+        return self.watchpoints
 
     def get_all_breakpoints(self):
         return self.breakpoints
 
+    def get_hit_count(self, filename, line_number):
+        if (filename, line_number) in self.breakpoints:
+            return self.breakpoints[(filename, line_number)].hit_count
+        return 0
+
+    def get_breakpoint_lines(self, filename):
+        return self.breakpoint_lines.get(filename, EMPTY_LINES)
+
+    def get_step_frames(self, thread=None):
+        thread = thread or self.threads.get(threading.get_ident())
+        if thread is None:
+            return []
+        frames = list(thread.step_frames or [])
+        if thread.step_depth is not None:
+            frames.extend(thread.frame_stack[:thread.step_depth - 1])
+        return frames
+
+    def get_current_task(self, thread=None):
+        thread = thread or self.get_command_thread()
+        if thread is None or thread.event_loop is None:
+            return None
+        return asyncio.current_task(thread.event_loop)
+
+    def get_tasks(self, thread=None):
+        # Tasks of the event loop running in a stopped thread, each with the
+        # frame it runs or awaits in
+        thread = thread or self.get_selected_thread()
+        if thread is None or thread.event_loop is None:
+            return []
+        current_task = asyncio.current_task(thread.event_loop)
+        tasks = []
+        for task in sorted(asyncio.all_tasks(thread.event_loop),
+                           key=lambda task: task.get_name()):
+            if task is current_task:
+                tasks.append(AsyncTask(task, thread.frame, True))
+            else:
+                tasks.append(AsyncTask(task, self.get_task_frame(task)))
+        return tasks
+
+    def get_task_frame(self, task):
+        # asyncio.sleep and other library coroutines are not shown, the
+        # innermost frame of an instrumented module is
+        frames = get_awaiting_frames(task)
+        if self.backend is not None:
+            frames = [frame for frame in frames
+                      if self.backend.module_filter.is_file_included(
+                          frame.f_code.co_filename)] or frames
+        return frames[-1] if frames else None
+
+    def get_awaiting_frames(self, thread, frame, task):
+        # Frames that go on when a coroutine returns: the coroutine awaiting
+        # it, or for the first coroutine of a task the tasks awaiting that
+        # task
+        index = thread.frame_indexes.get(frame)
+        if index and is_coroutine_frame(thread.frame_stack[index - 1]):
+            return [thread.frame_stack[index - 1]]
+        if task is None:
+            return []
+        frames = []
+        for awaiting_task in get_awaiting_tasks(task):
+            awaiting_frame = self.get_task_frame(awaiting_task)
+            if awaiting_frame is not None:
+                frames.append(awaiting_frame)
+        return frames
+
     def get_line_number(self):
-        return self.current_program_frame.f_lineno
+        thread = self.get_selected_thread()
+        if thread.line_number is None:
+            return thread.frame.f_lineno
+        return thread.line_number
 
     def get_function_name(self):
         return get_function_name_from_frame(self.current_program_frame)
 
     def get_filename(self):
-        (filename, _, _, _, _) = inspect.getframeinfo(
-            self.current_program_frame)
-        return filename
+        return self.current_program_frame.f_code.co_filename
 
     def modify_var(self, out_depth, modify_expression):
         dicts = (self.current_stacktrace[out_depth].f_globals,
@@ -159,89 +721,285 @@ class Debugger:
             print(sys.exc_info(), file=sys.stderr)
 
     def continue_until_breakpoint(self):
-        self.current_debug_mode = DebugMode.BreakpointMode
-        self.current_debugger_state = DebuggerState.Running
+        self.post_command(DebugMode.BreakpointMode)
 
     def make_step(self):
-        self.current_debugger_state = DebuggerState.Running
-        self.current_debug_mode = DebugMode.StepMode
+        thread = self.get_command_thread()
+        if is_coroutine_frame(thread.frame):
+            self.post_command(DebugMode.StepMode,
+                              step_task=self.get_current_task(thread))
+        else:
+            self.post_command(DebugMode.StepMode)
 
     def step_over(self):
-        self.step_over_marker = [(self.get_filename(),
-                                  self.get_function_name())]
-        if len(self.current_stacktrace) > 1:
-            (prev_filename, __, prev_function_name, __, __) = \
-                inspect.getframeinfo(self.current_stacktrace[1])
-            self.step_over_marker.append((prev_filename, prev_function_name))
-        self.current_debug_mode = DebugMode.BreakpointMode
-        self.current_debugger_state = DebuggerState.Running
+        # Stops on the next line of the same frame, or in a caller once the
+        # frame has returned. Recursive calls and other functions of the
+        # same name are deeper in the stack and do not stop.
+        thread = self.get_command_thread()
+        frame = thread.frame
+        if is_coroutine_frame(frame):
+            # The same coroutine frame resumes after an await, other tasks
+            # running the same function do not stop
+            task = self.get_current_task(thread)
+            step_frames = {frame,
+                           *self.get_awaiting_frames(thread, frame, task)}
+            self.post_command(DebugMode.BreakpointMode, step_frames,
+                              step_task=task)
+            return
+        self.post_command(DebugMode.BreakpointMode, {frame},
+                          get_frame_depth(thread, frame))
+
+    def step_out(self):
+        # Stops in a caller once the current frame has returned
+        thread = self.get_command_thread()
+        frame = thread.frame
+        if is_coroutine_frame(frame):
+            task = self.get_current_task(thread)
+            step_frames = set(self.get_awaiting_frames(thread, frame, task))
+            self.post_command(DebugMode.BreakpointMode, step_frames,
+                              step_task=task)
+            return
+        self.post_command(DebugMode.BreakpointMode,
+                          step_depth=get_frame_depth(thread, frame))
 
     def start_debugging(self, debug_function, file, mode=DebugMode.StepMode,
                         stdout=sys.stdout, stderr=sys.stderr,
                         stdin=sys.stdin,
                         after_debug_func=None,
                         new_wd=None,
-                        arguments=None):
+                        arguments=None,
+                        instrumentation_mode=InstrumentationMode.EveryLine,
+                        tracing_backend=TracingBackendType.Bytecode,
+                        code_cache=None,
+                        log_output=None,
+                        module_filter=None,
+                        debug_child_processes=False,
+                        on_child_stopped=None,
+                        record_file=None,
+                        snapshot_interval=recording.DEFAULT_SNAPSHOT_INTERVAL,
+                        line_coverage=None,
+                        line_profiler=None,
+                        sampler=None):
         if not new_wd:
             new_wd = os.getcwd()
         if not arguments:
             arguments = ''
+        self.log_buffer.output = log_output or stdout
         self.after_debug_func = after_debug_func
         self.current_debug_interface = debug_function
-        self.current_debug_mode = DebugMode(mode)
-        debuggerLoader.install_custom_loader(self.debug)
+        # The first line of the program always stops, an uninstrumented
+        # program has none and only stops on breakpoints
+        if TracingBackendType(tracing_backend) == TracingBackendType.Sampling:
+            debugger_state = DebuggerState.Running
+        else:
+            debugger_state = DebuggerState.Stopped
+        main_thread = ThreadState(threading.get_ident(),
+                                  threading.current_thread().name,
+                                  DebugMode(mode), debugger_state,
+                                  inspect.currentframe())
+        self.threads = {main_thread.thread_id: main_thread}
+        self.main_thread_id = main_thread.thread_id
+        self.selected_thread_id = main_thread.thread_id
         try:
-            with open(file, 'r') as code:
-                compiled_code = compile(code.read(), file, 'exec')
-                modified_code = modify_code(compiled_code)
+            self.backend = tracingBackends.create_backend(
+                tracing_backend, self,
+                instrumentation_mode=instrumentation_mode,
+                code_cache=code_cache,
+                module_filter=module_filter)
+            if ((record_file is not None or line_coverage is not None or
+                 line_profiler is not None) and
+                    (TracingBackendType(tracing_backend) !=
+                     TracingBackendType.Bytecode or
+                     InstrumentationMode(instrumentation_mode) !=
+                     InstrumentationMode.EveryLine)):
+                # Every line has to call the debugger to be recorded
+                raise ValueError('Recording, coverage and profiling need '
+                                 'every line to be instrumented with '
+                                 'bytecode')
+            self.line_coverage = line_coverage
+            self.line_profiler = line_profiler
+            if record_file is not None:
+                self.recorder = recording.Recorder(
+                    record_file, snapshot_interval,
+                    self.backend.get_globals())
+            self.backend.install()
+            modified_code = self.backend.load_code(
+                source_cache.get_source(file), file)
+            if debug_child_processes:
+                self.child_processes = childProcesses.ChildProcessServer(
+                    self, on_child_stopped)
+                self.child_processes.start()
+            if sampler is not None:
+                # Started last, threads of the debugger are not sampled
+                self.sampler = sampler
+                self.sampler.start()
         except BaseException:
             print(sys.exc_info(), file=stderr)
+            self.exit_code = 1
             self.stop_debug()
             return
-        _globals = {
-            'debug': self.debug,
-            '__name__': '__main__',
-        }
-        self.start_stacktrace_len = self.get_start_stacktrace_len()
+        main_module = None
+        if childProcesses.active_debugger is self:
+            # Child processes import the program by its __main__ module
+            main_module = types.ModuleType('__main__')
+            main_module.__file__ = os.path.abspath(file)
+            if childProcesses.main_module_spec is not None:
+                # Run with -m, relative imports resolve in its package
+                main_module.__spec__ = childProcesses.main_module_spec
+                main_module.__loader__ = main_module.__spec__.loader
+                main_module.__package__ = main_module.__spec__.parent
+            _globals = main_module.__dict__
+        else:
+            _globals = {
+                '__name__': '__main__',
+            }
+        _globals.update(self.backend.get_globals())
+        previous_main_module = sys.modules.get('__main__')
         with redirect_stdout(stdout), redirect_stderr(stderr), \
                 redirect_stdin(stdin), change_working_directory(new_wd), \
                 change_sys_arguments(arguments):
             try:
+                if main_module is not None:
+                    sys.modules['__main__'] = main_module
+                self.exit_code = 0
                 exec(modified_code, _globals)
+            except SystemExit as exit_exception:
+                self.exit_code = get_exit_code(exit_exception.code)
             except BaseException:
+                self.exit_code = 1
                 print(sys.exc_info(), file=sys.stderr)
+            finally:
+                if main_module is not None:
+                    sys.modules['__main__'] = previous_main_module
+            self.clear_frame_stack()
             self.stop_debug()
 
+    def run_coverage(self, file, line_coverage=None, stdout=sys.stdout,
+                     stderr=sys.stderr, stdin=sys.stdin, new_wd=None,
+                     arguments=None, code_cache=None, module_filter=None):
+        # Runs the program without stopping, only counting the lines run
+        line_coverage = line_coverage or LineCoverage()
+        self.headless = True
+        try:
+            self.start_debugging(self.continue_until_breakpoint, file,
+                                 DebugMode.BreakpointMode, stdout, stderr,
+                                 stdin, new_wd=new_wd, arguments=arguments,
+                                 code_cache=code_cache,
+                                 module_filter=module_filter,
+                                 line_coverage=line_coverage)
+        finally:
+            self.headless = False
+        return line_coverage
+
+    def run_profile(self, file, line_profiler=None, stdout=sys.stdout,
+                    stderr=sys.stderr, stdin=sys.stdin, new_wd=None,
+                    arguments=None, code_cache=None, module_filter=None):
+        # Runs the program without stopping, timing its lines and functions
+        line_profiler = line_profiler or LineProfiler()
+        self.headless = True
+        try:
+            self.start_debugging(self.continue_until_breakpoint, file,
+                                 DebugMode.BreakpointMode, stdout, stderr,
+                                 stdin, new_wd=new_wd, arguments=arguments,
+                                 code_cache=code_cache,
+                                 module_filter=module_filter,
+                                 line_profiler=line_profiler)
+        finally:
+            self.headless = False
+        return line_profiler
+
+    def run_sampled(self, file, sampler=None, stdout=sys.stdout,
+                    stderr=sys.stderr, stdin=sys.stdin, new_wd=None,
+                    arguments=None, module_filter=None):
+        # Runs the program uninstrumented while sampling its stacks
+        sampler = sampler or Sampler()
+        self.start_debugging(self.continue_until_breakpoint, file,
+                             DebugMode.BreakpointMode, stdout, stderr, stdin,
+                             new_wd=new_wd, arguments=arguments,
+                             tracing_backend=TracingBackendType.Sampling,
+                             module_filter=module_filter, sampler=sampler)
+        return sampler
+
+    def get_replay(self):
+        # Replay of what the recording mode recorded so far
+        if self.recorder is None:
+            return None
+        return self.recorder.get_replay()
+
     def stop_debug(self):
+        self.log_buffer.flush()
+        if self.sampler:
+            self.sampler.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.line_profiler:
+            self.line_profiler.finish()
+        if self.child_processes:
+            child_processes, self.child_processes = \
+                self.child_processes, None
+            child_processes.close()
         if self.after_debug_func:
             self.after_debug_func()
-        debuggerLoader.remove_custom_loader_and_invalidate_caches()
+        if self.backend:
+            backend, self.backend = self.backend, None
+            backend.uninstall()
 
 
-def modify_code(file_code):
+RETURN_INSTRUCTIONS = ('RETURN_VALUE', 'RETURN_CONST')
+EMPTY_LINES = frozenset()
+# Mutable values a watchpoint copies, to see them change in place
+COPIED_TYPES = (list, dict, set, bytearray)
+# Contexts a watchpoint keeps a value for, each keeps its objects alive
+MAX_WATCHPOINT_CONTEXTS = 64
+
+
+def modify_code(file_code, patched_lines=None, code_table=None,
+                code_key=None):
+    # patched_lines=None patches every line. Otherwise only the given lines,
+    # the entry line and the return points are patched; module level code is
+    # still patched everywhere as it can not be re-instrumented while running.
+    # With code_table, nested code objects are stored in it and loaded from
+    # it at definition time, so they can be replaced later.
+    if code_key is None:
+        code_key = (file_code.co_filename,)
+    every_line = patched_lines is None or file_code.co_name == '<module>'
     file_bytecode = Bytecode.from_code(file_code)
-    modified_lines = []
+    modified_lines = set()
     modified_bytecode = []
+    # Since 3.11 a frame is not complete (and not visible to f_back) until
+    # its prologue ending with RESUME has run
+    in_prologue = sys.version_info >= (3, 11)
     for instruction in file_bytecode:
-        if hasattr(instruction, "lineno"):
-            if instruction.lineno not in modified_lines:
-                modified_lines.append(instruction.lineno)
-                modified_bytecode.append(
-                    Instr('LOAD_GLOBAL', 'debug',
-                          lineno=instruction.lineno), )
-                modified_bytecode.append(
-                    Instr('CALL_FUNCTION', 0,
-                          lineno=instruction.lineno))
-                modified_bytecode.append(
-                    Instr('POP_TOP',
-                          lineno=instruction.lineno))
+        if in_prologue:
+            in_prologue = getattr(instruction, "name", None) != "RESUME"
+            modified_bytecode.append(instruction)
+        elif hasattr(instruction, "lineno"):
+            if instruction.lineno not in modified_lines and (
+                    every_line or not modified_lines or
+                    instruction.lineno in patched_lines):
+                modified_lines.add(instruction.lineno)
+                modified_bytecode.extend(get_debug_call(instruction.lineno))
+            elif (not every_line and instruction.name in RETURN_INSTRUCTIONS
+                  and instruction.lineno not in modified_lines):
+                modified_bytecode.extend(get_debug_call(instruction.lineno))
             if (instruction.name == "LOAD_CONST"
                     and type(instruction.arg) is type(file_code)
                     and is_source_available(instruction.arg)):
-                modified_bytecode.append(
-                    Instr('LOAD_CONST',
-                          modify_code(instruction.arg),
-                          lineno=instruction.lineno))
+                nested_key = code_key + (
+                    get_const_index(file_code, instruction.arg),)
+                if code_table is None:
+                    modified_bytecode.append(
+                        Instr('LOAD_CONST',
+                              modify_code(instruction.arg, patched_lines,
+                                          code_table, nested_key),
+                              lineno=instruction.lineno))
+                else:
+                    if nested_key not in code_table:
+                        code_table[nested_key] = modify_code(
+                            instruction.arg, patched_lines, code_table,
+                            nested_key)
+                    modified_bytecode.extend(
+                        get_code_table_lookup(nested_key, instruction.lineno))
             else:
                 modified_bytecode.append(instruction)
         else:
@@ -252,17 +1010,184 @@ def modify_code(file_code):
     return file_bytecode.to_code()
 
 
-def is_source_available(function):
-    try:
-        inspect.getsource(function)
+def get_debug_call(lineno):
+    # debug(lineno)
+    if sys.version_info < (3, 11):
+        return [Instr('LOAD_GLOBAL', 'debug', lineno=lineno),
+                Instr('LOAD_CONST', lineno, lineno=lineno),
+                Instr('CALL_FUNCTION', 1, lineno=lineno),
+                Instr('POP_TOP', lineno=lineno)]
+    call = [Instr('LOAD_GLOBAL', (True, 'debug'), lineno=lineno),
+            Instr('LOAD_CONST', lineno, lineno=lineno)]
+    if sys.version_info < (3, 12):
+        call.append(Instr('PRECALL', 1, lineno=lineno))
+    return call + [Instr('CALL', 1, lineno=lineno),
+                   Instr('POP_TOP', lineno=lineno)]
+
+
+def get_code_table_lookup(code_key, lineno):
+    if sys.version_info < (3, 11):
+        load_table = Instr('LOAD_GLOBAL', 'debug_code', lineno=lineno)
+    else:
+        load_table = Instr('LOAD_GLOBAL', (False, 'debug_code'),
+                           lineno=lineno)
+    return [load_table,
+            Instr('LOAD_CONST', code_key, lineno=lineno),
+            Instr('BINARY_SUBSCR', lineno=lineno)]
+
+
+def get_const_index(code, const):
+    for index, value in enumerate(code.co_consts):
+        if value is const:
+            return index
+    return code.co_consts.index(const)
+
+
+def get_code_lines(code):
+    lines = {line for _, line in dis.findlinestarts(code) if line}
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            lines |= get_code_lines(const)
+    return lines
+
+
+def get_own_lines(code):
+    return {line for _, line in dis.findlinestarts(code) if line}
+
+
+def get_code_path(code, line_number, code_key=None):
+    if code_key is None:
+        code_key = (code.co_filename,)
+    path = [(code_key, code)]
+    for index, const in enumerate(code.co_consts):
+        if (isinstance(const, types.CodeType) and
+                line_number in get_code_lines(const)):
+            return path + get_code_path(const, line_number,
+                                        code_key + (index,))
+    return path
+
+
+def get_expression_names(expression):
+    # Variables and attributes the expression reads, except the functions
+    # it calls by name: code calling len is not worth checking, code
+    # assigning a variable named max is
+    tree = ast.parse(expression, mode='eval')
+    functions = {id(node.func) for node in ast.walk(tree)
+                 if isinstance(node, ast.Call)}
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in functions:
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+    return frozenset(names)
+
+
+def get_context_names(expression):
+    # (name, is_object) for every variable the expression reads, is_object
+    # when it is only the object of attributes and subscripts
+    tree = ast.parse(expression, mode='eval')
+    functions = {id(node.func) for node in ast.walk(tree)
+                 if isinstance(node, ast.Call)}
+    objects = {id(node.value) for node in ast.walk(tree)
+               if isinstance(node, (ast.Attribute, ast.Subscript))}
+    names = dict()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in functions:
+            names[node.id] = (names.get(node.id, True) and
+                              id(node) in objects)
+    return tuple(sorted(names.items()))
+
+
+def get_exit_code(code):
+    # Like the interpreter for SystemExit: None is 0, an object that is not
+    # a number is printed and gives 1
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def get_code_names(code):
+    return frozenset(code.co_names + code.co_varnames + code.co_cellvars +
+                     code.co_freevars)
+
+
+def is_same_value(value, other):
+    if value is other:
         return True
-    except OSError:
+    try:
+        return bool(value == other)
+    except BaseException:
         return False
 
 
-def remove_last_n_from(stack, n):
-    for _ in range(n):
-        stack.pop()
+def replace_function_code(old_code, new_code):
+    for referrer in gc.get_referrers(old_code):
+        if (isinstance(referrer, types.FunctionType) and
+                referrer.__code__ is old_code):
+            referrer.__code__ = new_code
+
+
+def is_source_available(function):
+    code = getattr(function, '__code__', function)
+    if isinstance(code, types.CodeType):
+        filename, line_number = code.co_filename, code.co_firstlineno
+    else:
+        filename, line_number = getattr(function, '__file__', None), 1
+    return bool(filename) and source_cache.get_line(filename,
+                                                    line_number) != ''
+
+
+def get_thread_start_frame(frame):
+    # Frames of the threading module below the thread target are not shown
+    while frame is not None:
+        if frame.f_code.co_filename == threading.__file__:
+            return frame
+        frame = frame.f_back
+    return None
+
+
+def get_frame_depth(thread, frame):
+    return thread.frame_indexes.get(frame, len(thread.frame_stack) - 1) + 1
+
+
+def is_coroutine_frame(frame):
+    return frame is not None and bool(frame.f_code.co_flags & (
+        inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE |
+        inspect.CO_ASYNC_GENERATOR))
+
+
+def get_awaiting_frames(task):
+    # Frames of the coroutine chain a suspended task awaits in, outermost
+    # first
+    awaitable = task.get_coro()
+    frames = []
+    while awaitable is not None:
+        frame = (getattr(awaitable, 'cr_frame', None) or
+                 getattr(awaitable, 'ag_frame', None) or
+                 getattr(awaitable, 'gi_frame', None))
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = (getattr(awaitable, 'cr_await', None) or
+                     getattr(awaitable, 'ag_await', None) or
+                     getattr(awaitable, 'gi_yieldfrom', None))
+    return frames
+
+
+def get_awaiting_tasks(task):
+    # A task awaiting another task is woken up by a done callback. The
+    # callbacks are internal to asyncio: without them no task is found, and
+    # stepping out of the task stops once it is done.
+    try:
+        owners = [getattr(callback, '__self__', None)
+                  for callback, _ in task._callbacks or []]
+    except (AttributeError, TypeError, ValueError):
+        return []
+    return [owner for owner in owners if isinstance(owner, asyncio.Task)]
 
 
 def get_function_name_from_frame(frame):
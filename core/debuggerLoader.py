@@ -4,21 +4,47 @@ from importlib.abc import Loader, MetaPathFinder
 import sys
 import os
 import core.debugger as debugger
+from core.sourceCache import source_cache
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
                              os.path.pardir))
 
 
 class DebugFinder(MetaPathFinder):
-    def __init__(self):
-        self.loaded_modules = []
+    def __init__(self, module_filter=None):
+        self.loaded_modules = set()
+        self.module_filter = module_filter
+        # directory -> (mtime, names in it), mtime is None for missing ones
+        self.directory_cache = dict()
 
     def invalidate_caches(self):
+        self.directory_cache.clear()
         for module in self.loaded_modules:
             if module in sys.modules:
                 del sys.modules[module]
 
+    def get_directory_entries(self, directory):
+        cached = self.directory_cache.get(directory)
+        if cached is not None and cached[0] is None:
+            # Missing directories are cached until invalidate_caches
+            return cached[1]
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            entries = frozenset(os.listdir(directory))
+        except OSError:
+            mtime, entries = None, frozenset()
+        self.directory_cache[directory] = (mtime, entries)
+        return entries
+
     def find_spec(self, fullname, path, target=None):
+        if fullname in sys.modules and fullname not in self.loaded_modules:
+            # Already imported without the debugger
+            return None
         if path is None or path == "":
             path = [os.getcwd()]
             for entry in sys.path:
@@ -27,17 +53,25 @@ class DebugFinder(MetaPathFinder):
             *parents, name = fullname.split(".")
         else:
             name = fullname
-        for entry in path:
-            if os.path.isdir(os.path.join(entry, name)):
-                filename = os.path.join(entry, name, "__init__.py")
-                submodule_locations = [os.path.join(entry, name)]
-            else:
-                filename = os.path.join(entry, name + ".py")
+        # sys.path often holds the same directory several times
+        for directory in dict.fromkeys(map(os.path.abspath, path)):
+            entries = self.get_directory_entries(directory)
+            if (name in entries and "__init__.py" in
+                    self.get_directory_entries(os.path.join(directory,
+                                                            name))):
+                filename = os.path.join(directory, name, "__init__.py")
+                submodule_locations = [os.path.join(directory, name)]
+            elif name + ".py" in entries:
+                filename = os.path.join(directory, name + ".py")
                 submodule_locations = None
-            if not os.path.exists(filename):
+            else:
                 continue
+            if (self.module_filter is not None and
+                    not self.module_filter.is_included(fullname, filename)):
+                # Loaded by the next finder, without instrumentation
+                return None
 
-            self.loaded_modules.append(fullname)
+            self.loaded_modules.add(fullname)
 
             return importlib.util.spec_from_file_location(
                 fullname, filename,
@@ -48,6 +82,8 @@ class DebugFinder(MetaPathFinder):
 
 class DebugLoader(Loader):
     debug = None
+    load_code = None
+    code_table = None
 
     def __init__(self, filename):
         self.filename = filename
@@ -59,21 +95,27 @@ class DebugLoader(Loader):
         if not debugger.is_source_available(module):
             pass
         else:
-            with open(module.__file__, 'r') as f:
-                data = f.read()
-            compiled_code = compile(data, module.__file__, 'exec')
-            modified_code = debugger.modify_code(compiled_code)
+            data = source_cache.get_source(module.__file__)
+            modified_code = DebugLoader.load_code(data, module.__file__)
             _globals = vars(module)
             _globals['debug'] = DebugLoader.debug
+            _globals['debug_code'] = DebugLoader.code_table
             try:
                 exec(modified_code, _globals)
             except BaseException:
                 print(sys.exc_info(), file=sys.stderr)
 
 
-def install_custom_loader(debug_function):
+def install_custom_loader(debug_function, load_code_function=None,
+                          code_table=None, module_filter=None):
     DebugLoader.debug = debug_function
-    sys.meta_path.insert(0, DebugFinder())
+    DebugLoader.load_code = load_code_function or load_code
+    DebugLoader.code_table = code_table
+    sys.meta_path.insert(0, DebugFinder(module_filter))
+
+
+def load_code(source, filename):
+    return debugger.modify_code(compile(source, filename, 'exec'))
 
 
 def remove_custom_loader_and_invalidate_caches():
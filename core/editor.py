@@ -1,7 +1,8 @@
 from PyQt5 import Qsci
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont, QFontMetrics, QColor
-from PyQt5.QtWidgets import QInputDialog
+from PyQt5.QtWidgets import (QDialog, QDialogButtonBox, QFormLayout,
+                             QLineEdit, QMessageBox, QSpinBox)
 from core.debugger import Breakpoint
 
 FONT_FAMILY = "Source Code Pro"
@@ -17,12 +18,16 @@ IND_BACKGROUND = "#676a6d"
 IND_FOREGROUND = "#676a6d"
 MARKER_BACKGROUND = "#2b2b2b"  # "#313335"
 MARKER_FOREGROUND = "#676a6d"
+# Lines that did not run, then from cold to hot lines
+HEAT_COLORS = ("#a33a3a", "#2f5e36", "#3d7f46", "#4fa358", "#66cc70")
 
 
 class Editor(Qsci.QsciScintilla):
     BACKGROUND_MARKER_NUM = 10
     BACKGROUND_BREAKPOINT_MARKER_NUM = 9
     BREAKPOINT_MARKER_NUM = 8
+    # Drawn under the breakpoint marker
+    HEAT_MARKER_NUMS = range(len(HEAT_COLORS))
 
     def __init__(self, parent, filename, bp_add, bp_remove):
         super(Editor, self).__init__(None)
@@ -122,6 +127,11 @@ class Editor(Qsci.QsciScintilla):
         self.setMarkerBackgroundColor(QColor("#acec61"),
                                       self.BACKGROUND_MARKER_NUM)
 
+        for marker_num, color in zip(self.HEAT_MARKER_NUMS, HEAT_COLORS):
+            self.markerDefine(Qsci.QsciScintilla.SC_MARK_FULLRECT,
+                              marker_num)
+            self.setMarkerBackgroundColor(QColor(color), marker_num)
+
         # FOLDING LINE DISABLE
         self.SendScintilla(Qsci.QsciScintilla.SCI_SETFOLDFLAGS, 0)
 
@@ -142,27 +152,58 @@ class Editor(Qsci.QsciScintilla):
              font-size: 10px !important;
         }
         """)
+        # HIT COUNTS
+        self.setAnnotationDisplay(Qsci.QsciScintilla.AnnotationBoxed)
         self.highlighted_lines = []
         self.breakpoints = set()
 
     def on_margin_clicked(self, nmargin, nline, modifiers):
         # Toggle marker for the line the margin was clicked on
-        if self.markersAtLine(nline) > 1:
+        if self.markersAtLine(nline) & (1 << self.BREAKPOINT_MARKER_NUM):
             self.markerDelete(nline, self.BACKGROUND_BREAKPOINT_MARKER_NUM)
             self.markerDelete(nline, self.BREAKPOINT_MARKER_NUM)
-            self.breakpoints.remove(Breakpoint(self.filename, nline + 1))
+            self.clearAnnotations(nline)
+            self.breakpoints = {bp for bp in self.breakpoints
+                                if bp.line_number != nline + 1}
             self.bp_remove(self.filename, nline + 1)
         else:
             condition = None
+            ignore_count = 0
+            every_nth_hit = None
+            log_message = None
             ok = True
             if modifiers & Qt.ShiftModifier:
-                (ok, condition) = QConditionInputDialog(self).readline()
+                (ok, condition, ignore_count, every_nth_hit,
+                 log_message) = QBreakpointInputDialog(self).readline()
             if ok:
+                try:
+                    bp = Breakpoint(self.filename, nline + 1, condition,
+                                    ignore_count, every_nth_hit, log_message)
+                except SyntaxError as e:
+                    QMessageBox.warning(self, 'Wrong breakpoint', str(e))
+                    return
                 self.markerAdd(nline, self.BACKGROUND_BREAKPOINT_MARKER_NUM)
                 self.markerAdd(nline, self.BREAKPOINT_MARKER_NUM)
-                bp = Breakpoint(self.filename, nline + 1, condition)
                 self.breakpoints.add(bp)
-                self.bp_add(self.filename, nline + 1, condition)
+                self.bp_add(self.filename, nline + 1, condition,
+                            ignore_count, every_nth_hit, log_message)
+
+    def show_hit_counts(self, get_hit_count):
+        for bp in self.breakpoints:
+            self.annotate(bp.line_number - 1, 'Hits: {}'.format(
+                get_hit_count(bp.filename, bp.line_number)), 0)
+
+    def clear_hit_counts(self):
+        self.clearAnnotations()
+
+    def show_line_heat(self, heat_levels):
+        self.clear_line_heat()
+        for line_number, level in heat_levels.items():
+            self.markerAdd(line_number - 1, self.HEAT_MARKER_NUMS[level])
+
+    def clear_line_heat(self):
+        for marker_num in self.HEAT_MARKER_NUMS:
+            self.markerDeleteAll(marker_num)
 
     def set_line_highlight(self, line_num):
         if line_num not in self.highlighted_lines:
@@ -178,16 +219,39 @@ class Editor(Qsci.QsciScintilla):
         return id(self) == id(other)
 
 
-class QConditionInputDialog:
+class QBreakpointInputDialog(QDialog):
     def __init__(self, parentWidget):
-        self.parentWidget = parentWidget
+        super().__init__(parentWidget)
+        self.setWindowTitle('Set breakpoint')
+        self.condition = QLineEdit(self)
+        self.ignore_count = QSpinBox(self)
+        self.ignore_count.setRange(0, 2 ** 31 - 1)
+        self.every_nth_hit = QSpinBox(self)
+        self.every_nth_hit.setRange(1, 2 ** 31 - 1)
+        self.log_message = QLineEdit(self)
+        self.log_message.setPlaceholderText('Log {expression} and continue')
+        buttonBox = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        layout = QFormLayout(self)
+        layout.addRow('Condition:', self.condition)
+        layout.addRow('Ignore first hits:', self.ignore_count)
+        layout.addRow('Stop every Nth hit:', self.every_nth_hit)
+        layout.addRow('Log message:', self.log_message)
+        layout.addWidget(buttonBox)
+        buttonBox.accepted.connect(self.accept)
+        buttonBox.rejected.connect(self.reject)
 
     def readline(self):
-        text, ok = QInputDialog.getText(self.parentWidget, 'Set condition',
-                                        'Condition:')
+        if not self.exec():
+            return False, None, 0, None, None
+        text = self.condition.text()
         if not len(text):
             text = None
-        if ok:
-            return True, text
-        else:
-            return False, None
+        every_nth_hit = self.every_nth_hit.value()
+        if every_nth_hit == 1:
+            every_nth_hit = None
+        log_message = self.log_message.text()
+        if not len(log_message):
+            log_message = None
+        return (True, text, self.ignore_count.value(), every_nth_hit,
+                log_message)
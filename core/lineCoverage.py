@@ -0,0 +1,159 @@
+import array
+import datetime
+import dis
+import json
+import math
+import sqlite3
+import types
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.sourceCache import source_cache
+
+# Version of the data file schema of coverage.py 5 to 7
+COVERAGE_SCHEMA_VERSION = 7
+COVERAGE_SCHEMA = '''
+CREATE TABLE coverage_schema (version integer);
+CREATE TABLE meta (key text, value text, unique (key));
+CREATE TABLE file (id integer primary key, path text, unique (path));
+CREATE TABLE context (id integer primary key, context text,
+                      unique (context));
+CREATE TABLE line_bits (file_id integer, context_id integer, numbits blob,
+                        foreign key (file_id) references file (id),
+                        foreign key (context_id) references context (id),
+                        unique (file_id, context_id));
+CREATE TABLE arc (file_id integer, context_id integer, fromno integer,
+                  tono integer,
+                  foreign key (file_id) references file (id),
+                  foreign key (context_id) references context (id),
+                  unique (file_id, context_id, fromno, tono));
+CREATE TABLE tracer (file_id integer primary key, tracer text,
+                     foreign key (file_id) references file (id));
+'''
+HEAT_LEVELS = 4
+
+
+class LineCoverage:
+    """Hit counts of the lines run by the debugger.
+
+    Every code object gets an array of counters, one per line from its first
+    to its last line, so counting a hit is a dict lookup and an increment.
+    Hits of lines run at the same time by several threads may be lost.
+    """
+
+    def __init__(self):
+        # Keyed by id, hashing a code object hashes all its constants. The
+        # code object is kept in the value so its id is not reused.
+        self.counters = dict()
+
+    def hit(self, code, line_number):
+        cached = self.counters.get(id(code))
+        if cached is None or cached[0] is not code:
+            cached = self.add_code(code)
+        cached[2][line_number - cached[1]] += 1
+
+    def add_code(self, code):
+        lines = [line for _, line in dis.findlinestarts(code) if line]
+        first_line = min(lines, default=code.co_firstlineno)
+        last_line = max(lines, default=code.co_firstlineno)
+        cached = (code, first_line,
+                  array.array('Q', bytes(8 * (last_line - first_line + 1))))
+        self.counters[id(code)] = cached
+        return cached
+
+    def get_line_hits(self):
+        # Lines of several code objects of a file are summed, a lambda on
+        # the line of a statement counts both
+        line_hits = dict()
+        for code, first_line, counters in list(self.counters.values()):
+            file_hits = line_hits.setdefault(code.co_filename, dict())
+            for line_number, hits in enumerate(counters, first_line):
+                if hits:
+                    file_hits[line_number] = \
+                        file_hits.get(line_number, 0) + hits
+        return line_hits
+
+    def clear(self):
+        self.counters.clear()
+
+    def write_json(self, filename):
+        report = dict()
+        for path, file_hits in sorted(self.get_line_hits().items()):
+            executable_lines = get_executable_lines(path)
+            report[path] = {
+                'hits': {str(line): hits
+                         for line, hits in sorted(file_hits.items())},
+                'missing_lines': sorted(executable_lines - set(file_hits)),
+            }
+        with open(filename, 'w', encoding='utf8') as file:
+            json.dump({'files': report}, file, indent=1)
+
+    def write_coverage_data(self, filename):
+        # A coverage.py data file, coverage report and coverage html read it
+        if os.path.exists(filename):
+            os.remove(filename)
+        connection = sqlite3.connect(filename)
+        try:
+            with connection:
+                connection.executescript(COVERAGE_SCHEMA)
+                connection.execute('INSERT INTO coverage_schema VALUES (?)',
+                                   (COVERAGE_SCHEMA_VERSION,))
+                connection.executemany(
+                    'INSERT INTO meta VALUES (?, ?)',
+                    [('has_arcs', '0'), ('version', 'python-debugger'),
+                     ('when', datetime.datetime.now().strftime(
+                         '%Y-%m-%d %H:%M:%S'))])
+                connection.execute('INSERT INTO context VALUES (1, ?)',
+                                   ('',))
+                for file_id, (path, file_hits) in enumerate(
+                        sorted(self.get_line_hits().items()), 1):
+                    connection.execute('INSERT INTO file VALUES (?, ?)',
+                                       (file_id, os.path.abspath(path)))
+                    connection.execute(
+                        'INSERT INTO line_bits VALUES (?, 1, ?)',
+                        (file_id, get_numbits(file_hits)))
+        finally:
+            connection.close()
+
+
+def get_numbits(line_numbers):
+    # Bit n of the blob is set when line n was run
+    numbits = bytearray(max(line_numbers, default=0) // 8 + 1)
+    for line_number in line_numbers:
+        numbits[line_number // 8] |= 1 << (line_number % 8)
+    return bytes(numbits)
+
+
+def get_executable_lines(filename):
+    # Lines of every code object in the file, functions that never ran too
+    try:
+        code = compile(source_cache.get_source(filename), filename, 'exec')
+    except BaseException:
+        return set()
+    lines = set()
+    codes = [code]
+    while codes:
+        code = codes.pop()
+        lines.update(line for _, line in dis.findlinestarts(code) if line)
+        codes.extend(const for const in code.co_consts
+                     if isinstance(const, types.CodeType))
+    return lines
+
+
+def get_heat_levels(file_hits, executable_lines, levels=HEAT_LEVELS):
+    # 0 for lines that did not run, then 1 to levels on a log scale of the
+    # hits (or times), so a hot loop does not make every other line look
+    # cold
+    heat_levels = {line: 0 for line in executable_lines
+                   if line not in file_hits}
+    max_hits = max(file_hits.values(), default=0)
+    for line, hits in file_hits.items():
+        if max_hits <= 1:
+            heat_levels[line] = levels
+        else:
+            heat_levels[line] = 1 + int(
+                (levels - 1) * math.log(max(hits, 1)) / math.log(max_hits))
+    return heat_levels
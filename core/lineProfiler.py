@@ -0,0 +1,293 @@
+import array
+import dis
+import json
+import marshal
+import threading
+import time
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class CallNode:
+    """A function in the call tree, under the function that called it"""
+
+    __slots__ = ('code', 'children', 'self_ns', 'calls')
+
+    def __init__(self, code):
+        self.code = code
+        self.children = dict()
+        self.self_ns = 0
+        self.calls = 0
+
+    def get_child(self, code):
+        child = self.children.get(id(code))
+        if child is None:
+            child = CallNode(code)
+            self.children[id(code)] = child
+        return child
+
+
+class FunctionStats:
+    def __init__(self, code):
+        self.code = code
+        self.calls = 0
+        # Calls that were not inside another call of the same function
+        self.primitive_calls = 0
+        self.exclusive_ns = 0
+        self.inclusive_ns = 0
+        self.callers = dict()
+        self.active_calls = 0
+
+
+class ThreadProfile:
+    def __init__(self):
+        # Entries are [frame, stats, node, start_ns, exclusive_ns, caller]
+        self.stack = []
+        self.frames = dict()
+        self.root = CallNode(None)
+        self.line = None
+        self.last_ns = None
+
+
+class ThreadEnd:
+    """Kept in thread local data, it is dropped when its thread ends"""
+
+    __slots__ = ('profiler', 'thread_id')
+
+    def __init__(self, profiler, thread_id):
+        self.profiler = profiler
+        self.thread_id = thread_id
+
+    def __del__(self):
+        self.profiler.close(self.thread_id)
+
+
+class LineProfiler:
+    """Time spent on every line and in every function of the program.
+
+    The time from one line event of a thread to its next one is spent on
+    the first line. A shadow stack of the instrumented frames gives the
+    exclusive and inclusive time of functions; time in code that is not
+    instrumented counts for the line that called it. The last line of a
+    thread runs until the thread ends. The time taken by the profiler itself
+    is left out, the call to the debugger is not.
+    """
+
+    def __init__(self):
+        # Keyed by id, hashing a code object hashes all its constants. The
+        # code object is kept in the value so its id is not reused.
+        self.line_times = dict()
+        self.functions = dict()
+        # Profiles of the running threads, and of all threads in order
+        self.threads = dict()
+        self.thread_profiles = []
+        self.thread_local = threading.local()
+        self.lock = threading.Lock()
+
+    def line(self, frame, line_number):
+        now = time.perf_counter_ns()
+        thread = self.threads.get(threading.get_ident())
+        if thread is None:
+            thread = ThreadProfile()
+            self.threads[threading.get_ident()] = thread
+            self.thread_profiles.append(thread)
+            # Threads that end before the program stop their timer then
+            self.thread_local.end = ThreadEnd(self, threading.get_ident())
+        stack = thread.stack
+        if thread.line is not None:
+            elapsed = now - thread.last_ns
+            times, index = thread.line
+            times[index] += elapsed
+            stack[-1][4] += elapsed
+        if not stack or stack[-1][0] is not frame:
+            self.update_stack(thread, frame, now)
+        code = frame.f_code
+        cached = self.line_times.get(id(code))
+        if cached is None or cached[0] is not code:
+            cached = self.add_code(code)
+        index = 2 * (line_number - cached[1])
+        cached[2][index + 1] += 1
+        thread.line = (cached[2], index)
+        thread.last_ns = time.perf_counter_ns()
+
+    def update_stack(self, thread, frame, now):
+        # Frames are matched against the shadow stack, returns are noticed
+        # on the next line of a caller. Frames between a new frame and the
+        # innermost known one are not instrumented.
+        current_frame = frame
+        while current_frame is not None and \
+                current_frame not in thread.frames:
+            current_frame = current_frame.f_back
+        if current_frame is not None:
+            depth = thread.frames[current_frame] + 1
+        else:
+            depth = 0
+        while len(thread.stack) > depth:
+            self.pop(thread, now)
+        if current_frame is not frame:
+            self.push(thread, frame, now)
+
+    def push(self, thread, frame, now):
+        code = frame.f_code
+        stats = self.functions.get(id(code))
+        if stats is None or stats.code is not code:
+            stats = FunctionStats(code)
+            self.functions[id(code)] = stats
+        stats.calls += 1
+        if not stats.active_calls:
+            stats.primitive_calls += 1
+        stats.active_calls += 1
+        if thread.stack:
+            caller = thread.stack[-1]
+            node = caller[2].get_child(code)
+        else:
+            caller = None
+            node = thread.root.get_child(code)
+        node.calls += 1
+        thread.frames[frame] = len(thread.stack)
+        thread.stack.append([frame, stats, node, now, 0, caller])
+
+    def pop(self, thread, now):
+        frame, stats, node, start_ns, exclusive_ns, caller = \
+            thread.stack.pop()
+        del thread.frames[frame]
+        inclusive_ns = now - start_ns
+        stats.active_calls -= 1
+        stats.exclusive_ns += exclusive_ns
+        # Recursive calls are inside the outermost one
+        is_primitive = not stats.active_calls
+        if is_primitive:
+            stats.inclusive_ns += inclusive_ns
+        node.self_ns += exclusive_ns
+        if caller is not None:
+            edge = stats.callers.setdefault(id(caller[1].code),
+                                            [caller[1].code, 0, 0, 0, 0])
+            edge[1] += is_primitive
+            edge[2] += 1
+            edge[3] += exclusive_ns
+            edge[4] += inclusive_ns if is_primitive else 0
+
+    def add_code(self, code):
+        # Pairs of (time, hits) for every line from the first to the last
+        lines = [line for _, line in dis.findlinestarts(code) if line]
+        first_line = min(lines, default=code.co_firstlineno)
+        last_line = max(lines, default=code.co_firstlineno)
+        cached = (code, first_line, array.array(
+            'Q', bytes(16 * (last_line - first_line + 1))))
+        self.line_times[id(code)] = cached
+        return cached
+
+    def restart_timer(self):
+        # Time spent stopped in the debugger is not the program's
+        thread = self.threads.get(threading.get_ident())
+        if thread is not None:
+            thread.last_ns = time.perf_counter_ns()
+
+    def close(self, thread_id):
+        # The last line and the open frames of the thread end now, a new
+        # thread with the same id gets a new profile
+        with self.lock:
+            now = time.perf_counter_ns()
+            thread = self.threads.pop(thread_id, None)
+            if thread is None:
+                return
+            if thread.line is not None:
+                times, index = thread.line
+                elapsed = now - thread.last_ns
+                times[index] += elapsed
+                thread.stack[-1][4] += elapsed
+                thread.line = None
+            while thread.stack:
+                self.pop(thread, now)
+
+    def finish(self):
+        for thread_id in list(self.threads):
+            self.close(thread_id)
+
+    def get_line_times(self):
+        # {filename: {line: (time_ns, hits)}}
+        line_times = dict()
+        for code, first_line, times in list(self.line_times.values()):
+            file_times = line_times.setdefault(code.co_filename, dict())
+            for index in range(0, len(times), 2):
+                if times[index + 1]:
+                    line_number = first_line + index // 2
+                    time_ns, hits = file_times.get(line_number, (0, 0))
+                    file_times[line_number] = (time_ns + times[index],
+                                               hits + times[index + 1])
+        return line_times
+
+    def get_function_stats(self):
+        return sorted(self.functions.values(),
+                      key=lambda stats: stats.exclusive_ns, reverse=True)
+
+    def write_pstats(self, filename):
+        # The marshal format of cProfile, pstats.Stats(filename) reads it
+        stats = dict()
+        for function in self.functions.values():
+            callers = {
+                get_function_key(caller_code): (
+                    primitive_calls, calls, exclusive_ns / 1e9,
+                    inclusive_ns / 1e9)
+                for caller_code, primitive_calls, calls, exclusive_ns,
+                inclusive_ns in function.callers.values()}
+            stats[get_function_key(function.code)] = (
+                function.primitive_calls, function.calls,
+                function.exclusive_ns / 1e9, function.inclusive_ns / 1e9,
+                callers)
+        with open(filename, 'wb') as file:
+            marshal.dump(stats, file)
+
+    def write_speedscope(self, filename, name='python-debugger'):
+        # A sampled profile with one sample per call path, weighted by the
+        # time spent in its last function
+        write_speedscope(filename, [thread.root
+                                    for thread in self.thread_profiles],
+                         name)
+
+
+def write_speedscope(filename, roots, name='python-debugger'):
+    # One profile per call tree, the self_ns of every CallNode is the weight
+    # of the path leading to it
+    frames = []
+    frame_indexes = dict()
+    profiles = []
+    for root_index, root in enumerate(roots):
+        samples = []
+        weights = []
+        paths = [(child, ()) for child in root.children.values()]
+        while paths:
+            node, path = paths.pop()
+            code = node.code
+            if id(code) not in frame_indexes:
+                frame_indexes[id(code)] = len(frames)
+                frames.append({'name': code.co_name,
+                               'file': code.co_filename,
+                               'line': code.co_firstlineno})
+            path = path + (frame_indexes[id(code)],)
+            if node.self_ns:
+                samples.append(list(path))
+                weights.append(node.self_ns)
+            paths.extend((child, path) for child in node.children.values())
+        profiles.append({'type': 'sampled',
+                         'name': '{} thread {}'.format(name, root_index),
+                         'unit': 'nanoseconds',
+                         'startValue': 0,
+                         'endValue': sum(weights),
+                         'samples': samples,
+                         'weights': weights})
+    with open(filename, 'w', encoding='utf8') as file:
+        json.dump({'$schema': SPEEDSCOPE_SCHEMA,
+                   'shared': {'frames': frames},
+                   'profiles': profiles,
+                   'name': name,
+                   'exporter': 'python-debugger'}, file)
+
+
+def get_function_key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
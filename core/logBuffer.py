@@ -0,0 +1,48 @@
+import collections
+import threading
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+DEFAULT_MAX_RECORDS = 10000
+DEFAULT_BATCH_SIZE = 100
+
+
+class LogBuffer:
+    """Bounded ring buffer of logpoint messages.
+
+    Messages are written to output in batches of batch_size. Without output
+    only the last max_records messages are kept and older ones are counted
+    as dropped.
+    """
+
+    def __init__(self, output=None, max_records=DEFAULT_MAX_RECORDS,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.output = output
+        self.records = collections.deque(maxlen=max_records)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def append(self, message):
+        with self.lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(message)
+            if self.output is None or len(self.records) < self.batch_size:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.output is None or not self.records:
+                return
+            records = list(self.records)
+            self.records.clear()
+        self.output.write('\n'.join(records) + '\n')
+
+    def get_records(self):
+        with self.lock:
+            return list(self.records)
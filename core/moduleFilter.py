@@ -0,0 +1,92 @@
+import fnmatch
+import site
+import sysconfig
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+
+def get_standard_library_directories():
+    paths = sysconfig.get_paths()
+    return {os.path.normcase(os.path.abspath(paths[name]))
+            for name in ('stdlib', 'platstdlib') if name in paths}
+
+
+def get_site_packages_directories():
+    paths = sysconfig.get_paths()
+    directories = [paths[name] for name in ('purelib', 'platlib')
+                   if name in paths]
+    if hasattr(site, 'getsitepackages'):
+        directories.extend(site.getsitepackages())
+    if hasattr(site, 'getusersitepackages'):
+        directories.append(site.getusersitepackages())
+    return {os.path.normcase(os.path.abspath(directory))
+            for directory in directories}
+
+
+def is_in_directories(filename, directories):
+    filename = os.path.normcase(os.path.abspath(filename))
+    return any(filename.startswith(directory + os.sep)
+               for directory in directories)
+
+
+def get_module_name(filename):
+    filename = os.path.abspath(filename)
+    entries = sorted((os.path.abspath(entry or os.getcwd())
+                      for entry in sys.path), key=len, reverse=True)
+    for entry in entries:
+        if filename.startswith(entry + os.sep):
+            name = os.path.splitext(filename[len(entry) + 1:])[0]
+            parts = name.split(os.sep)
+            if parts[-1] == '__init__':
+                parts.pop()
+            return '.'.join(parts)
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+class ModuleFilter:
+    """Decides which imported modules are instrumented.
+
+    include and exclude are glob patterns matched against the module name
+    and the names of its parent packages, so 'requests' or 'requests.*'
+    match every module of the requests package. include wins over exclude,
+    exclude wins over the standard library and site-packages defaults.
+    """
+
+    def __init__(self, include=None, exclude=None, skip_stdlib=True,
+                 skip_site_packages=True):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.skip_stdlib = skip_stdlib
+        self.skip_site_packages = skip_site_packages
+        self.stdlib_directories = get_standard_library_directories()
+        self.site_packages_directories = get_site_packages_directories()
+        self.included_files = dict()
+
+    def matches(self, fullname, patterns):
+        parts = fullname.split('.')
+        names = ['.'.join(parts[:index]) for index in range(1, len(parts) + 1)]
+        return any(fnmatch.fnmatchcase(name, pattern)
+                   for pattern in patterns for name in names)
+
+    def is_included(self, fullname, filename):
+        if self.matches(fullname, self.include):
+            return True
+        if self.matches(fullname, self.exclude):
+            return False
+        if is_in_directories(filename, self.site_packages_directories):
+            return not self.skip_site_packages
+        if is_in_directories(filename, self.stdlib_directories):
+            return not self.skip_stdlib
+        return True
+
+    def include_file(self, filename):
+        self.included_files[filename] = True
+
+    def is_file_included(self, filename):
+        if filename not in self.included_files:
+            self.included_files[filename] = self.is_included(
+                get_module_name(filename), filename)
+        return self.included_files[filename]
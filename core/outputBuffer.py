@@ -0,0 +1,97 @@
+import threading
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+DEFAULT_FLUSH_SIZE = 64 * 1024
+DEFAULT_MAX_PENDING = 1024 * 1024
+
+
+class OutputBuffer:
+    """Program output collected between flushes.
+
+    write is called by the debuggee threads and only appends the text.
+    flush hands the pending text to output(text, stream) in one call per
+    run of writes to the same stream, and copies it to the spool file if
+    one is open. Once flush_size characters are pending on_full is called
+    to ask for a flush, or the writer flushes itself without on_full.
+    Writers wait while max_pending characters are pending, so output that
+    comes faster than it is shown does not pile up in memory; the thread
+    that answers on_full (flush_thread_id) flushes itself instead.
+    """
+
+    def __init__(self, output, flush_size=DEFAULT_FLUSH_SIZE,
+                 max_pending=DEFAULT_MAX_PENDING, on_full=None,
+                 flush_thread_id=None):
+        self.output = output
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.on_full = on_full
+        self.pending = []
+        self.pending_size = 0
+        self.flush_requested = False
+        self.spool_file = None
+        self.condition = threading.Condition()
+        # Keeps the order of the flushed text between flushing threads
+        self.flush_lock = threading.Lock()
+        self.flush_thread_id = flush_thread_id
+
+    def write(self, text, stream=None):
+        if not text:
+            return
+        flush_now = request_flush = False
+        with self.condition:
+            while (self.pending_size >= self.max_pending and
+                   self.on_full is not None and
+                   threading.get_ident() != self.flush_thread_id):
+                self.condition.wait()
+            self.pending.append((text, stream))
+            self.pending_size += len(text)
+            if self.pending_size >= self.flush_size:
+                if self.on_full is None or \
+                        threading.get_ident() == self.flush_thread_id:
+                    flush_now = True
+                elif not self.flush_requested:
+                    self.flush_requested = request_flush = True
+        if flush_now:
+            self.flush()
+        elif request_flush:
+            self.on_full()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.condition:
+                pending = self.pending
+                self.pending = []
+                self.pending_size = 0
+                self.flush_requested = False
+                self.condition.notify_all()
+            for text, stream in join_writes(pending):
+                if self.spool_file is not None:
+                    self.spool_file.write(text)
+                self.output(text, stream)
+            if self.spool_file is not None:
+                self.spool_file.flush()
+
+    def open_spool(self, filename):
+        self.close_spool()
+        self.spool_file = open(filename, 'w', encoding='utf8',
+                               errors='replace')
+
+    def close_spool(self):
+        self.flush()
+        if self.spool_file is not None:
+            self.spool_file.close()
+            self.spool_file = None
+
+
+def join_writes(writes):
+    chunks = []
+    for text, stream in writes:
+        if chunks and chunks[-1][1] == stream:
+            chunks[-1][0].append(text)
+        else:
+            chunks.append(([text], stream))
+    return [(''.join(texts), stream) for texts, stream in chunks]
@@ -0,0 +1,391 @@
+import array
+import bisect
+import marshal
+import mmap
+import struct
+import threading
+import types
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.variables import get_scope_names, get_value_repr
+
+MAGIC = b'PDBREC1\0'
+FILE_HEADER = struct.Struct('<8sQ')
+RECORD_HEADER = struct.Struct('<IB')
+INITIAL_SIZE = 1024 * 1024
+DEFAULT_SNAPSHOT_INTERVAL = 1000
+MAX_RECORDED_REPR_LENGTH = 200
+
+EVENT_CODE = 1
+EVENT_THREAD = 2
+EVENT_CALL = 3
+EVENT_RETURN = 4
+EVENT_LOCALS = 5
+EVENT_LINE = 6
+EVENT_SNAPSHOT = 7
+
+# Values of these types are not mutated in place, a local still bound to the
+# same one does not need a new repr
+IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, range,
+                   type, types.ModuleType, types.FunctionType,
+                   types.BuiltinFunctionType, types.MethodType)
+
+
+class RecordingIndex:
+    """Where snapshots are in a recording, and the tables its events use"""
+
+    def __init__(self):
+        self.codes = dict()
+        self.thread_names = dict()
+        self.snapshot_positions = array.array('Q')
+        self.snapshot_offsets = array.array('Q')
+        self.line_count = 0
+
+
+class RecordedFrame:
+    def __init__(self, code_index, line_number, local_reprs=None):
+        self.code_index = code_index
+        self.line_number = line_number
+        self.local_reprs = local_reprs if local_reprs is not None else dict()
+        # Values whose repr is in local_reprs, only immutable ones are kept
+        self.local_values = dict()
+
+
+class Recorder:
+    """Appends the execution of the debuggee to a memory mapped file.
+
+    Every line event is preceded by the calls and returns since the previous
+    line of its thread and by the locals of the current frame that changed,
+    as reprs. Every snapshot_interval lines a snapshot of all recorded
+    stacks is written, so a replay seeks from the nearest one.
+    """
+
+    def __init__(self, filename, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 hidden=()):
+        if snapshot_interval < 1:
+            raise ValueError('Wrong snapshot interval')
+        self.filename = filename
+        self.snapshot_interval = snapshot_interval
+        self.hidden = frozenset(hidden)
+        # A symlink planted at the path is not followed, and the recorded
+        # values are only readable by the user
+        self.file = os.fdopen(os.open(
+            filename, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0),
+            0o600), 'r+b')
+        self.file.truncate(0)
+        self.file.truncate(INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), INITIAL_SIZE)
+        self.end = FILE_HEADER.size
+        FILE_HEADER.pack_into(self.map, 0, MAGIC, self.end)
+        self.index = RecordingIndex()
+        # Code objects are keyed by id, hashing one hashes all its constants
+        self.code_indexes = dict()
+        self.thread_indexes = dict()
+        self.stacks = dict()
+        self.lock = threading.Lock()
+
+    def record_line(self, thread, line_number):
+        with self.lock:
+            if self.map is None:
+                return
+            thread_index = self.thread_indexes.get(thread.thread_id)
+            if thread_index is None:
+                thread_index = self.add_thread(thread)
+            self.record_stack_changes(thread_index, thread.frame_stack)
+            recorded_frame = self.stacks[thread_index][-1][1]
+            self.record_locals(thread_index, recorded_frame, thread.frame)
+            recorded_frame.line_number = line_number
+            self.append(EVENT_LINE, (thread_index, line_number))
+            self.index.line_count += 1
+            if self.index.line_count % self.snapshot_interval == 0:
+                self.append_snapshot(thread_index)
+
+    def add_thread(self, thread):
+        thread_index = len(self.thread_indexes)
+        self.thread_indexes[thread.thread_id] = thread_index
+        self.index.thread_names[thread_index] = thread.name
+        self.stacks[thread_index] = []
+        self.append(EVENT_THREAD, (thread_index, thread.name))
+        return thread_index
+
+    def record_stack_changes(self, thread_index, frame_stack):
+        # Stacks only differ by the frames called or returned from since
+        # the previous line of the thread
+        stack = self.stacks[thread_index]
+        common = 0
+        if len(stack) == len(frame_stack) and stack and \
+                stack[-1][0] is frame_stack[-1]:
+            return
+        while (common < len(stack) and common < len(frame_stack) and
+               stack[common][0] is frame_stack[common]):
+            common += 1
+        while len(stack) > common:
+            stack.pop()
+            self.append(EVENT_RETURN, (thread_index,))
+        for frame in frame_stack[common:]:
+            code_index = self.get_code_index(frame.f_code)
+            stack.append((frame, RecordedFrame(code_index, frame.f_lineno)))
+            self.append(EVENT_CALL, (thread_index, code_index,
+                                     frame.f_lineno))
+            if frame is not frame_stack[-1]:
+                # Frames outside of instrumented code have no line events
+                self.record_locals(thread_index, stack[-1][1], frame)
+
+    def get_code_index(self, code):
+        cached = self.code_indexes.get(id(code))
+        if cached is None or cached[0] is not code:
+            code_index = len(self.index.codes)
+            description = (code.co_filename, code.co_name,
+                           code.co_firstlineno)
+            self.index.codes[code_index] = description
+            self.append(EVENT_CODE, (code_index,) + description)
+            cached = (code, code_index)
+            self.code_indexes[id(code)] = cached
+        return cached[1]
+
+    def record_locals(self, thread_index, recorded_frame, frame):
+        scope = frame.f_locals
+        local_reprs = recorded_frame.local_reprs
+        local_values = recorded_frame.local_values
+        changed = []
+        for name in get_scope_names(scope, self.hidden):
+            value = scope[name]
+            if name in local_values and local_values[name] is value:
+                continue
+            value_repr = get_value_repr(value, MAX_RECORDED_REPR_LENGTH)
+            if isinstance(value, IMMUTABLE_TYPES):
+                local_values[name] = value
+            else:
+                local_values.pop(name, None)
+            if local_reprs.get(name) != value_repr:
+                local_reprs[name] = value_repr
+                changed.append((name, value_repr))
+        deleted = tuple(name for name in local_reprs if name not in scope)
+        for name in deleted:
+            del local_reprs[name]
+            local_values.pop(name, None)
+        if changed or deleted:
+            self.append(EVENT_LOCALS, (thread_index, tuple(changed),
+                                       deleted))
+
+    def append_snapshot(self, thread_index):
+        stacks = tuple(
+            (index, tuple((recorded.code_index, recorded.line_number,
+                           tuple(recorded.local_reprs.items()))
+                          for _, recorded in stack))
+            for index, stack in self.stacks.items())
+        self.index.snapshot_positions.append(self.index.line_count - 1)
+        self.index.snapshot_offsets.append(self.end)
+        self.append(EVENT_SNAPSHOT, (self.index.line_count - 1, thread_index,
+                                     stacks))
+
+    def append(self, event_type, payload):
+        data = marshal.dumps(payload)
+        size = RECORD_HEADER.size + len(data)
+        if self.end + size > len(self.map):
+            self.map.resize(max(len(self.map) * 2, self.end + size))
+        RECORD_HEADER.pack_into(self.map, self.end, len(data), event_type)
+        start = self.end + RECORD_HEADER.size
+        self.map[start:start + len(data)] = data
+        self.end += size
+        # The header always tells how much of the file is written
+        FILE_HEADER.pack_into(self.map, 0, MAGIC, self.end)
+
+    def get_replay(self):
+        # Replays the recording so far, recording goes on meanwhile
+        with self.lock:
+            if self.map is None:
+                return Replay.open(self.filename)
+            self.map.flush()
+            # The file only grows while recording, a second read only map
+            # sees the events written so far without copying them
+            data = mmap.mmap(self.file.fileno(), self.end,
+                             access=mmap.ACCESS_READ)
+            index = RecordingIndex()
+            index.codes = dict(self.index.codes)
+            index.thread_names = dict(self.index.thread_names)
+            index.snapshot_positions = array.array(
+                'Q', self.index.snapshot_positions)
+            index.snapshot_offsets = array.array(
+                'Q', self.index.snapshot_offsets)
+            index.line_count = self.index.line_count
+            return Replay(data, index)
+
+    def close(self):
+        with self.lock:
+            if self.map is None:
+                return
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            self.file.truncate(self.end)
+            self.file.close()
+            self.stacks.clear()
+
+
+class RecordedValue:
+    """A recorded repr, shown as is"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+
+class ReplayFrame:
+    def __init__(self, filename, name, line_number, local_reprs):
+        self.filename = filename
+        self.name = name
+        self.line_number = line_number
+        self.local_reprs = local_reprs
+
+    @property
+    def f_locals(self):
+        # Shown in place of the locals of a frame
+        return {name: RecordedValue(text)
+                for name, text in self.local_reprs.items()}
+
+
+class Replay:
+    """Moves through a recording without running the program.
+
+    Positions are the recorded lines, 0 to line_count - 1. Seeking restores
+    the nearest snapshot before the position and applies the events after
+    it.
+    """
+
+    def __init__(self, data, index=None):
+        self.data = data
+        self.end = FILE_HEADER.unpack_from(data, 0)[1] \
+            if len(data) >= FILE_HEADER.size else 0
+        if len(data) < FILE_HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a recording')
+        self.index = index if index is not None else self.read_index()
+        self.position = None
+        # Offset of the first event after the current position
+        self.offset = None
+        self.thread_index = None
+        self.stacks = dict()
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read_index(self):
+        index = RecordingIndex()
+        for offset, event_type, payload_start, payload_end in \
+                self.read_records(FILE_HEADER.size):
+            if event_type == EVENT_LINE:
+                index.line_count += 1
+            elif event_type in (EVENT_CODE, EVENT_THREAD):
+                payload = marshal.loads(self.data[payload_start:payload_end])
+                if event_type == EVENT_CODE:
+                    index.codes[payload[0]] = payload[1:]
+                else:
+                    index.thread_names[payload[0]] = payload[1]
+            elif event_type == EVENT_SNAPSHOT:
+                index.snapshot_positions.append(index.line_count - 1)
+                index.snapshot_offsets.append(offset)
+        return index
+
+    def read_records(self, offset):
+        while offset + RECORD_HEADER.size <= self.end:
+            size, event_type = RECORD_HEADER.unpack_from(self.data, offset)
+            payload_start = offset + RECORD_HEADER.size
+            yield offset, event_type, payload_start, payload_start + size
+            offset = payload_start + size
+
+    @property
+    def line_count(self):
+        return self.index.line_count
+
+    def seek(self, position):
+        if not 0 <= position < self.line_count:
+            raise IndexError(position)
+        snapshot = bisect.bisect_right(self.index.snapshot_positions,
+                                       position) - 1
+        snapshot_position = -1
+        if snapshot >= 0:
+            snapshot_position = self.index.snapshot_positions[snapshot]
+        if (self.position is not None and
+                snapshot_position <= self.position < position):
+            # Stepping forward goes on from the current position
+            offset = self.offset
+            current_position = self.position
+        elif snapshot >= 0:
+            offset = self.index.snapshot_offsets[snapshot]
+            current_position = snapshot_position
+        else:
+            offset = FILE_HEADER.size
+            current_position = -1
+            self.stacks = dict()
+        self.offset = self.end
+        for offset, event_type, payload_start, payload_end in \
+                self.read_records(offset):
+            if current_position == position and event_type != EVENT_SNAPSHOT:
+                # Events after the line belong to the next position
+                self.offset = offset
+                break
+            if event_type in (EVENT_CODE, EVENT_THREAD):
+                continue
+            payload = marshal.loads(self.data[payload_start:payload_end])
+            if event_type == EVENT_SNAPSHOT:
+                self.restore_snapshot(payload)
+            elif event_type == EVENT_LINE:
+                thread_index, line_number = payload
+                self.stacks[thread_index][-1].line_number = line_number
+                self.thread_index = thread_index
+                current_position += 1
+            elif event_type == EVENT_CALL:
+                thread_index, code_index, line_number = payload
+                filename, name, _ = self.index.codes[code_index]
+                self.stacks.setdefault(thread_index, []).append(
+                    ReplayFrame(filename, name, line_number, dict()))
+            elif event_type == EVENT_RETURN:
+                self.stacks[payload[0]].pop()
+            elif event_type == EVENT_LOCALS:
+                thread_index, changed, deleted = payload
+                local_reprs = self.stacks[thread_index][-1].local_reprs
+                local_reprs.update(changed)
+                for name in deleted:
+                    del local_reprs[name]
+        self.position = position
+        return self.get_frame()
+
+    def restore_snapshot(self, payload):
+        _, self.thread_index, stacks = payload
+        self.stacks = dict()
+        for thread_index, frames in stacks:
+            self.stacks[thread_index] = [
+                ReplayFrame(*self.index.codes[code_index][:2], line_number,
+                            dict(local_reprs))
+                for code_index, line_number, local_reprs in frames]
+
+    def step_back(self):
+        if not self.position:
+            return None
+        return self.seek(self.position - 1)
+
+    def step_forward(self):
+        if self.position is None or self.position + 1 >= self.line_count:
+            return None
+        return self.seek(self.position + 1)
+
+    def get_frame(self):
+        stack = self.stacks.get(self.thread_index)
+        return stack[-1] if stack else None
+
+    def get_stacktrace(self):
+        # Innermost frame first, like Debugger.current_stacktrace
+        return list(reversed(self.stacks.get(self.thread_index, [])))
+
+    def get_thread_name(self):
+        return self.index.thread_names.get(self.thread_index)
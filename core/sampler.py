@@ -0,0 +1,196 @@
+import collections
+import threading
+import time
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.lineProfiler import CallNode, write_speedscope
+from core.tracingBackends import DEBUGGER_DIRECTORIES
+
+DEFAULT_INTERVAL = 0.005
+MAX_OVERHEAD = 0.02
+IGNORED_DIRECTORIES = tuple(os.path.abspath(directory) + os.sep
+                            for directory in DEBUGGER_DIRECTORIES)
+
+
+class Sampler:
+    """Samples the stacks of the program threads from a background thread.
+
+    sys._current_frames gives the innermost frame of every thread, the
+    stacks are added to a call tree per thread (CallNode.self_ns is the time
+    the samples stand for, calls the number of samples) and to sample counts
+    per line. The program itself runs unchanged. Taking a sample holds the
+    GIL, so the interval grows when sampling would take more than
+    max_overhead of the time.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, max_overhead=MAX_OVERHEAD):
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.roots = dict()
+        self.thread_names = dict()
+        self.line_samples = dict()
+        self.samples = 0
+        # Stacks added, one per sampled thread in every sample
+        self.stack_samples = 0
+        self.sampling_ns = 0
+        self.elapsed_ns = 0
+        self.excluded_thread_ids = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        # Keyed by id, the code object is kept in the value so its id is
+        # not reused
+        self.ignored_code = dict()
+
+    def start(self):
+        # Samples the calling thread and the threads it starts, not the
+        # threads that are already running
+        self.excluded_thread_ids = (set(sys._current_frames()) -
+                                    {threading.get_ident()})
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run,
+                                       name='python-debugger-sampler',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        interval = self.interval
+        last_ns = time.perf_counter_ns()
+        while not self.stop_event.wait(interval):
+            start_ns = time.perf_counter_ns()
+            self.sample(start_ns - last_ns)
+            last_ns = start_ns
+            sampling_ns = time.perf_counter_ns() - start_ns
+            self.sampling_ns += sampling_ns
+            interval = max(self.interval,
+                           sampling_ns / self.max_overhead / 10 ** 9)
+
+    def sample(self, elapsed_ns):
+        sampler_thread_id = threading.get_ident()
+        frames = sys._current_frames()
+        with self.lock:
+            self.samples += 1
+            self.elapsed_ns += elapsed_ns
+            for thread_id, frame in frames.items():
+                if (thread_id == sampler_thread_id or
+                        thread_id in self.excluded_thread_ids):
+                    continue
+                self.add_stack(thread_id, frame, elapsed_ns)
+
+    def add_stack(self, thread_id, frame, elapsed_ns):
+        stack = []
+        line_number = frame.f_lineno
+        while frame is not None:
+            code = frame.f_code
+            if self.is_ignored(code):
+                if not stack:
+                    # The thread is in the debugger, not in the program
+                    return
+                break
+            stack.append(code)
+            frame = frame.f_back
+        if not stack:
+            return
+        root = self.roots.get(thread_id)
+        if root is None:
+            root = CallNode(None)
+            self.roots[thread_id] = root
+            self.thread_names[thread_id] = get_thread_name(thread_id)
+        node = root
+        for code in reversed(stack):
+            node = node.get_child(code)
+            node.calls += 1
+        node.self_ns += elapsed_ns
+        self.stack_samples += 1
+        key = (stack[0].co_filename, line_number)
+        self.line_samples[key] = self.line_samples.get(key, 0) + 1
+
+    def is_ignored(self, code):
+        # Frames of the debugger below the program and of the threading
+        # module below thread targets are left out
+        cached = self.ignored_code.get(id(code))
+        if cached is None or cached[0] is not code:
+            filename = os.path.abspath(code.co_filename)
+            cached = (code, filename == threading.__file__ or
+                      filename.startswith(IGNORED_DIRECTORIES))
+            self.ignored_code[id(code)] = cached
+        return cached[1]
+
+    def get_hotspots(self, count=None):
+        # [(filename, line_number, samples)], the most sampled lines first
+        with self.lock:
+            hotspots = sorted(
+                ((filename, line_number, samples)
+                 for (filename, line_number), samples
+                 in self.line_samples.items()),
+                key=lambda hotspot: hotspot[2], reverse=True)
+        return hotspots[:count]
+
+    def get_function_samples(self):
+        # {code: (self samples, total samples)}, a recursive function counts
+        # once per sample in the total
+        function_samples = dict()
+        with self.lock:
+            for root in self.roots.values():
+                add_function_samples(root, function_samples)
+        return {code: (self_samples, total_samples)
+                for code, self_samples, total_samples
+                in function_samples.values()}
+
+    def get_overhead(self):
+        if not self.elapsed_ns:
+            return 0.0
+        return self.sampling_ns / self.elapsed_ns
+
+    def clear(self):
+        with self.lock:
+            self.roots.clear()
+            self.thread_names.clear()
+            self.line_samples.clear()
+            self.samples = 0
+            self.stack_samples = 0
+            self.sampling_ns = 0
+            self.elapsed_ns = 0
+
+    def write_speedscope(self, filename, name='python-debugger'):
+        with self.lock:
+            write_speedscope(filename, list(self.roots.values()), name)
+
+
+def add_function_samples(node, function_samples):
+    # Depth first without recursion, call trees are as deep as the program
+    # stacks. A function already on the path does not add to the total.
+    active_codes = collections.Counter()
+    nodes = [(child, False) for child in node.children.values()]
+    while nodes:
+        node, leaving = nodes.pop()
+        code = node.code
+        if leaving:
+            active_codes[id(code)] -= 1
+            continue
+        entry = function_samples.setdefault(id(code), [code, 0, 0])
+        # Samples that stopped in no deeper function
+        entry[1] += node.calls - sum(child.calls
+                                     for child in node.children.values())
+        if not active_codes[id(code)]:
+            entry[2] += node.calls
+        active_codes[id(code)] += 1
+        nodes.append((node, True))
+        nodes.extend((child, False) for child in node.children.values())
+
+
+def get_thread_name(thread_id):
+    for thread in threading.enumerate():
+        if thread.ident == thread_id:
+            return thread.name
+    return str(thread_id)
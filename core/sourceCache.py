@@ -0,0 +1,144 @@
+import array
+import collections
+import mmap
+import threading
+import tokenize
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+DEFAULT_MAX_SIZE = 128 * 1024 * 1024
+DEFAULT_MMAP_THRESHOLD = 1024 * 1024
+
+
+class SourceFile:
+    def __init__(self, filename, stat, mmap_threshold):
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.size = stat.st_size
+        self.data = b''
+        self.mapped = False
+        with open(filename, 'rb') as f:
+            if self.size >= mmap_threshold:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mapped = True
+            elif self.size:
+                self.data = f.read()
+        self.encoding = detect_encoding(self.data)
+        self.text = None
+        self.line_offsets = None
+
+    def get_text(self):
+        if self.text is None:
+            self.text = normalize_newlines(
+                self.data[:].decode(self.encoding))
+        return self.text
+
+    def get_line_offsets(self):
+        # Offsets of line starts, plus the end of the file
+        if self.line_offsets is None:
+            offsets = array.array('Q', [0])
+            position = self.data.find(b'\n')
+            while position != -1:
+                offsets.append(position + 1)
+                position = self.data.find(b'\n', position + 1)
+            if offsets[-1] != len(self.data):
+                offsets.append(len(self.data))
+            self.line_offsets = offsets
+        return self.line_offsets
+
+    def get_line_count(self):
+        return len(self.get_line_offsets()) - 1
+
+    def get_line(self, line_number):
+        offsets = self.get_line_offsets()
+        if not 1 <= line_number < len(offsets):
+            return ''
+        return normalize_newlines(self.data[offsets[line_number - 1]:
+                                            offsets[line_number]]
+                                  .decode(self.encoding))
+
+    def close(self):
+        if self.mapped:
+            self.data.close()
+
+
+class SourceCache:
+    """Source files shared by the debugger, its loader and the GUI.
+
+    Files are checked against their mtime and size on every access and read
+    again only when they change. Files bigger than mmap_threshold are memory
+    mapped. Least recently used files are dropped when the cache holds more
+    than max_size bytes.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE,
+                 mmap_threshold=DEFAULT_MMAP_THRESHOLD):
+        self.max_size = max_size
+        self.mmap_threshold = mmap_threshold
+        self.files = collections.OrderedDict()
+        self.current_size = 0
+        self.lock = threading.RLock()
+
+    def get_file(self, filename):
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        with self.lock:
+            source_file = self.files.get(filename)
+            if source_file is not None and \
+                    source_file.key == (stat.st_mtime_ns, stat.st_size):
+                self.files.move_to_end(filename)
+                return source_file
+            if source_file is not None:
+                self.remove(filename)
+            source_file = SourceFile(filename, stat, self.mmap_threshold)
+            self.files[filename] = source_file
+            self.current_size += source_file.size
+            while self.current_size > self.max_size and len(self.files) > 1:
+                self.remove(next(iter(self.files)))
+            return source_file
+
+    def remove(self, filename):
+        source_file = self.files.pop(filename)
+        self.current_size -= source_file.size
+        source_file.close()
+
+    def get_source(self, filename):
+        source_file = self.get_file(filename)
+        with self.lock:
+            return source_file.get_text()
+
+    def get_line(self, filename, line_number):
+        try:
+            source_file = self.get_file(filename)
+        except (OSError, ValueError):
+            return ''
+        with self.lock:
+            return source_file.get_line(line_number)
+
+    def get_line_count(self, filename):
+        source_file = self.get_file(filename)
+        with self.lock:
+            return source_file.get_line_count()
+
+    def clear(self):
+        with self.lock:
+            for filename in list(self.files):
+                self.remove(filename)
+
+
+def detect_encoding(data):
+    lines = data[:1024].splitlines(keepends=True)[:2]
+    try:
+        encoding, _ = tokenize.detect_encoding(iter(lines).__next__)
+    except (SyntaxError, StopIteration):
+        encoding = 'utf-8'
+    return encoding
+
+
+def normalize_newlines(text):
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+source_cache = SourceCache()
@@ -0,0 +1,388 @@
+import collections
+import gc
+import threading
+import types
+import sys
+import os
+import core.debugger as debugger
+import core.debuggerLoader as debuggerLoader
+from core.moduleFilter import ModuleFilter
+from core.sourceCache import source_cache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+DEBUGGER_DIRECTORIES = (
+    os.path.dirname(os.path.abspath(__file__)),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir,
+                 'utils'),
+)
+
+
+class TracingBackend:
+    """Connects a Debugger to the running program.
+
+    The debugger calls install before the program starts, load_code for
+    the main script source, breakpoints_changed when a breakpoint is added or
+    removed, watchpoints_changed when a watchpoint is added or removed, stop
+    when a thread stops, resume every time the program
+    continues after a stop and uninstall when debugging is over. The backend
+    has to call Debugger.debug_frame with the program frame, and the line
+    number when it is known, before a line is executed.
+    """
+
+    def __init__(self, debugger_instance, module_filter=None):
+        self.debugger = debugger_instance
+        self.module_filter = module_filter or ModuleFilter()
+
+    def install(self):
+        pass
+
+    def prepare_code(self, code):
+        return code
+
+    def load_code(self, source, filename):
+        return self.prepare_code(compile(source, filename, 'exec'))
+
+    def get_globals(self):
+        return dict()
+
+    def breakpoints_changed(self, filename, line_number):
+        pass
+
+    def watchpoints_changed(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def uninstall(self):
+        pass
+
+
+class BytecodeBackend(TracingBackend):
+    def __init__(self, debugger_instance, instrumentation_mode=None,
+                 code_cache=None, module_filter=None):
+        super().__init__(debugger_instance, module_filter)
+        self.instrumentation_mode = debugger.InstrumentationMode(
+            instrumentation_mode or debugger.InstrumentationMode.EveryLine)
+        self.code_cache = code_cache
+        self.instrumented_files = set()
+        self.code_table = dict()
+
+    def install(self):
+        debuggerLoader.install_custom_loader(self.debugger.debug,
+                                             self.load_code,
+                                             self.code_table,
+                                             self.module_filter)
+
+    def get_globals(self):
+        return {
+            'debug': self.debugger.debug,
+            'debug_code': self.code_table,
+        }
+
+    def get_patched_lines(self, filename):
+        if self.instrumentation_mode == debugger.InstrumentationMode.EveryLine:
+            return None
+        return self.debugger.get_breakpoint_lines(filename)
+
+    def prepare_code(self, code):
+        filename = code.co_filename
+        if self.instrumentation_mode == debugger.InstrumentationMode.EveryLine:
+            return debugger.modify_code(code)
+        for key in [key for key in self.code_table if key[0] == filename]:
+            del self.code_table[key]
+        self.instrumented_files.add(filename)
+        return debugger.modify_code(code, self.get_patched_lines(filename),
+                                    self.code_table)
+
+    def load_code(self, source, filename):
+        if self.code_cache is None:
+            return super().load_code(source, filename)
+        patched_lines = self.get_patched_lines(filename)
+        if patched_lines is not None:
+            patched_lines = sorted(patched_lines)
+        key = self.code_cache.get_key(
+            source, filename, (self.instrumentation_mode.name, patched_lines))
+        cached = self.code_cache.load(filename, key)
+        if cached is not None:
+            code, code_table = cached
+            if self.instrumentation_mode != \
+                    debugger.InstrumentationMode.EveryLine:
+                for table_key in [table_key for table_key in self.code_table
+                                  if table_key[0] == filename]:
+                    del self.code_table[table_key]
+                self.code_table.update(code_table)
+                self.instrumented_files.add(filename)
+            return code
+        code = super().load_code(source, filename)
+        code_table = {table_key: value
+                      for table_key, value in self.code_table.items()
+                      if table_key[0] == filename}
+        self.code_cache.store(filename, key, (code, code_table))
+        return code
+
+    def breakpoints_changed(self, filename, line_number):
+        # Only the innermost code object owning the line is rebuilt: its
+        # parents load it through code_table, so functions defined later pick
+        # up the new version, and functions already defined are swapped here.
+        # Frames that are already running keep their old code.
+        if filename not in self.instrumented_files:
+            return
+        try:
+            original_code = compile(source_cache.get_source(filename),
+                                    filename, 'exec')
+        except BaseException:
+            return
+        code_key, code = debugger.get_code_path(original_code,
+                                                line_number)[-1]
+        if code is original_code:
+            # Module level code is always patched on every line
+            return
+        old_code = self.code_table.get(code_key)
+        self.code_table[code_key] = debugger.modify_code(
+            code, self.get_patched_lines(filename), self.code_table, code_key)
+        if old_code is not None:
+            debugger.replace_function_code(old_code,
+                                           self.code_table[code_key])
+
+    def uninstall(self):
+        debuggerLoader.remove_custom_loader_and_invalidate_caches()
+
+
+class MonitoringBackend(TracingBackend):
+    """sys.monitoring (PEP 669) backend, requires Python 3.12+.
+
+    LINE events are enabled only for code objects with breakpoints, code
+    objects using the names of a watchpoint and code objects the user steps
+    through, and for all code while a thread steps or has to stop. Lines
+    that were checked and can not stop return DISABLE, and are enabled again
+    with restart_events when the user steps or changes a breakpoint.
+    """
+
+    def __init__(self, debugger_instance, instrumentation_mode=None,
+                 code_cache=None, module_filter=None):
+        super().__init__(debugger_instance, module_filter)
+        if not hasattr(sys, 'monitoring'):
+            raise RuntimeError('sys.monitoring requires Python 3.12+')
+        self.monitoring = sys.monitoring
+        self.events = sys.monitoring.events
+        self.tool_id = sys.monitoring.DEBUGGER_ID
+        self.code_objects = collections.defaultdict(set)
+        # Code objects are keyed by id, hashing one hashes all its constants
+        self.known_code_objects = dict()
+        self.step_code_objects = dict()
+        self.traced_code_objects = dict()
+        self.excluded_thread_ids = set()
+
+    def install(self):
+        # Threads running before the program, like the one controlling the
+        # debugger, are never paused
+        self.excluded_thread_ids = (set(sys._current_frames()) -
+                                    {threading.get_ident()})
+        self.monitoring.use_tool_id(self.tool_id, 'python-debugger')
+        self.monitoring.register_callback(self.tool_id, self.events.PY_START,
+                                          self.on_start)
+        self.monitoring.register_callback(self.tool_id, self.events.LINE,
+                                          self.on_line)
+        self.resume()
+
+    def prepare_code(self, code):
+        self.module_filter.include_file(code.co_filename)
+        self.register_code(code)
+        return code
+
+    def register_code(self, code):
+        self.known_code_objects[id(code)] = code
+        self.code_objects[code.co_filename].add(code)
+        self.update_local_events(code)
+        for const in code.co_consts:
+            if isinstance(const, type(code)):
+                self.register_code(const)
+
+    def update_local_events(self, code):
+        breakpoint_lines = self.debugger.get_breakpoint_lines(
+            code.co_filename)
+        if (id(code) in self.step_code_objects or
+                breakpoint_lines & debugger.get_own_lines(code) or
+                self.debugger.get_code_watchpoints(code)):
+            events = self.events.LINE
+        else:
+            events = self.events.NO_EVENTS
+        self.monitoring.set_local_events(self.tool_id, code, events)
+
+    def is_traced(self, code):
+        cached = self.traced_code_objects.get(id(code))
+        if cached is None:
+            filename = os.path.abspath(code.co_filename)
+            cached = (code, not (
+                code.co_filename.startswith('<') or any(
+                    filename.startswith(os.path.abspath(directory) + os.sep)
+                    for directory in DEBUGGER_DIRECTORIES) or
+                not self.module_filter.is_file_included(code.co_filename)))
+            self.traced_code_objects[id(code)] = cached
+        return cached[1]
+
+    def on_start(self, code, instruction_offset):
+        if (id(code) not in self.known_code_objects and
+                self.is_traced(code)):
+            self.register_code(code)
+        return self.monitoring.DISABLE
+
+    def on_line(self, code, line_number):
+        if not self.is_traced(code):
+            return self.monitoring.DISABLE
+        thread_id = threading.get_ident()
+        thread = self.debugger.threads.get(thread_id)
+        if ((thread is not None and
+             (thread.debug_mode == debugger.DebugMode.StepMode or
+              thread.debugger_state == debugger.DebuggerState.Stopped))
+                or self.is_paused(thread_id)
+                or id(code) in self.step_code_objects
+                or line_number in self.debugger.get_breakpoint_lines(
+                    code.co_filename)
+                or self.debugger.get_code_watchpoints(code)):
+            self.debugger.debug_frame(sys._getframe(1), line_number)
+            return None
+        return self.monitoring.DISABLE
+
+    def breakpoints_changed(self, filename, line_number):
+        for code in self.code_objects[filename]:
+            self.update_local_events(code)
+        self.monitoring.restart_events()
+
+    def watchpoints_changed(self):
+        for code in self.known_code_objects.values():
+            self.update_local_events(code)
+        self.monitoring.restart_events()
+
+    def is_paused(self, thread_id):
+        return (self.debugger.thread_stop_mode ==
+                debugger.ThreadStopMode.StopAll and
+                self.debugger.stopped_thread_id not in (None, thread_id) and
+                (thread_id in self.debugger.threads or
+                 thread_id not in self.excluded_thread_ids))
+
+    def stop(self):
+        # Other threads get line events, so they pause on their next line
+        if self.debugger.thread_stop_mode == debugger.ThreadStopMode.StopAll:
+            self.monitoring.set_events(
+                self.tool_id, self.events.PY_START | self.events.LINE)
+            self.monitoring.restart_events()
+
+    def resume(self):
+        previous_step_code_objects = self.step_code_objects
+        self.step_code_objects = dict()
+        # A thread that has to stop on its next line, like the main thread
+        # on the first line of the program, steps too
+        stepping = any(thread.debug_mode == debugger.DebugMode.StepMode or
+                       thread.debugger_state == debugger.DebuggerState.Stopped
+                       for thread in self.debugger.get_threads())
+        if stepping:
+            self.monitoring.set_events(
+                self.tool_id, self.events.PY_START | self.events.LINE)
+        else:
+            self.monitoring.set_events(self.tool_id, self.events.PY_START)
+            for frame in self.debugger.get_step_frames():
+                self.step_code_objects[id(frame.f_code)] = frame.f_code
+        for code in {**previous_step_code_objects,
+                     **self.step_code_objects}.values():
+            self.update_local_events(code)
+        if stepping or self.step_code_objects:
+            self.monitoring.restart_events()
+
+    def uninstall(self):
+        self.monitoring.set_events(self.tool_id, self.events.NO_EVENTS)
+        for code in self.known_code_objects.values():
+            self.monitoring.set_local_events(self.tool_id, code,
+                                             self.events.NO_EVENTS)
+        self.monitoring.register_callback(self.tool_id, self.events.PY_START,
+                                          None)
+        self.monitoring.register_callback(self.tool_id, self.events.LINE,
+                                          None)
+        self.monitoring.free_tool_id(self.tool_id)
+
+
+class SamplingBackend(TracingBackend):
+    """Runs the program uninstrumented, for the sampling profiler.
+
+    Nothing calls the debugger until a breakpoint is added. Function
+    objects owning breakpoint lines then get their code instrumented as with
+    InstrumentationMode.BreakpointsOnly and stop on their next call. Frames
+    that are already running keep their old code, module level code never
+    stops.
+    """
+
+    def __init__(self, debugger_instance, instrumentation_mode=None,
+                 code_cache=None, module_filter=None):
+        super().__init__(debugger_instance, module_filter)
+        # Original code of the instrumented code objects, keyed by id of
+        # the instrumented one
+        self.original_code = dict()
+
+    def get_globals(self):
+        return {'debug': self.debugger.debug}
+
+    def get_original_code(self, code):
+        cached = self.original_code.get(id(code))
+        if cached is None or cached[0] is not code:
+            return code
+        return cached[1]
+
+    def register_instrumented_code(self, code, original_code):
+        # Functions defined by instrumented code get instrumented nested
+        # code, it is never instrumented twice
+        self.original_code[id(code)] = (code, original_code)
+        original_consts = {
+            (const.co_name, const.co_firstlineno): const
+            for const in original_code.co_consts
+            if isinstance(const, types.CodeType)}
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                original_const = original_consts.get(
+                    (const.co_name, const.co_firstlineno))
+                if original_const is not None:
+                    self.register_instrumented_code(const, original_const)
+
+    def breakpoints_changed(self, filename, line_number):
+        breakpoint_lines = self.debugger.get_breakpoint_lines(filename)
+        instrumented = dict()
+        for function in get_functions(filename):
+            original_code = self.get_original_code(function.__code__)
+            if line_number not in debugger.get_own_lines(original_code):
+                continue
+            if id(original_code) not in instrumented:
+                code = original_code
+                if breakpoint_lines & debugger.get_own_lines(original_code):
+                    code = debugger.modify_code(original_code,
+                                                breakpoint_lines)
+                    self.register_instrumented_code(code, original_code)
+                instrumented[id(original_code)] = code
+            function.__globals__['debug'] = self.debugger.debug
+            function.__code__ = instrumented[id(original_code)]
+
+    def uninstall(self):
+        if self.original_code:
+            for function in get_functions():
+                function.__code__ = self.get_original_code(function.__code__)
+            self.original_code.clear()
+
+
+def get_functions(filename=None):
+    return [function for function in gc.get_objects()
+            if isinstance(function, types.FunctionType) and
+            (filename is None or function.__code__.co_filename == filename)]
+
+
+def create_backend(backend_type, debugger_instance, **options):
+    backend_classes = {
+        debugger.TracingBackendType.Bytecode: BytecodeBackend,
+        debugger.TracingBackendType.Monitoring: MonitoringBackend,
+        debugger.TracingBackendType.Sampling: SamplingBackend,
+    }
+    backend_class = backend_classes[debugger.TracingBackendType(backend_type)]
+    return backend_class(debugger_instance, **options)
@@ -0,0 +1,160 @@
+import inspect
+import itertools
+import reprlib
+import types
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+MAX_REPR_LENGTH = 1000
+PAGE_SIZE = 100
+MAX_CODE_TITLES = 10000
+CONTAINER_TYPES = (dict, list, tuple, set, frozenset)
+SCALAR_TYPES = (type(None), bool, float)
+
+
+class ValueRepr(reprlib.Repr):
+    """reprlib.Repr that does not sort dicts and sets, sorting takes
+    longer than the repr for big ones"""
+
+    def __init__(self):
+        super().__init__()
+        self.maxlevel = 3
+        self.maxdict = 10
+        self.maxlist = self.maxtuple = self.maxset = self.maxfrozenset = 20
+        self.maxdeque = self.maxarray = 20
+        self.maxstring = self.maxother = MAX_REPR_LENGTH
+        self.maxlong = 100
+
+    def repr1(self, x, level):
+        # Elements of big containers are mostly small numbers
+        value_type = type(x)
+        if value_type in SCALAR_TYPES or (value_type is int and
+                                          x.bit_length() < 64):
+            return repr(x)
+        if value_type in CONTAINER_TYPES or \
+                not isinstance(x, CONTAINER_TYPES):
+            return super().repr1(x, level)
+        # Subclasses of containers would get their full repr
+        for container_type in CONTAINER_TYPES:
+            if (isinstance(x, container_type) and
+                    type(x) is not container_type and
+                    len(x) > self.maxlist):
+                return '{}({})'.format(
+                    type(x).__name__,
+                    getattr(self, 'repr_' + container_type.__name__)(
+                        x, level))
+        return super().repr1(x, level)
+
+    def repr_dict(self, x, level):
+        if not x:
+            return '{}'
+        if level <= 0:
+            return '{...}'
+        pieces = ['{}: {}'.format(self.repr1(key, level - 1),
+                                  self.repr1(x[key], level - 1))
+                  for key in itertools.islice(x, self.maxdict)]
+        if len(x) > self.maxdict:
+            pieces.append('...')
+        return '{%s}' % ', '.join(pieces)
+
+    def repr_set(self, x, level):
+        if not x:
+            return 'set()'
+        return self._repr_iterable(x, level, '{', '}', self.maxset)
+
+    def repr_frozenset(self, x, level):
+        if not x:
+            return 'frozenset()'
+        return self._repr_iterable(x, level, 'frozenset({', '})',
+                                   self.maxfrozenset)
+
+
+value_repr = ValueRepr()
+# Keyed by id, hashing a code object hashes all its constants
+code_titles = dict()
+
+
+def get_value_repr(value, limit=MAX_REPR_LENGTH):
+    try:
+        text = value_repr.repr(value)
+    except BaseException:
+        text = '<repr failed: {}>'.format(sys.exc_info()[1])
+    if len(text) > limit:
+        text = text[:limit] + '...'
+    return text
+
+
+class ReprCache:
+    """Reprs of the values shown at one stop, cleared on the next one"""
+
+    def __init__(self):
+        self.reprs = dict()
+
+    def get(self, value):
+        # The value is kept in the entry so its id is not reused
+        cached = self.reprs.get(id(value))
+        if cached is None or cached[0] is not value:
+            cached = (value, get_value_repr(value))
+            self.reprs[id(value)] = cached
+        return cached[1]
+
+    def clear(self):
+        self.reprs.clear()
+
+
+def has_children(value):
+    if isinstance(value, CONTAINER_TYPES):
+        return len(value) > 0
+    if isinstance(value, type) or callable(value):
+        return False
+    return bool(getattr(value, '__dict__', None))
+
+
+def get_child_count(value):
+    if isinstance(value, CONTAINER_TYPES):
+        return len(value)
+    if has_children(value):
+        return len(vars(value))
+    return 0
+
+
+def get_children(value, start=0, count=None):
+    # Only the requested page is read, big containers are not copied
+    stop = None if count is None else start + count
+    if isinstance(value, dict):
+        return [(get_value_repr(key), child) for key, child in
+                itertools.islice(value.items(), start, stop)]
+    if isinstance(value, (list, tuple)):
+        return [(str(index), value[index]) for index in
+                range(*slice(start, stop).indices(len(value)))]
+    if isinstance(value, (set, frozenset)):
+        return [(str(index), child) for index, child in
+                itertools.islice(enumerate(value), start, stop)]
+    if has_children(value):
+        return list(itertools.islice(vars(value).items(), start, stop))
+    return []
+
+
+def get_scope_names(scope, hidden=()):
+    # Names the debugger injects and dunder names are not shown
+    return [name for name in scope
+            if name not in hidden and
+            not (name.startswith('__') and name.endswith('__'))]
+
+
+def get_frame_title(frame):
+    code = frame.f_code
+    cached = code_titles.get(id(code))
+    if cached is None or cached[0] is not code:
+        try:
+            signature = str(inspect.signature(types.FunctionType(code, {})))
+        except (TypeError, ValueError):
+            signature = '()'
+        cached = (code, code.co_name + signature)
+        if len(code_titles) >= MAX_CODE_TITLES:
+            code_titles.clear()
+        code_titles[id(code)] = cached
+    return cached[1]
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Headless debugger speaking the Debug Adapter Protocol.
+
+Serves one client on stdio, or on a local TCP port with --port.
+"""
+import argparse
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import core.dapServer as dapServer
+
+
+def print_address(address):
+    print('Listening on {}:{}'.format(*address[:2]), file=sys.stderr,
+          flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int,
+                        help='listen on this TCP port instead of stdio, '
+                             '0 picks a free one')
+    args = parser.parse_args()
+    try:
+        if args.port is None:
+            asyncio.run(dapServer.serve_stdio())
+        else:
+            asyncio.run(dapServer.serve_tcp(args.host, args.port,
+                                            print_address))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 from PyQt5.QtGui import (
     QIcon,
-    QStandardItem,
-    QStandardItemModel,
+    QTextCharFormat,
     QTextCursor,
     QColor,
 )
@@ -15,7 +14,7 @@ from PyQt5.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QTreeView,
-    QTextEdit,
+    QPlainTextEdit,
     QHBoxLayout,
     QInputDialog,
     QLineEdit,
@@ -23,17 +22,48 @@ from PyQt5.QtWidgets import (
     QDialogButtonBox,
     QFormLayout,
     QPushButton,
+    QListWidget,
+    QListWidgetItem,
 )
 from core.editor import Editor, BACKGROUND_COLOR
+from core.codeCache import CodeCache
+from core.lineCoverage import (
+    LineCoverage,
+    get_executable_lines,
+    get_heat_levels,
+)
+from core.lineProfiler import LineProfiler
+from core.moduleFilter import ModuleFilter
+from core.outputBuffer import OutputBuffer
+from core.recording import Replay
+from core.sampler import Sampler
+from core.sourceCache import source_cache
+from core.variables import (
+    PAGE_SIZE,
+    ReprCache,
+    get_children,
+    get_child_count,
+    get_frame_title,
+    get_scope_names,
+    get_value_repr,
+    has_children,
+)
 import core.debugger as debugger
-from PyQt5.QtCore import QCoreApplication, pyqtSignal
+from PyQt5.QtCore import (
+    QAbstractItemModel,
+    QCoreApplication,
+    QModelIndex,
+    Qt,
+    QTimer,
+    pyqtSignal,
+)
 import sys
 import os
-from threading import Thread
-import inspect
-import types
+from threading import Thread, Condition, get_ident
 import collections
 import shlex
+import sqlite3
+import tempfile
 
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir)
@@ -42,24 +72,44 @@ sys.path.append(
 STDOUT_COLOR = QColor(0, 0, 0)
 STDERR_COLOR = QColor(255, 0, 0)
 RUNNING_BG_COLOR = QColor(120, 115, 130)
+OUTPUT_FLUSH_INTERVAL_MS = 50
+MAX_CONSOLE_LINES = 10000
+HOTSPOTS_REFRESH_INTERVAL_MS = 500
+MAX_HOTSPOTS = 20
 
 
 class MainWindow(QMainWindow):
     input_request_handler = pyqtSignal()
     debug_function_handler = pyqtSignal(str, int)
-    output_request_handler = pyqtSignal(str, QColor)
-    error_request_handler = pyqtSignal(str, QColor)
+    output_full_handler = pyqtSignal()
     after_debug_function_handler = pyqtSignal()
+    child_stopped_handler = pyqtSignal(object)
 
     def __init__(self, debug_function, parent=None):
         super().__init__(parent)
         self.debug_function = debug_function
         self.debugger = debugger.Debugger()
+        self.code_cache = CodeCache()
         self.main_widget = QWidget(self)
         self.layout = QVBoxLayout(self.main_widget)
         self.tab = TabWidget()
         self.stacktrace_widget = StacktraceWidget(self)
+        self.threads_widget = ThreadsWidget(self)
+        self.tasks_widget = TasksWidget(self)
+        self.hotspots_widget = HotspotsWidget(self)
         self.output_widget = QDbgConsole()
+        # Program output is shown in batches, not on every write
+        self.output_buffer = OutputBuffer(
+            self.output_widget.write_with_color,
+            on_full=self.output_full_handler.emit,
+            flush_thread_id=get_ident(),
+        )
+        self.output_timer = QTimer(self)
+        self.output_timer.timeout.connect(self.output_buffer.flush)
+        self.output_timer.start(OUTPUT_FLUSH_INTERVAL_MS)
+        self.hotspots_timer = QTimer(self)
+        self.hotspots_timer.timeout.connect(self.show_hotspots)
+        self.hotspots_timer.start(HOTSPOTS_REFRESH_INTERVAL_MS)
         self.sub_layout = QHBoxLayout()
         self.stdin = InputProvider(self)
         self.stdout = OutputProvider(self, STDOUT_COLOR)
@@ -69,24 +119,49 @@ class MainWindow(QMainWindow):
         self.set_menu()
         self.setup_toolbar()
         self.main_widget.setLayout(self.layout)
+        self.threads_layout = QVBoxLayout()
+        self.threads_layout.addWidget(self.threads_widget)
+        self.threads_layout.addWidget(self.tasks_widget)
+        self.threads_layout.addWidget(self.hotspots_widget)
+        self.sub_layout.addLayout(self.threads_layout)
         self.sub_layout.addWidget(self.stacktrace_widget)
         self.sub_layout.addWidget(self.output_widget)
         self.layout.addWidget(self.tab)
         self.layout.addLayout(self.sub_layout)
         self.setCentralWidget(self.main_widget)
         self.input = collections.deque()
+        self.input_condition = Condition()
         self.providing_input = False
         self.active_debugger = False
+        # Child processes waiting for a command, the first one is shown
+        self.stopped_children = collections.deque()
+        # Recording of the last session and the replay shown from it, in a
+        # file only this process could have created
+        recording_fd, self.recording_file = tempfile.mkstemp(
+            prefix="python-debugger-", suffix=".recording"
+        )
+        os.close(recording_fd)
+        self.has_recording = False
+        self.replay = None
+        self.line_coverage = None
+        self.line_profiler = None
+        self.sampler = None
+        # Kept between sessions like the breakpoints of the tabs
+        self.watch_expressions = []
         self.setup_signals()
         self.last_launch_info = dict()
 
     def setup_signals(self):
+        self.debug_function_handler.connect(self.output_buffer.flush)
+        self.debug_function_handler.connect(self.close_replay)
         self.debug_function_handler.connect(self.highlight_current_line)
         self.debug_function_handler.connect(self.show_stacktrace)
+        self.debug_function_handler.connect(self.show_changed_watchpoints)
+        self.input_request_handler.connect(self.output_buffer.flush)
         self.input_request_handler.connect(self.get_input)
-        self.output_request_handler.connect(self.write_to_stdout)
-        self.error_request_handler.connect(self.write_to_stdout)
+        self.output_full_handler.connect(self.output_buffer.flush)
         self.after_debug_function_handler.connect(self.stop_debug)
+        self.child_stopped_handler.connect(self.show_child_stop)
 
     def setup_tab_widget(self):
         path = os.path.dirname(os.path.abspath(__file__))
@@ -158,6 +233,15 @@ class MainWindow(QMainWindow):
                 triggered=self.step_over,
             )
         )
+        self.toolbar.addAction(
+            QAction(
+                QIcon(os.path.join(path, "icons/step-out-icon.svg")),
+                "Step out",
+                self,
+                shortcut="Shift+F8",
+                triggered=self.step_out,
+            )
+        )
         self.toolbar.addAction(
             QAction(
                 QIcon(os.path.join(path, "icons/exec-code-icon.svg")),
@@ -210,6 +294,75 @@ class MainWindow(QMainWindow):
             )
         )
 
+        # DEBUG MENU
+        debug_menu = menu.addMenu("&Debug")
+        self.stop_all_threads_action = QAction(
+            "Stop all threads", self, checkable=True
+        )
+        self.stop_all_threads_action.setChecked(True)
+        debug_menu.addAction(self.stop_all_threads_action)
+        self.debug_child_processes_action = QAction(
+            "Debug child processes", self, checkable=True
+        )
+        debug_menu.addAction(self.debug_child_processes_action)
+        self.spool_output_action = QAction(
+            "Save output to file...",
+            self,
+            checkable=True,
+            triggered=self.spool_output,
+        )
+        debug_menu.addAction(self.spool_output_action)
+        debug_menu.addSeparator()
+        self.coverage_action = QAction(
+            "Collect coverage", self, checkable=True
+        )
+        debug_menu.addAction(self.coverage_action)
+        debug_menu.addAction(
+            QAction("Save coverage...", self, triggered=self.save_coverage)
+        )
+        self.profile_action = QAction("Profile lines", self, checkable=True)
+        debug_menu.addAction(self.profile_action)
+        debug_menu.addAction(
+            QAction("Save profile...", self, triggered=self.save_profile)
+        )
+        self.sample_action = QAction(
+            "Sample stacks (no instrumentation)", self, checkable=True
+        )
+        debug_menu.addAction(self.sample_action)
+        debug_menu.addAction(
+            QAction("Save samples...", self, triggered=self.save_samples)
+        )
+        debug_menu.addSeparator()
+        debug_menu.addAction(
+            QAction("Add watchpoint...", self, triggered=self.add_watchpoint)
+        )
+        debug_menu.addAction(
+            QAction(
+                "Remove watchpoints", self, triggered=self.remove_watchpoints
+            )
+        )
+        debug_menu.addSeparator()
+        self.record_action = QAction(
+            "Record execution", self, checkable=True
+        )
+        debug_menu.addAction(self.record_action)
+        debug_menu.addAction(
+            QAction(
+                "Step back in recording",
+                self,
+                shortcut="Ctrl+F7",
+                triggered=self.step_back,
+            )
+        )
+        debug_menu.addAction(
+            QAction(
+                "Step forward in recording",
+                self,
+                shortcut="Ctrl+F8",
+                triggered=self.step_forward,
+            )
+        )
+
         # HELP MENU
         help_menu = menu.addMenu("&Help")
         help_menu.addAction(
@@ -234,9 +387,9 @@ class MainWindow(QMainWindow):
             editor = Editor(
                 self, filename, self.add_breakpoint, self.remove_breakpoint
             )
-            with open(filename, "r") as text:
-                self.tab.addTab(editor, file_name)
-                editor.setText(text.read())
+            text = source_cache.get_source(filename)
+            self.tab.addTab(editor, file_name)
+            editor.setText(text)
             self.tab.tab_container[filename] = editor
         self.tab.setCurrentWidget(self.tab.tab_container[filename])
 
@@ -248,14 +401,37 @@ class MainWindow(QMainWindow):
             "F5 : Launch debugger on current opened file\n"
             "F7 : Step in\n"
             "F8 : Step over\n"
+            "Shift + F8 : Step out\n"
             "F9 : Continue\n"
             "F6 : Exec code\n"
             "F3 : Stop debugger\n"
             "Ctrl + Q : Exit debugger\n"
             "Editing stack values allowed through stack widget\n"
             "To place a breakpoint click near the line number\n"
-            "To place a conditional breakpoint click while "
-            "holding SHIFT button",
+            "To place a conditional or hit count breakpoint click while "
+            "holding SHIFT button\n"
+            "Debug > Add watchpoint... stops when the value of an expression "
+            "such as self.counter or cache['k'] changes\n"
+            "Click a paused thread in the threads list to inspect it\n"
+            "Click an asyncio task in the tasks list to show its line\n"
+            "Uncheck Debug > Stop all threads to stop only the thread "
+            "hitting a breakpoint\n"
+            "Check Debug > Debug child processes to stop on breakpoints in "
+            "Python subprocesses and multiprocessing workers\n"
+            "The console keeps the last {} lines, check Debug > Save output "
+            "to file to keep all program output\n"
+            "Check Debug > Record execution, then Ctrl + F7 / Ctrl + F8 step "
+            "back and forward through the recorded lines\n"
+            "Check Debug > Collect coverage to color lines by how often they "
+            "ran, red lines did not run\n"
+            "Check Debug > Profile lines to color lines by the time spent "
+            "on them, Debug > Save profile... saves pstats or speedscope "
+            "files\n"
+            "Check Debug > Sample stacks to run the program uninstrumented "
+            "and list its hottest lines, double click one to stop there the "
+            "next time its function is called".format(
+                MAX_CONSOLE_LINES
+            ),
         )
 
     def _quit(self):
@@ -263,19 +439,112 @@ class MainWindow(QMainWindow):
 
     def make_step(self):
         if self.active_debugger:
+            if self.stopped_children:
+                self.resume_child(self.stopped_children.popleft().make_step)
+                return
             self.debugger.make_step()
             self.set_bg_color(RUNNING_BG_COLOR)
 
     def step_over(self):
         if self.active_debugger:
+            if self.stopped_children:
+                self.resume_child(self.stopped_children.popleft().step_over)
+                return
             self.debugger.step_over()
             self.set_bg_color(RUNNING_BG_COLOR)
 
+    def step_out(self):
+        if self.active_debugger and not self.stopped_children:
+            self.debugger.step_out()
+            self.set_bg_color(RUNNING_BG_COLOR)
+
     def continue_until_breakpoint(self):
         if self.active_debugger:
+            if self.stopped_children:
+                self.resume_child(
+                    self.stopped_children.popleft().continue_until_breakpoint
+                )
+                return
             self.debugger.continue_until_breakpoint()
             self.set_bg_color(RUNNING_BG_COLOR)
 
+    def on_child_stopped(self, child):
+        # Called on a child process server thread
+        self.child_stopped_handler.emit(child)
+
+    def show_child_stop(self, child):
+        if not self.active_debugger:
+            child.continue_until_breakpoint()
+            return
+        self.stopped_children.append(child)
+        if len(self.stopped_children) == 1:
+            self.show_first_stopped_child()
+
+    def show_first_stopped_child(self):
+        stop = self.stopped_children[0].stop
+        self.highlight_current_line(stop["filename"], stop["line"])
+        self.write_to_stdout(
+            "Process {} stopped at {}:{} in {}\n".format(
+                stop["pid"], stop["filename"], stop["line"], stop["function"]
+            ),
+            STDOUT_COLOR,
+        )
+
+    def resume_child(self, command):
+        command()
+        if self.stopped_children:
+            self.show_first_stopped_child()
+        else:
+            self.set_bg_color(RUNNING_BG_COLOR)
+
+    def get_replay(self):
+        if self.replay is None:
+            if self.active_debugger:
+                self.replay = self.debugger.get_replay()
+            elif self.has_recording and os.path.isfile(
+                self.recording_file
+            ):
+                self.replay = Replay.open(self.recording_file)
+            if self.replay is not None and self.replay.line_count:
+                self.replay.seek(self.replay.line_count - 1)
+        return self.replay
+
+    def step_back(self):
+        replay = self.get_replay()
+        if replay is not None and replay.step_back() is not None:
+            self.show_replay()
+
+    def step_forward(self):
+        if self.replay is None:
+            return
+        if self.replay.step_forward() is not None:
+            self.show_replay()
+        elif self.active_debugger:
+            # The end of the recording is where the program is stopped
+            self.close_replay()
+            self.highlight_current_line(
+                self.debugger.get_filename(), self.debugger.get_line_number()
+            )
+            self.show_stacktrace()
+
+    def show_replay(self):
+        frame = self.replay.get_frame()
+        self.highlight_current_line(frame.filename, frame.line_number)
+        self.stacktrace_widget.importData(
+            self.replay.get_stacktrace(), recorded=True
+        )
+        self.statusBar().showMessage(
+            "Recorded line {} of {} in {}".format(
+                self.replay.position + 1,
+                self.replay.line_count,
+                self.replay.get_thread_name(),
+            )
+        )
+
+    def close_replay(self):
+        self.replay = None
+        self.statusBar().clearMessage()
+
     def highlight_current_line(self, filename, line_number):
         if len(self.tab.tab_container) > 0:
             if self.tab.currentWidget() is not None:
@@ -293,7 +562,151 @@ class MainWindow(QMainWindow):
 
     def show_stacktrace(self):
         if self.active_debugger:
-            self.stacktrace_widget.importData(self.debugger.current_stacktrace)
+            hidden = ()
+            if self.debugger.backend is not None:
+                hidden = set(self.debugger.backend.get_globals())
+            self.stacktrace_widget.importData(
+                self.debugger.current_stacktrace, hidden
+            )
+            self.threads_widget.importData(
+                self.debugger.get_threads(), self.debugger.selected_thread_id
+            )
+            self.tasks_widget.importData(self.debugger.get_tasks())
+            self.show_hit_counts()
+            self.show_line_heat()
+
+    def select_thread(self, thread_id):
+        if self.active_debugger:
+            thread = self.debugger.threads.get(thread_id)
+            # Frames of running threads change while they are read
+            if thread is not None and (
+                thread.is_paused
+                or thread_id == self.debugger.stopped_thread_id
+            ):
+                self.debugger.select_thread(thread_id)
+                self.highlight_current_line(
+                    self.debugger.get_filename(),
+                    self.debugger.get_line_number(),
+                )
+            self.show_stacktrace()
+
+    def show_line_heat(self):
+        # Line times of the profiler, or else hit counts of the coverage
+        if self.line_profiler is not None:
+            line_times = self.line_profiler.get_line_times()
+            for filename, widget in self.tab.tab_container.items():
+                file_times = line_times.get(filename, {})
+                widget.show_line_heat(
+                    get_heat_levels(
+                        {
+                            line: time_ns
+                            for line, (time_ns, _) in file_times.items()
+                        },
+                        (),
+                    )
+                )
+        elif self.line_coverage is not None:
+            line_hits = self.line_coverage.get_line_hits()
+            for filename, widget in self.tab.tab_container.items():
+                widget.show_line_heat(
+                    get_heat_levels(
+                        line_hits.get(filename, {}),
+                        get_executable_lines(filename),
+                    )
+                )
+        else:
+            for widget in self.tab.tab_container.values():
+                widget.clear_line_heat()
+
+    def save_coverage(self):
+        if self.line_coverage is None:
+            self.write_to_stdout(
+                "Check Debug > Collect coverage and debug a program first\n",
+                STDERR_COLOR,
+            )
+            return
+        filename = QFileDialog.getSaveFileName(
+            self,
+            "Save coverage",
+            ".coverage",
+            "coverage.py data (*.coverage);;JSON (*.json)",
+        )[0]
+        if not filename:
+            return
+        try:
+            if filename.endswith(".json"):
+                self.line_coverage.write_json(filename)
+            else:
+                self.line_coverage.write_coverage_data(filename)
+        except (OSError, sqlite3.Error) as error:
+            self.write_to_stdout(
+                "Cannot save coverage: {}\n".format(error), STDERR_COLOR
+            )
+
+    def show_hotspots(self):
+        if self.sampler is not None and self.active_debugger:
+            self.hotspots_widget.importData(
+                self.sampler.get_hotspots(MAX_HOTSPOTS),
+                self.sampler.stack_samples,
+            )
+
+    def stop_at_hotspot(self, filename, line_number):
+        # The sample becomes a breakpoint, the program stops on the next
+        # call of the function that owns the line
+        if not self.active_debugger:
+            return
+        self.try_add_tab(filename)
+        editor = self.tab.tab_container[filename]
+        if line_number not in {bp.line_number for bp in editor.breakpoints}:
+            editor.on_margin_clicked(1, line_number - 1, Qt.NoModifier)
+
+    def save_samples(self):
+        if self.sampler is None:
+            self.write_to_stdout(
+                "Check Debug > Sample stacks and run a program first\n",
+                STDERR_COLOR,
+            )
+            return
+        filename = QFileDialog.getSaveFileName(
+            self, "Save samples", "samples.json", "speedscope (*.json)"
+        )[0]
+        if not filename:
+            return
+        try:
+            self.sampler.write_speedscope(filename)
+        except OSError as error:
+            self.write_to_stdout(
+                "Cannot save samples: {}\n".format(error), STDERR_COLOR
+            )
+
+    def save_profile(self):
+        if self.line_profiler is None:
+            self.write_to_stdout(
+                "Check Debug > Profile lines and debug a program first\n",
+                STDERR_COLOR,
+            )
+            return
+        filename = QFileDialog.getSaveFileName(
+            self,
+            "Save profile",
+            "profile.pstats",
+            "pstats (*.pstats *.prof);;speedscope (*.json)",
+        )[0]
+        if not filename:
+            return
+        try:
+            if filename.endswith(".json"):
+                self.line_profiler.write_speedscope(filename)
+            else:
+                self.line_profiler.write_pstats(filename)
+        except OSError as error:
+            self.write_to_stdout(
+                "Cannot save profile: {}\n".format(error), STDERR_COLOR
+            )
+
+    def show_hit_counts(self):
+        for index in range(len(self.tab.tab_container)):
+            self.tab.widget(index).show_hit_counts(self.debugger.get_hit_count)
 
     def exec_code(self):
         if self.active_debugger:
@@ -304,9 +717,12 @@ class MainWindow(QMainWindow):
             )
             self.show_stacktrace()
 
-    def add_breakpoint(self, filename, line_num, condition):
+    def add_breakpoint(self, filename, line_num, condition, ignore_count=0,
+                       every_nth_hit=None, log_message=None):
         if self.active_debugger:
-            self.debugger.add_breakpoint(filename, line_num, condition)
+            self.debugger.add_breakpoint(filename, line_num, condition,
+                                         ignore_count, every_nth_hit,
+                                         log_message)
 
     def modify_vars(self, key, depth, value):
         if self.active_debugger:
@@ -324,17 +740,62 @@ class MainWindow(QMainWindow):
                 self, "Input dialog", "Write your input"
             ).readlines()
             if lines:
-                for line in lines.split():
-                    self.input.append(line)
+                with self.input_condition:
+                    for line in lines.split():
+                        self.input.append(line)
+                    self.input_condition.notify_all()
             self.providing_input = False
 
+    def add_watchpoint(self):
+        expression, ok = QInputDialog.getText(
+            self, "Add watchpoint", "Stop when this expression changes:"
+        )
+        expression = expression.strip()
+        if not ok or not expression:
+            return
+        if expression in self.watch_expressions:
+            return
+        try:
+            debugger.Watchpoint(expression)
+        except SyntaxError as e:
+            QMessageBox.warning(self, "Wrong watchpoint", str(e))
+            return
+        self.watch_expressions.append(expression)
+        if self.active_debugger:
+            self.debugger.add_watchpoint(expression)
+
+    def remove_watchpoints(self):
+        if self.active_debugger:
+            for expression in self.watch_expressions:
+                self.debugger.remove_watchpoint(expression)
+        self.watch_expressions.clear()
+
+    def show_changed_watchpoints(self):
+        if self.active_debugger:
+            thread = self.debugger.get_selected_thread()
+            for watchpoint in thread.changed_watchpoints:
+                self.write_to_stdout(
+                    "Watchpoint {}: {} -> {}\n".format(
+                        watchpoint.expression,
+                        get_value_repr(watchpoint.old_value),
+                        get_value_repr(watchpoint.value),
+                    ),
+                    STDOUT_COLOR,
+                )
+
     def set_breakpoints_from_tabs(self):
         if self.active_debugger:
             for index in range(len(self.tab.tab_container)):
                 widget = self.tab.widget(index)
+                widget.clear_hit_counts()
                 for bp in widget.breakpoints:
                     self.debugger.add_breakpoint(
-                        bp.filename, bp.line_number, bp.condition
+                        bp.filename,
+                        bp.line_number,
+                        bp.condition,
+                        bp.ignore_count,
+                        bp.every_nth_hit,
+                        bp.log_message,
                     )
 
     def after_debug_func(self):
@@ -347,7 +808,10 @@ class MainWindow(QMainWindow):
             self.tab.removeTab(0)
 
     def stop_debug(self):
+        self.output_buffer.flush()
         self.active_debugger = False
+        while self.stopped_children:
+            self.stopped_children.popleft().continue_until_breakpoint()
         for index in range(len(self.tab.tab_container)):
             widget = self.tab.widget(index)
             widget.clear_highlights()
@@ -355,6 +819,7 @@ class MainWindow(QMainWindow):
         if self.debugger:
             self.debugger.stop_debug()
         self.debugger = None
+        self.show_line_heat()
 
     def start_debugging(self):
         if not self.active_debugger:
@@ -362,6 +827,8 @@ class MainWindow(QMainWindow):
                 program_to_debug,
                 working_directory,
                 arguments,
+                include_modules,
+                exclude_modules,
             ) = StartProgramDialog(self).get_inputs()
             if program_to_debug and os.path.isfile(program_to_debug):
                 if not working_directory:
@@ -371,17 +838,60 @@ class MainWindow(QMainWindow):
                 self.providing_input = False
                 self.active_debugger = True
                 self.debugger = debugger.Debugger()
+                self.debugger.set_thread_stop_mode(
+                    debugger.ThreadStopMode.StopAll
+                    if self.stop_all_threads_action.isChecked()
+                    else debugger.ThreadStopMode.StopOne
+                )
                 self.set_breakpoints_from_tabs()
+                for expression in self.watch_expressions:
+                    self.debugger.add_watchpoint(expression)
+                self.close_replay()
+                self.has_recording = self.record_action.isChecked()
+                self.line_coverage = None
+                if self.coverage_action.isChecked():
+                    self.line_coverage = LineCoverage()
+                self.line_profiler = None
+                if self.profile_action.isChecked():
+                    self.line_profiler = LineProfiler()
+                self.sampler = None
+                mode = debugger.DebugMode.StepMode
+                tracing_backend = debugger.TracingBackendType.Bytecode
+                if self.sample_action.isChecked():
+                    # Nothing is instrumented, there is no first line stop
+                    self.sampler = Sampler()
+                    mode = debugger.DebugMode.BreakpointMode
+                    tracing_backend = debugger.TracingBackendType.Sampling
+                    self.hotspots_widget.clear()
                 t = Thread(
                     target=self.debugger.start_debugging,
                     args=(self.debug_function, program_to_debug),
                     kwargs={
+                        "mode": mode,
                         "stdout": self.stdout,
                         "stderr": self.stderr,
                         "stdin": self.stdin,
                         "after_debug_func": self.after_debug_func,
                         "new_wd": working_directory,
                         "arguments": self.get_arguments_from_line(arguments),
+                        "code_cache": self.code_cache,
+                        "module_filter": ModuleFilter(
+                            self.get_patterns_from_line(include_modules),
+                            self.get_patterns_from_line(exclude_modules),
+                        ),
+                        "debug_child_processes": (
+                            self.debug_child_processes_action.isChecked()
+                        ),
+                        "on_child_stopped": self.on_child_stopped,
+                        "line_coverage": self.line_coverage,
+                        "line_profiler": self.line_profiler,
+                        "tracing_backend": tracing_backend,
+                        "sampler": self.sampler,
+                        "record_file": (
+                            self.recording_file
+                            if self.has_recording
+                            else None
+                        ),
                     },
                 )
                 t.daemon = True
@@ -390,6 +900,8 @@ class MainWindow(QMainWindow):
                     program_to_debug,
                     working_directory,
                     arguments,
+                    include_modules,
+                    exclude_modules,
                 )
             elif program_to_debug or working_directory or arguments:
                 self.write_to_stdout(
@@ -404,11 +916,32 @@ class MainWindow(QMainWindow):
         return None
 
     def write_to_stdout(self, message, color):
+        self.output_buffer.flush()
         self.output_widget.write_with_color(message, color)
 
+    def spool_output(self, checked):
+        if not checked:
+            self.output_buffer.close_spool()
+            return
+        filename = QFileDialog.getSaveFileName(self, "Save output to file")[0]
+        if not filename:
+            self.spool_output_action.setChecked(False)
+            return
+        try:
+            self.output_buffer.open_spool(filename)
+        except OSError as error:
+            self.spool_output_action.setChecked(False)
+            self.write_to_stdout(
+                "Cannot save output: {}\n".format(error), STDERR_COLOR
+            )
+
     def get_arguments_from_line(self, arguments):
         return shlex.split(arguments)
 
+    def get_patterns_from_line(self, patterns):
+        return [pattern.strip() for pattern in patterns.split(",")
+                if pattern.strip()]
+
 
 class InputProvider:
     def __init__(self, parent):
@@ -417,9 +950,10 @@ class InputProvider:
     def readline(self):
         if len(self.parent.input) == 0 and not self.parent.providing_input:
             self.parent.input_request_handler.emit()
-        while len(self.parent.input) == 0:
-            pass
-        received_input = self.parent.input.popleft()
+        with self.parent.input_condition:
+            while len(self.parent.input) == 0:
+                self.parent.input_condition.wait()
+            received_input = self.parent.input.popleft()
         return received_input
 
 
@@ -429,7 +963,11 @@ class OutputProvider:
         self.color = color
 
     def write(self, msg):
-        self.parent.output_request_handler.emit(msg, self.color)
+        self.parent.output_buffer.write(msg, self.color)
+
+    def flush(self):
+        # Output is shown by the timer of the window
+        pass
 
 
 class TabWidget(QTabWidget):
@@ -455,6 +993,291 @@ class TabWidget(QTabWidget):
         super().removeTab(index)
 
 
+class ThreadsWidget(QListWidget):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.setMaximumWidth(250)
+        self.itemClicked.connect(self.on_item_clicked)
+
+    def importData(self, threads, selected_thread_id):
+        self.clear()
+        for thread in threads:
+            if thread.debugger_state == debugger.DebuggerState.Stopped:
+                status = "stopped"
+            elif thread.is_paused:
+                status = "paused"
+            else:
+                status = "running"
+            item = QListWidgetItem("{} ({})".format(thread.name, status))
+            item.setData(Qt.UserRole, thread.thread_id)
+            self.addItem(item)
+            if thread.thread_id == selected_thread_id:
+                self.setCurrentItem(item)
+
+    def on_item_clicked(self, item):
+        self.parent.select_thread(item.data(Qt.UserRole))
+
+
+class TasksWidget(QListWidget):
+    """asyncio tasks of the selected thread, click one to show its line"""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.setMaximumWidth(250)
+        self.itemClicked.connect(self.on_item_clicked)
+
+    def importData(self, tasks):
+        self.clear()
+        for task in tasks:
+            if task.frame is None:
+                location = ""
+            else:
+                location = " {}:{}".format(
+                    task.frame.f_code.co_name, task.frame.f_lineno
+                )
+            if task.is_current:
+                location += " (current)"
+            item = QListWidgetItem(task.name + location)
+            item.setData(Qt.UserRole, task.frame)
+            self.addItem(item)
+            if task.is_current:
+                self.setCurrentItem(item)
+
+    def on_item_clicked(self, item):
+        frame = item.data(Qt.UserRole)
+        if frame is not None:
+            self.parent.highlight_current_line(
+                frame.f_code.co_filename, frame.f_lineno
+            )
+
+
+class HotspotsWidget(QListWidget):
+    """Most sampled lines, double click one to stop there"""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.setMaximumWidth(250)
+        self.itemDoubleClicked.connect(self.on_item_double_clicked)
+
+    def importData(self, hotspots, total_samples):
+        self.clear()
+        for filename, line_number, samples in hotspots:
+            item = QListWidgetItem(
+                "{}:{} ({:.1f}%)".format(
+                    os.path.basename(filename),
+                    line_number,
+                    100 * samples / max(total_samples, 1),
+                )
+            )
+            item.setData(Qt.UserRole, (filename, line_number))
+            item.setToolTip(filename)
+            self.addItem(item)
+
+    def on_item_double_clicked(self, item):
+        self.parent.stop_at_hotspot(*item.data(Qt.UserRole))
+
+
+class VariableNode:
+    def __init__(
+        self,
+        parent,
+        row,
+        name,
+        value=None,
+        frame=None,
+        frame_depth=None,
+        is_more=False,
+        hidden=(),
+    ):
+        self.parent = parent
+        self.row = row
+        self.name = name
+        self.value = value
+        self.frame = frame
+        # Stack depth of the frame owning a local, locals can be edited
+        self.frame_depth = frame_depth
+        self.is_more = is_more
+        self.hidden = hidden
+        self.children = []
+        self.child_count = None
+        # Locals are read once per stop: f_locals builds a new dict
+        self.scope = None
+        self.scope_names = None
+
+    def get_child_count(self):
+        if self.child_count is None:
+            if self.frame is not None:
+                self.child_count = len(self.get_scope_names())
+            else:
+                self.child_count = get_child_count(self.value)
+        return self.child_count
+
+    def get_scope_names(self):
+        if self.scope_names is None:
+            self.scope = self.frame.f_locals
+            self.scope_names = get_scope_names(self.scope, self.hidden)
+        return self.scope_names
+
+    def get_loaded_count(self):
+        if self.children and self.children[-1].is_more:
+            return len(self.children) - 1
+        return len(self.children)
+
+
+class VariablesModel(QAbstractItemModel):
+    """Frames of the stacktrace and their variables.
+
+    Nothing is read before it is shown: frames list their locals and
+    containers their items when expanded, PAGE_SIZE rows at a time, and
+    reprs are truncated and cached until the next stop.
+    """
+
+    def __init__(self, global_parent):
+        super().__init__(global_parent)
+        self.global_parent = global_parent
+        self.root = VariableNode(None, 0, "")
+        self.reprs = ReprCache()
+        self.editable = True
+
+    def set_frames(self, frames, hidden, recorded=False):
+        self.beginResetModel()
+        self.reprs.clear()
+        # Recorded frames only have the reprs of their locals
+        self.editable = not recorded
+        self.root = VariableNode(None, 0, "")
+        for depth, frame in enumerate(frames or []):
+            self.root.children.append(
+                VariableNode(
+                    self.root,
+                    depth,
+                    "{} (line {})".format(frame.name, frame.line_number)
+                    if recorded
+                    else get_frame_title(frame),
+                    frame=frame,
+                    hidden=hidden,
+                )
+            )
+        self.endResetModel()
+
+    def get_node(self, index):
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.get_node(parent)
+        if 0 <= row < len(node.children):
+            return self.createIndex(row, column, node.children[row])
+        return QModelIndex()
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.get_node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 2
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.get_node(parent)
+        if node is self.root:
+            return bool(node.children)
+        if node.is_more:
+            return False
+        if node.frame is not None:
+            return True
+        return has_children(node.value)
+
+    def canFetchMore(self, parent):
+        node = self.get_node(parent)
+        if node is self.root or node.is_more:
+            return False
+        return node.get_loaded_count() < node.get_child_count()
+
+    def fetchMore(self, parent):
+        node = self.get_node(parent)
+        loaded = node.get_loaded_count()
+        if node.children and node.children[-1].is_more:
+            self.beginRemoveRows(parent, loaded, loaded)
+            node.children.pop()
+            self.endRemoveRows()
+        if node.frame is not None:
+            names = node.get_scope_names()[loaded:loaded + PAGE_SIZE]
+            children = [(name, node.scope[name]) for name in names]
+            frame_depth = node.row
+        else:
+            children = get_children(node.value, loaded, PAGE_SIZE)
+            frame_depth = None
+        remaining = node.get_child_count() - loaded - len(children)
+        self.beginInsertRows(
+            parent, loaded, loaded + len(children) - (remaining <= 0)
+        )
+        for row, (name, value) in enumerate(children, loaded):
+            node.children.append(
+                VariableNode(node, row, name, value, frame_depth=frame_depth)
+            )
+        if remaining > 0:
+            node.children.append(
+                VariableNode(
+                    node,
+                    len(node.children),
+                    "... {} more".format(remaining),
+                    is_more=True,
+                )
+            )
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        node = index.internalPointer()
+        if index.column() == 0:
+            return node.name
+        if node.frame is not None or node.is_more:
+            return ""
+        return self.reprs.get(node.value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ("Level", "Values")[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        node = index.internalPointer()
+        if (
+            self.editable
+            and index.column() == 1
+            and node.frame_depth is not None
+        ):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        node = index.internalPointer()
+        if (
+            role != Qt.EditRole
+            or not self.editable
+            or node.frame_depth is None
+        ):
+            return False
+        self.global_parent.modify_vars(node.name, node.frame_depth, value)
+        return True
+
+
 class StacktraceWidget(QWidget):
     def __init__(self, parent):
         super().__init__(parent)
@@ -462,60 +1285,34 @@ class StacktraceWidget(QWidget):
         self.tree = QTreeView(self)
         layout = QVBoxLayout(self)
         layout.addWidget(self.tree)
-        self.model = QStandardItemModel()
-        self.model.setHorizontalHeaderLabels(["Level", "Values"])
+        self.model = VariablesModel(parent)
         self.tree.header().setDefaultSectionSize(180)
         self.tree.setModel(self.model)
+        self.tree.clicked.connect(self.on_item_clicked)
 
-    def importData(self, data):
-        self.model.setRowCount(0)
-        root = self.model.invisibleRootItem()
-        for index, stack_values in enumerate(data):
-            parent = QStandardItem(
-                str(stack_values.f_code.co_name)
-                + str(
-                    inspect.signature(
-                        types.FunctionType(stack_values.f_code, {})
-                    )
-                )
-            )
-            parent.setEditable(False)
-            for key, value in stack_values.f_locals.items():
-                keyWidget = QStandardItem(str(key))
-                keyWidget.setEditable(False)
-                try:
-                    value_as_str = repr(value)
-                except BaseException:
-                    value_as_str = "Can't see"
-                valueWidget = ValueWidget(
-                    self.parent, value_as_str, str(key), str(index)
-                )
-                parent.appendRow([keyWidget, valueWidget])
-            root.appendRow(parent)
-
+    def importData(self, data, hidden=(), recorded=False):
+        self.model.set_frames(data, hidden, recorded)
 
-class ValueWidget(QStandardItem):
-    def __init__(self, global_parent, value, key, depth):
-        super().__init__(value)
-        self.global_parent = global_parent
-        self.key = key
-        self.depth = depth
-
-    def setData(self, value, role):
-        super().setData(value, role)
-        self.global_parent.modify_vars(self.key, int(self.depth), value)
+    def on_item_clicked(self, index):
+        # The "... more" row loads the next page of its parent
+        if index.isValid() and index.internalPointer().is_more:
+            self.model.fetchMore(index.parent())
 
 
-class QDbgConsole(QTextEdit):
+class QDbgConsole(QPlainTextEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        # Oldest lines are dropped, the saved output file keeps them all
+        self.setMaximumBlockCount(MAX_CONSOLE_LINES)
 
     def write_with_color(self, msg, color):
-        previous_color = self.textColor()
-        self.setTextColor(color)
-        self.insertPlainText(msg)
-        self.setTextColor(previous_color)
+        text_format = QTextCharFormat()
+        text_format.setForeground(color)
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(msg, text_format)
         self.moveCursor(QTextCursor.End)
 
 
@@ -546,6 +1343,12 @@ class StartProgramDialog(QDialog):
         self.working_directory_dialog_button = QPushButton(self)
         self.working_directory_dialog_button.setText("Open Directory")
         self.arguments = QLineEdit(self)
+        self.include_modules = QLineEdit(self)
+        self.include_modules.setPlaceholderText("mypackage.*, requests")
+        self.exclude_modules = QLineEdit(self)
+        self.exclude_modules.setPlaceholderText(
+            "Standard library and site-packages are excluded by default"
+        )
         buttonBox = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self
         )
@@ -556,9 +1359,11 @@ class StartProgramDialog(QDialog):
         layout.addRow("Working directory", self.working_directory)
         layout.addRow(self.working_directory_dialog_button)
         layout.addRow("Arguments", self.arguments)
+        layout.addRow("Instrument modules", self.include_modules)
+        layout.addRow("Skip modules", self.exclude_modules)
         layout.addWidget(buttonBox)
 
-        self.setFixedSize(640, 200)
+        self.setFixedSize(640, 260)
 
         buttonBox.accepted.connect(self.accept)
         buttonBox.rejected.connect(self.reject)
@@ -572,12 +1377,14 @@ class StartProgramDialog(QDialog):
                 current_tab_filename
                 and current_tab_filename in parent.last_launch_info
             ):
-                (path, wd, arguments) = parent.last_launch_info[
-                    current_tab_filename
-                ]
+                (path, wd, arguments, include, exclude) = (
+                    parent.last_launch_info[current_tab_filename]
+                )
                 self.path_to_program.setText(path)
                 self.working_directory.setText(wd)
                 self.arguments.setText(arguments)
+                self.include_modules.setText(include)
+                self.exclude_modules.setText(exclude)
             elif current_tab_filename:
                 self.path_to_program.setText(current_tab_filename)
                 working_directory = os.path.dirname(current_tab_filename)
@@ -590,8 +1397,10 @@ class StartProgramDialog(QDialog):
                 self.path_to_program.text(),
                 self.working_directory.text(),
                 self.arguments.text(),
+                self.include_modules.text(),
+                self.exclude_modules.text(),
             )
-        return None, None, None
+        return None, None, None, None, None
 
     def get_filename(self):
         filename, ok = QFileDialog.getOpenFileName(self, "Select file")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.childProcesses as childProcesses
+import core.debugger as debugger
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+
+POOL_PROGRAM = ['import multiprocessing',
+                'def work(x):',
+                '    y = x * 2',
+                '    return y',
+                'if __name__ == "__main__":',
+                '    context = multiprocessing.get_context("{}")',
+                '    with context.Pool(2) as pool:',
+                '        print(pool.map(work, [1, 2]))']
+
+
+class ChildProcessTests(unittest.TestCase):
+    def run_program(self, filename, breakpoints, on_child_stopped):
+        debugger_instance = debugger.Debugger()
+        for breakpoint_filename, line_number in breakpoints:
+            debugger_instance.add_breakpoint(breakpoint_filename,
+                                             line_number)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        debugger_instance.start_debugging(
+            debugger_instance.continue_until_breakpoint, filename,
+            debugger.DebugMode.BreakpointMode, stdout, stderr,
+            debug_child_processes=True, on_child_stopped=on_child_stopped)
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertIsNone(childProcesses.active_debugger)
+        self.assertNotIn(childProcesses.PARENT_ADDRESS_VARIABLE, os.environ)
+        return stdout.getvalue()
+
+    def test_subprocess_child_stops_and_steps(self):
+        stops = []
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(['a = 1',
+                                 'b = a + 1',
+                                 'print(b)'], tempfiles[1].name)
+            print_lines_to_file(['import subprocess, sys',
+                                 'subprocess.run([sys.executable, "{}"])'
+                                 .format(tempfiles[1].name)],
+                                tempfiles[0].name)
+
+            def on_child_stopped(child):
+                stops.append((child.pid, child.stop['filename'],
+                              child.stop['line']))
+                if len(stops) == 1:
+                    child.make_step()
+                else:
+                    child.continue_until_breakpoint()
+
+            self.run_program(tempfiles[0].name, [(tempfiles[1].name, 2)],
+                             on_child_stopped)
+        self.assertEqual([stop[1:] for stop in stops],
+                         [(tempfiles[1].name, 2), (tempfiles[1].name, 3)])
+        self.assertNotEqual(stops[0][0], os.getpid())
+
+    def test_child_with_an_environment_of_its_own_is_debugged(self):
+        stops = []
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(['import os',
+                                 'print(os.environ["NAME"])'],
+                                tempfiles[1].name)
+            print_lines_to_file(['import subprocess, sys',
+                                 'child = subprocess.run(',
+                                 '    [sys.executable, "{}"],'
+                                 .format(tempfiles[1].name),
+                                 '    env={"NAME": "child"},',
+                                 '    capture_output=True, text=True)',
+                                 'print(child.returncode, child.stdout,',
+                                 '      end="")'],
+                                tempfiles[0].name)
+
+            def on_child_stopped(child):
+                stops.append((child.stop['filename'], child.stop['line']))
+                child.continue_until_breakpoint()
+
+            output = self.run_program(tempfiles[0].name,
+                                      [(tempfiles[1].name, 2)],
+                                      on_child_stopped)
+        self.assertEqual(output, '0 child\n')
+        self.assertEqual(stops, [(tempfiles[1].name, 2)])
+
+    def test_child_exit_status_reaches_the_parent(self):
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(['import sys',
+                                 'sys.exit(3)'], tempfiles[1].name)
+            print_lines_to_file(['import subprocess, sys',
+                                 'child = subprocess.run(',
+                                 '    [sys.executable, "{}"],'
+                                 .format(tempfiles[1].name),
+                                 '    capture_output=True, text=True)',
+                                 'print(child.returncode,',
+                                 '      repr(child.stderr))'],
+                                tempfiles[0].name)
+            output = self.run_program(
+                tempfiles[0].name, [],
+                lambda child: child.continue_until_breakpoint())
+        self.assertEqual(output, "3 ''\n")
+
+    def test_child_without_a_parent_session_runs_undebugged(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['print("alone")'], tempfiles[0].name)
+            environment = dict(os.environ)
+            environment.pop(childProcesses.PARENT_ADDRESS_VARIABLE, None)
+            child = subprocess.run(
+                [sys.executable, childProcesses.CHILD_SCRIPT,
+                 tempfiles[0].name], env=environment, capture_output=True,
+                text=True)
+        self.assertEqual((child.returncode, child.stdout, child.stderr),
+                         (0, 'alone\n', ''))
+
+    def test_multiprocessing_children_report_breakpoints(self):
+        for start_method in ('fork', 'spawn'):
+            with self.subTest(start_method=start_method), \
+                    TempFiles(1) as tempfiles:
+                print_lines_to_file(
+                    [line.format(start_method) for line in POOL_PROGRAM],
+                    tempfiles[0].name)
+                stops = []
+                lock = threading.Lock()
+
+                def on_child_stopped(child):
+                    with lock:
+                        stops.append((child.pid, child.stop['line'],
+                                      child.stop['function']))
+                    child.continue_until_breakpoint()
+
+                output = self.run_program(tempfiles[0].name,
+                                          [(tempfiles[0].name, 3)],
+                                          on_child_stopped)
+                self.assertEqual(output, '[2, 4]\n')
+                self.assertEqual(sorted(stop[1:] for stop in stops),
+                                 [(3, 'work'), (3, 'work')])
+                self.assertNotIn(os.getpid(), [stop[0] for stop in stops])
+
+    def test_module_child_runs_the_package_main_module(self):
+        stops = []
+        with tempfile.TemporaryDirectory() as directory, \
+                TempFiles(1) as tempfiles:
+            package = os.path.join(directory, 'pkg')
+            os.mkdir(package)
+            print_lines_to_file(['print("init")'],
+                                os.path.join(package, '__init__.py'))
+            print_lines_to_file(['value = 2'],
+                                os.path.join(package, 'helper.py'))
+            main_file = os.path.join(package, '__main__.py')
+            print_lines_to_file(['from . import helper',
+                                 'a = helper.value',
+                                 'print(a, __package__)'], main_file)
+            print_lines_to_file(['import subprocess, sys',
+                                 'child = subprocess.run(',
+                                 '    [sys.executable, "-m", "pkg"],',
+                                 '    cwd={!r}, capture_output=True,'
+                                 .format(directory),
+                                 '    text=True)',
+                                 'print(child.stdout, end="")'],
+                                tempfiles[0].name)
+
+            def on_child_stopped(child):
+                stops.append((child.stop['filename'], child.stop['line']))
+                child.continue_until_breakpoint()
+
+            output = self.run_program(tempfiles[0].name, [(main_file, 3)],
+                                      on_child_stopped)
+        self.assertEqual(output, 'init\n2 pkg\n')
+        self.assertEqual(stops, [(main_file, 3)])
+
+    def test_only_python_commands_are_rewritten(self):
+        script = childProcesses.CHILD_SCRIPT
+        self.assertEqual(
+            childProcesses.get_child_command([sys.executable, '-u', 'a.py',
+                                              '-x']),
+            [sys.executable, '-u', script, 'a.py', '-x'])
+        self.assertEqual(
+            childProcesses.get_child_command(['python3', '-W', 'error',
+                                              '-m', 'pkg']),
+            ['python3', '-W', 'error', script, '-m', 'pkg'])
+        for args in (['ls', '-l'], 'python a.py', [sys.executable],
+                     [sys.executable, '-'], [sys.executable, '-c']):
+            self.assertEqual(childProcesses.get_child_command(args), args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import unittest
+import tempfile
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.debugger as debugger
+from core.codeCache import CodeCache
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+
+class CodeCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = CodeCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stored_code_is_loaded_and_counted(self):
+        code = compile('a = 1', 'test.py', 'exec')
+        key = self.cache.get_key('a = 1', 'test.py', 'mode')
+        self.assertIsNone(self.cache.load('test.py', key))
+        self.cache.store('test.py', key, (code, {}))
+        loaded_code, code_table = self.cache.load('test.py', key)
+        self.assertEqual(loaded_code, code)
+        self.assertEqual(self.cache.get_statistics(),
+                         {'hits': 1, 'misses': 1})
+
+    def test_key_depends_on_source_and_instrumentation(self):
+        key = self.cache.get_key('a = 1', 'test.py', 'mode')
+        self.assertNotEqual(key,
+                            self.cache.get_key('a = 2', 'test.py', 'mode'))
+        self.assertNotEqual(key,
+                            self.cache.get_key('a = 1', 'test.py', 'other'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        code = compile('a = 1', 'test.py', 'exec')
+        keys = [self.cache.get_key(str(i), 'test.py', None)
+                for i in range(3)]
+        self.cache.store('test.py', keys[0], code)
+        self.cache.max_size = 2 * len(os.listdir(self.directory.name)) * \
+            os.path.getsize(self.cache.get_path('test.py', keys[0]))
+        self.cache.store('test.py', keys[1], code)
+        os.utime(self.cache.get_path('test.py', keys[0]), (0, 0))
+        self.cache.store('test.py', keys[2], code)
+        self.assertIsNone(self.cache.load('test.py', keys[0]))
+        self.assertIsNotNone(self.cache.load('test.py', keys[1]))
+        self.assertIsNotNone(self.cache.load('test.py', keys[2]))
+
+    def test_repeated_session_uses_cached_code(self):
+        for instrumentation_mode in debugger.InstrumentationMode:
+            with TempFiles(1) as tempfiles:
+                print_lines_to_file(['def f(x):',
+                                     '    return x + 1',
+                                     'a = f(1)'], tempfiles[0].name)
+                stopped_lines = []
+                for _ in range(2):
+                    dbg = debugger.Debugger()
+                    dbg.add_breakpoint(tempfiles[0].name, 2)
+
+                    def machine():
+                        stopped_lines.append(dbg.get_line_number())
+                        dbg.continue_until_breakpoint()
+
+                    dbg.start_debugging(
+                        machine, tempfiles[0].name,
+                        debugger.DebugMode.BreakpointMode,
+                        instrumentation_mode=instrumentation_mode,
+                        code_cache=self.cache)
+                self.assertEqual(stopped_lines, [1, 2, 1, 2])
+        self.assertEqual(self.cache.get_statistics(),
+                         {'hits': 2, 'misses': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import unittest
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.dapServer as dapServer
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+TIMEOUT = 10
+
+
+class DapClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.sequence = 0
+        self.events = []
+
+    async def request(self, command, arguments=None):
+        self.sequence += 1
+        self.writer.write(dapServer.encode_message({
+            'seq': self.sequence,
+            'type': 'request',
+            'command': command,
+            'arguments': arguments or {},
+        }))
+        await self.writer.drain()
+        while True:
+            message = await self.read()
+            if (message['type'] == 'response' and
+                    message['request_seq'] == self.sequence):
+                return message
+
+    async def wait_for_event(self, event):
+        for index, message in enumerate(self.events):
+            if message['event'] == event:
+                return self.events.pop(index)
+        while True:
+            message = await self.read()
+            if message['type'] == 'event' and message['event'] == event:
+                return message
+
+    async def read(self):
+        message = await asyncio.wait_for(
+            dapServer.read_message(self.reader), TIMEOUT)
+        if message['type'] == 'event':
+            self.events.append(message)
+        return message
+
+
+class DapServerTests(unittest.TestCase):
+    def run_session(self, scenario):
+        sessions = []
+
+        async def main():
+            async def on_connection(reader, writer):
+                session = dapServer.DapSession(reader, writer)
+                sessions.append(session)
+                try:
+                    await session.run()
+                finally:
+                    writer.close()
+
+            server = await asyncio.start_server(on_connection,
+                                                '127.0.0.1', 0)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                               port)
+                await scenario(DapClient(reader, writer), sessions)
+                writer.close()
+
+        asyncio.run(main())
+
+    def test_breakpoint_stops_and_variables_are_inspected(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['a = 1',
+                                 'b = a + 1',
+                                 'print(b)'], tempfiles[0].name)
+
+            async def scenario(client, sessions):
+                response = await client.request('initialize')
+                self.assertTrue(response['body'][
+                    'supportsConditionalBreakpoints'])
+                await client.wait_for_event('initialized')
+                response = await client.request('setBreakpoints', {
+                    'source': {'path': tempfiles[0].name},
+                    'breakpoints': [{'line': 2}, {'line': 3,
+                                                  'hitCondition': 'x'}],
+                })
+                self.assertEqual([bp['verified'] for bp in
+                                  response['body']['breakpoints']],
+                                 [True, False])
+                await client.request('launch',
+                                     {'program': tempfiles[0].name})
+                await client.request('configurationDone')
+                stopped = await client.wait_for_event('stopped')
+                self.assertEqual(stopped['body']['reason'], 'breakpoint')
+                thread_id = stopped['body']['threadId']
+                response = await client.request('threads')
+                self.assertEqual([thread['id'] for thread in
+                                  response['body']['threads']], [thread_id])
+
+                response = await client.request('stackTrace',
+                                                {'threadId': thread_id})
+                frame = response['body']['stackFrames'][0]
+                self.assertEqual(frame['line'], 2)
+                response = await client.request('scopes',
+                                                {'frameId': frame['id']})
+                reference = response['body']['scopes'][-1][
+                    'variablesReference']
+                response = await client.request(
+                    'variables', {'variablesReference': reference})
+                variables = {variable['name']: variable['value']
+                             for variable in response['body']['variables']}
+                self.assertEqual(variables, {'a': '1'})
+                response = await client.request(
+                    'evaluate', {'expression': 'a + 41',
+                                 'frameId': frame['id']})
+                self.assertEqual(response['body']['result'], '42')
+
+                await client.request('continue', {'threadId': thread_id})
+                output = await client.wait_for_event('output')
+                self.assertEqual(output['body']['output'], '2')
+                await client.wait_for_event('terminated')
+                await client.request('disconnect')
+
+            self.run_session(scenario)
+
+    def test_exited_event_has_the_exit_code_of_the_program(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['import sys',
+                                 'sys.exit(3)'], tempfiles[0].name)
+
+            async def scenario(client, sessions):
+                await client.request('initialize')
+                await client.request('launch',
+                                     {'program': tempfiles[0].name})
+                await client.request('configurationDone')
+                exited = await client.wait_for_event('exited')
+                self.assertEqual(exited['body']['exitCode'], 3)
+                await client.wait_for_event('terminated')
+                await client.request('disconnect')
+
+            self.run_session(scenario)
+
+    def test_disconnect_terminates_stopped_program(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['while True:',
+                                 '    a = 1'], tempfiles[0].name)
+
+            async def scenario(client, sessions):
+                await client.request('initialize')
+                await client.request('launch', {'program': tempfiles[0].name,
+                                                'stopOnEntry': True})
+                await client.request('configurationDone')
+                stopped = await client.wait_for_event('stopped')
+                self.assertEqual(stopped['body']['reason'], 'entry')
+                await client.request(
+                    'next', {'threadId': stopped['body']['threadId']})
+                await client.wait_for_event('stopped')
+                await client.request('disconnect')
+                await asyncio.get_running_loop().run_in_executor(
+                    None, sessions[0].debuggee.join, TIMEOUT)
+                self.assertFalse(sessions[0].debuggee.is_alive())
+
+            self.run_session(scenario)
+
+    def test_data_breakpoint_stops_when_the_value_changes(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['counter = 0',
+                                 'counter = 0',
+                                 'counter = 1',
+                                 'print(counter)'], tempfiles[0].name)
+
+            async def scenario(client, sessions):
+                await client.request('initialize')
+                response = await client.request('dataBreakpointInfo',
+                                                {'name': 'counter'})
+                data_id = response['body']['dataId']
+                response = await client.request('setDataBreakpoints', {
+                    'breakpoints': [{'dataId': data_id}, {'dataId': 'a =='}],
+                })
+                self.assertEqual([bp['verified'] for bp in
+                                  response['body']['breakpoints']],
+                                 [True, False])
+                await client.request('launch',
+                                     {'program': tempfiles[0].name})
+                await client.request('configurationDone')
+                stopped = await client.wait_for_event('stopped')
+                self.assertEqual(stopped['body']['reason'],
+                                 'data breakpoint')
+                thread_id = stopped['body']['threadId']
+                response = await client.request('stackTrace',
+                                                {'threadId': thread_id})
+                self.assertEqual(response['body']['stackFrames'][0]['line'],
+                                 4)
+                await client.request('continue', {'threadId': thread_id})
+                output = await client.wait_for_event('output')
+                self.assertEqual(output['body']['output'], '1')
+                await client.wait_for_event('terminated')
+                await client.request('disconnect')
+
+            self.run_session(scenario)
+
+    def test_hit_conditions_are_parsed(self):
+        for hit_condition, expected in [('', (0, None)),
+                                        ('3', (2, None)),
+                                        ('>= 3', (2, None)),
+                                        ('>3', (3, None)),
+                                        ('%2', (0, 2))]:
+            self.assertEqual(dapServer.parse_hit_condition(hit_condition),
+                             expected)
+        with self.assertRaises(ValueError):
+            dapServer.parse_hit_condition('== 3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,22 +4,21 @@ import unittest
 import os
 import sys
 import importlib
+import functools
+import io
+import threading
+import time
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
                              os.path.pardir))
 
 import core.debugger as debugger
-from utils.tempfiles import TempFiles
+from core.moduleFilter import ModuleFilter
+from utils.tempfiles import TempFiles, print_lines_to_file
 
 sys_path_hooks_init_len = len(sys.path_hooks)
 
 
-def print_lines_to_file(lines, filename):
-    with open(filename, 'w', encoding='utf8') as f:
-        for line in lines:
-            print(line, file=f)
-
-
 class DebuggerTests(unittest.TestCase):
     debugger = None
 
@@ -97,6 +96,259 @@ class DebuggerTests(unittest.TestCase):
             self.debugger.start_debugging(machine, tempfiles[0].name,
                                           debugger.DebugMode.StepMode)
 
+    def test_conditional_breakpoint_syntax_error_is_reported_when_added(self):
+        with self.assertRaises(SyntaxError):
+            self.debugger.add_breakpoint('test.py', 2, 'a ==')
+        self.assertEqual(self.debugger.get_breakpoint_lines('test.py'), set())
+
+    def test_many_breakpoints_in_one_file_stop_where_expected(self):
+        stopped_lines = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['def f():',
+                                 '    return 1',
+                                 'a = f()',
+                                 'b = 1'], tempfiles[0].name)
+            for line_number in range(5, 1000):
+                self.debugger.add_breakpoint(tempfiles[0].name, line_number)
+            self.debugger.add_breakpoint(tempfiles[0].name, 2)
+            self.debugger.add_breakpoint('other.py', 4)
+
+            def machine():
+                stopped_lines.append(self.debugger.get_line_number())
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        self.assertEqual(stopped_lines, [1, 2])
+
+    def test_hit_count_breakpoints_stop_where_expected(self):
+        for ignore_count, every_nth_hit, expected_values in [
+                (3, None, [3, 4, 5]),
+                (0, 2, [1, 3, 5]),
+                (1, 2, [2, 4])]:
+            stopped_values = []
+            with TempFiles(1) as tempfiles:
+                print_lines_to_file(['for i in range(6):',
+                                     '    a = i'], tempfiles[0].name)
+
+                def machine():
+                    _globals, _locals = \
+                        self.debugger.get_globals_and_locals()
+                    if self.debugger.get_line_number() == 2:
+                        stopped_values.append(_locals['i'])
+                    self.debugger.continue_until_breakpoint()
+
+                self.debugger.add_breakpoint(tempfiles[0].name, 2,
+                                             ignore_count=ignore_count,
+                                             every_nth_hit=every_nth_hit)
+                self.debugger.start_debugging(machine, tempfiles[0].name,
+                                              debugger.DebugMode.StepMode)
+                self.assertEqual(
+                    self.debugger.get_hit_count(tempfiles[0].name, 2), 6)
+                self.debugger.remove_breakpoint(tempfiles[0].name, 2)
+            self.assertEqual(stopped_values, expected_values)
+
+    def test_hit_counts_count_only_hits_where_the_condition_holds(self):
+        stopped_values = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['for i in range(10):',
+                                 '    a = i'], tempfiles[0].name)
+
+            def machine():
+                _globals, _locals = self.debugger.get_globals_and_locals()
+                if self.debugger.get_line_number() == 2:
+                    stopped_values.append(_locals['i'])
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 2,
+                                         condition='i % 2 == 0',
+                                         ignore_count=1, every_nth_hit=2)
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.StepMode)
+            self.assertEqual(
+                self.debugger.get_hit_count(tempfiles[0].name, 2), 5)
+        # Hits are i = 0, 2, 4, 6 and 8, the first is ignored
+        self.assertEqual(stopped_values, [4, 8])
+
+    def test_logpoint_logs_without_stopping(self):
+        stopped_lines = []
+        output = io.StringIO()
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['for i in range(3):',
+                                 '    a = i * 2',
+                                 'b = 1'], tempfiles[0].name)
+
+            def machine():
+                stopped_lines.append(self.debugger.get_line_number())
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 2,
+                                         log_message='i={i} a={a!r}',
+                                         condition='i > 0')
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.StepMode,
+                                          log_output=output)
+        self.assertEqual(stopped_lines, [1])
+        self.assertEqual(output.getvalue(), 'i=1 a=0\ni=2 a=2\n')
+
+    def test_logpoint_with_a_failing_condition_logs_the_error(self):
+        stopped_lines = []
+        output = io.StringIO()
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['a = 1',
+                                 'b = 2',
+                                 'c = 3'], tempfiles[0].name)
+
+            def machine():
+                stopped_lines.append(self.debugger.get_line_number())
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 2,
+                                         log_message='a={a}',
+                                         condition='a / 0')
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode,
+                                          log_output=output)
+        self.assertEqual(stopped_lines, [1])
+        self.assertEqual(output.getvalue(), '{}:2: division by zero\n'
+                         .format(tempfiles[0].name))
+
+    def test_watchpoints_stop_after_the_value_changes(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['class Counter:',
+                                 '    def __init__(self):',
+                                 '        self.count = 0',
+                                 '    def increment(self):',
+                                 '        self.count += 1',
+                                 'counter = Counter()',
+                                 'cache = {}',
+                                 'counter.increment()',
+                                 'a = 1',
+                                 'counter.increment()',
+                                 "cache['k'] = 1",
+                                 "cache['k'] = 1",
+                                 "cache['k'] = 2",
+                                 'done = True'], tempfiles[0].name)
+            self.debugger.add_watchpoint('counter.count')
+            self.debugger.add_watchpoint("cache['k']")
+
+            def machine():
+                thread = self.debugger.get_selected_thread()
+                stops.append((self.debugger.get_line_number(),
+                              [(watchpoint.expression, watchpoint.old_value,
+                                watchpoint.value)
+                               for watchpoint in thread.changed_watchpoints]))
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        self.assertEqual(stops, [(1, []),
+                                 (9, [('counter.count', 0, 1)]),
+                                 (11, [('counter.count', 1, 2)]),
+                                 (14, [("cache['k']", 1, 2)])])
+        with self.assertRaises(SyntaxError):
+            self.debugger.add_watchpoint('a ==')
+        with self.assertRaises(LookupError):
+            self.debugger.add_watchpoint('counter.count')
+
+    def test_watchpoints_keep_a_value_per_object_and_call(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['class Counter:',
+                                 '    def __init__(self, counter):',
+                                 '        self.counter = counter',
+                                 '    def read(self):',
+                                 '        return self.counter',
+                                 'def f(n):',
+                                 '    return n',
+                                 'first = Counter(0)',
+                                 'second = Counter(5)',
+                                 'first.read()',
+                                 'second.read()',
+                                 'f(1)',
+                                 'f(2)',
+                                 'first.counter = 1',
+                                 'first.read()',
+                                 'done = True'], tempfiles[0].name)
+            self.debugger.add_watchpoint('self.counter')
+            self.debugger.add_watchpoint('n')
+
+            def machine():
+                thread = self.debugger.get_selected_thread()
+                stops.append((self.debugger.get_line_number(),
+                              [(watchpoint.expression, watchpoint.old_value,
+                                watchpoint.value)
+                               for watchpoint in thread.changed_watchpoints]))
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        self.assertEqual(stops, [(1, []), (5, [('self.counter', 0, 1)])])
+        # The values of the locals of f went away with its calls
+        watchpoint, = [watchpoint
+                       for watchpoint in self.debugger.get_watchpoints()
+                       if watchpoint.expression == 'n']
+        self.assertEqual((watchpoint.values, watchpoint.frame_keys),
+                         ({}, {}))
+
+    def test_watchpoints_on_variables_named_like_builtins(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['max = 1',
+                                 'max = 2',
+                                 'done = len([max])'], tempfiles[0].name)
+            self.debugger.add_watchpoint('max')
+
+            def machine():
+                thread = self.debugger.get_selected_thread()
+                stops.append((self.debugger.get_line_number(),
+                              [(watchpoint.old_value, watchpoint.value)
+                               for watchpoint in thread.changed_watchpoints]))
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        # Binding the name hides the builtin, that is a change too
+        self.assertEqual(stops, [(1, []), (2, [(max, 1)]), (3, [(1, 2)])])
+        self.assertEqual(debugger.get_expression_names('len(items) + max'),
+                         {'items', 'max'})
+
+    def test_watchpoints_are_checked_only_in_code_using_their_names(self):
+        stops = []
+        code_watchpoints = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['def add(values):',
+                                 '    values.append(1)',
+                                 '    return len(values)',
+                                 'def other():',
+                                 '    return 0',
+                                 'items = []',
+                                 'add(items)',
+                                 'other()'], tempfiles[0].name)
+            self.debugger.add_watchpoint('len(items)')
+            self.debugger.add_watchpoint('items')
+
+            def machine():
+                stops.append(self.debugger.get_line_number())
+                thread = self.debugger.get_selected_thread()
+                stops.append(len(thread.changed_watchpoints))
+                frame = self.debugger.current_program_frame
+                if 'other' in frame.f_globals:
+                    code_watchpoints.extend(
+                        len(self.debugger.get_code_watchpoints(code))
+                        for code in (frame.f_globals['add'].__code__,
+                                     frame.f_globals['other'].__code__,
+                                     frame.f_code))
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 7)
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        # Changes made by add are seen on the next line of the module
+        self.assertEqual(stops, [1, 0, 7, 0, 8, 2])
+        self.assertEqual(code_watchpoints, [0, 0, 2, 0, 0, 2])
+
     def test_should_stop_on_breakpoint_returns_correct_value(self):
         current_program_state = 0
         with TempFiles(1) as tempfiles:
@@ -247,3 +499,337 @@ class DebuggerTests(unittest.TestCase):
             self.debugger.start_debugging(machine, test_filename,
                                           debugger.DebugMode.StepMode)
         self.assertTrue(stopped)
+
+    def test_paused_debugger_waits_for_command_without_spinning(self):
+        stopped = threading.Event()
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['a = 0',
+                                 'b = 1'], tempfiles[0].name)
+            thread = threading.Thread(
+                target=self.debugger.start_debugging,
+                args=(stopped.set, tempfiles[0].name,
+                      debugger.DebugMode.StepMode),
+                daemon=True)
+            thread.start()
+            try:
+                self.assertTrue(stopped.wait(5))
+                cpu_time = time.process_time()
+                time.sleep(0.3)
+                self.assertLess(time.process_time() - cpu_time, 0.15)
+                self.assertTrue(thread.is_alive())
+            finally:
+                # A failed assertion must not leave the program stopped
+                self.debugger.continue_until_breakpoint()
+                thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_stacktrace_is_tracked_through_calls_and_returns(self):
+        stacktraces = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['def f(n):',
+                                 '    if n:',
+                                 '        f(n - 1)',
+                                 '    return n',
+                                 'f(2)',
+                                 'a = 1'], tempfiles[0].name)
+
+            def machine():
+                stacktraces.append(
+                    (self.debugger.get_line_number(),
+                     self.debugger.get_stack_depth(),
+                     [(frame.f_code.co_name, frame.f_locals.get('n'))
+                      for frame in self.debugger.current_stacktrace]))
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 4)
+            self.debugger.add_breakpoint(tempfiles[0].name, 6)
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.StepMode)
+        self.assertEqual(stacktraces[1:], [
+            (4, 4, [('f', 0), ('f', 1), ('f', 2), ('<module>', None)]),
+            (4, 3, [('f', 1), ('f', 2), ('<module>', None)]),
+            (4, 2, [('f', 2), ('<module>', None)]),
+            (6, 1, [('<module>', None)]),
+        ])
+
+    def test_excluded_module_is_not_instrumented(self):
+        stopped_filenames = []
+
+        with TempFiles(2) as tempfiles:
+            test_filename = tempfiles[0].name
+            imported_filename = tempfiles[1].name
+            module_name = os.path.splitext(
+                os.path.basename(imported_filename))[0]
+
+            print_lines_to_file(['import sys',
+                                 'sys.path.append({})'.format(
+                                     repr(os.path.dirname(imported_filename))),
+                                 'import {}'.format(module_name),
+                                 'a = 1'],
+                                test_filename)
+            print_lines_to_file(['b = 2'], imported_filename)
+
+            def machine():
+                stopped_filenames.append(self.debugger.get_filename())
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(imported_filename, 1)
+            self.debugger.add_breakpoint(test_filename, 4)
+            self.debugger.start_debugging(
+                machine, test_filename, debugger.DebugMode.StepMode,
+                module_filter=ModuleFilter(exclude=[module_name]))
+            sys.modules.pop(module_name, None)
+        self.assertEqual(stopped_filenames, [test_filename, test_filename])
+
+    def test_thread_stop_modes_pause_or_keep_other_threads_running(self):
+        for thread_stop_mode, main_thread_paused in [
+                (debugger.ThreadStopMode.StopAll, True),
+                (debugger.ThreadStopMode.StopOne, False)]:
+            observations = []
+            with TempFiles(1) as tempfiles:
+                print_lines_to_file(['import threading',
+                                     '',
+                                     '',
+                                     'def worker():',
+                                     '    a = 1',
+                                     '',
+                                     '',
+                                     'counter = 0',
+                                     'thread = threading.Thread('
+                                     '    target=worker)',
+                                     'thread.start()',
+                                     'while thread.is_alive():',
+                                     '    counter += 1'], tempfiles[0].name)
+
+                def machine():
+                    if self.debugger.get_line_number() == 5:
+                        program_globals = \
+                            self.debugger.get_globals_and_locals()[0]
+                        main_thread = [
+                            thread for thread in self.debugger.get_threads()
+                            if thread.thread_id ==
+                            self.debugger.main_thread_id][0]
+                        deadline = time.monotonic() + 5
+                        while (main_thread.is_paused != main_thread_paused
+                               and time.monotonic() < deadline):
+                            time.sleep(0.01)
+                        counter = program_globals['counter']
+                        time.sleep(0.05)
+                        observations.append((
+                            self.debugger.get_function_name(),
+                            self.debugger.get_stack_depth(),
+                            len(self.debugger.get_threads()),
+                            main_thread.is_paused,
+                            program_globals['counter'] != counter))
+                    self.debugger.continue_until_breakpoint()
+
+                self.debugger.add_breakpoint(tempfiles[0].name, 5)
+                self.debugger.set_thread_stop_mode(thread_stop_mode)
+                self.debugger.start_debugging(
+                    machine, tempfiles[0].name,
+                    debugger.DebugMode.BreakpointMode)
+                self.debugger.remove_breakpoint(tempfiles[0].name, 5)
+            self.assertEqual(observations, [('worker', 1, 2,
+                                             main_thread_paused,
+                                             not main_thread_paused)])
+
+    def test_commands_go_to_the_stopped_thread(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['import threading',
+                                 '',
+                                 '',
+                                 'def worker():',
+                                 '    a = 1',
+                                 '    b = 2',
+                                 '',
+                                 '',
+                                 'thread = threading.Thread(target=worker)',
+                                 'thread.start()',
+                                 'thread.join()',
+                                 'c = 3'], tempfiles[0].name)
+
+            def machine():
+                stops.append((self.debugger.get_function_name(),
+                              self.debugger.get_line_number()))
+                if self.debugger.get_line_number() == 5:
+                    self.debugger.make_step()
+                else:
+                    self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 5)
+            self.debugger.add_breakpoint(tempfiles[0].name, 12)
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        self.assertEqual(stops, [('<module>', 1), ('worker', 5),
+                                 ('worker', 6), ('<module>', 12)])
+
+    def test_step_over_and_step_out_follow_frames_in_recursion(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['def f(n):',
+                                 '    if n:',
+                                 '        f(n - 1)',
+                                 '    return n',
+                                 'f(2)',
+                                 'x = 1'], tempfiles[0].name)
+
+            def machine():
+                frame = self.debugger.current_program_frame
+                stops.append((frame.f_code.co_name,
+                              self.debugger.get_line_number(),
+                              frame.f_locals.get('n')))
+                if stops[-1] == ('f', 2, 0):
+                    self.debugger.step_out()
+                elif stops[-1][0] == 'f':
+                    self.debugger.step_over()
+                else:
+                    self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 2, 'n == 0')
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        self.assertEqual(stops, [('<module>', 1, None), ('f', 2, 0),
+                                 ('f', 4, 1), ('f', 4, 2),
+                                 ('<module>', 6, None)])
+
+    def test_async_stepping_follows_one_task(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['import asyncio',
+                                 'async def inner(name):',
+                                 '    await asyncio.sleep(0)',
+                                 '    return name',
+                                 'async def worker(name):',
+                                 '    value = await inner(name)',
+                                 '    return value',
+                                 'async def main():',
+                                 '    await asyncio.gather(worker("a"),',
+                                 '                         worker("b"))',
+                                 'asyncio.run(main())'], tempfiles[0].name)
+
+            def machine():
+                frame = self.debugger.current_program_frame
+                stops.append((frame.f_code.co_name,
+                              self.debugger.get_line_number(),
+                              frame.f_locals.get('name')))
+                if stops[-1] == ('inner', 3, 'a'):
+                    self.debugger.step_over()
+                elif stops[-1] == ('inner', 4, 'a'):
+                    stops.append(sorted(
+                        (task.is_current, task.frame.f_code.co_name,
+                         task.frame.f_lineno)
+                        for task in self.debugger.get_tasks()))
+                    self.debugger.step_out()
+                else:
+                    self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 3, 'name == "a"')
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        self.assertEqual(stops, [('<module>', 1, None),
+                                 ('inner', 3, 'a'),
+                                 ('inner', 4, 'a'),
+                                 [(False, 'inner', 3), (False, 'main', 9),
+                                  (True, 'inner', 4)],
+                                 ('worker', 7, 'a')])
+
+    def test_stepping_out_of_a_task_with_no_awaiting_task(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['import asyncio',
+                                 'async def worker(name):',
+                                 '    await asyncio.sleep(0)',
+                                 '    return name',
+                                 'async def main():',
+                                 '    await asyncio.gather(worker("a"),',
+                                 '                         worker("b"))',
+                                 'asyncio.run(main())'], tempfiles[0].name)
+
+            def machine():
+                frame = self.debugger.current_program_frame
+                stops.append((frame.f_code.co_name,
+                              self.debugger.get_line_number(),
+                              frame.f_locals.get('name')))
+                if stops[-1] == ('worker', 4, 'a'):
+                    self.debugger.step_out()
+                else:
+                    self.debugger.continue_until_breakpoint()
+
+            self.debugger.add_breakpoint(tempfiles[0].name, 4, 'name == "a"')
+            self.debugger.start_debugging(machine, tempfiles[0].name,
+                                          debugger.DebugMode.BreakpointMode)
+        # gather awaits with a future, not a task: once the task is done
+        # the next line stops
+        self.assertEqual(stops, [('<module>', 1, None),
+                                 ('worker', 4, 'a'),
+                                 ('worker', 4, 'b')])
+        self.assertEqual(debugger.get_awaiting_tasks(object()), [])
+
+
+@unittest.skipUnless(hasattr(sys, 'monitoring'),
+                     'sys.monitoring requires Python 3.12+')
+class MonitoringDebuggerTests(DebuggerTests):
+    def setUp(self):
+        super().setUp()
+        DebuggerTests.debugger.start_debugging = functools.partial(
+            DebuggerTests.debugger.start_debugging,
+            tracing_backend=debugger.TracingBackendType.Monitoring)
+
+
+class BytecodeInstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        self.debugger = debugger.Debugger()
+
+    def test_breakpoint_only_instrumentation_patches_only_needed_lines(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['def f(x):',
+                                 '    y = x + 1',
+                                 '    y = y * 2',
+                                 '    return y',
+                                 'f(1)'], tempfiles[0].name)
+            with open(tempfiles[0].name, 'r') as f:
+                code = compile(f.read(), tempfiles[0].name, 'exec')
+
+            for patched_lines, expected_lines in [({3}, [2, 3, 4]),
+                                                  (set(), [2, 4])]:
+                hit_lines = []
+
+                def debug(line_number):
+                    frame = sys._getframe(1)
+                    if frame.f_code.co_name == 'f':
+                        self.assertEqual(line_number, frame.f_lineno)
+                        hit_lines.append(line_number)
+
+                exec(debugger.modify_code(code, patched_lines),
+                     {'debug': debug})
+                self.assertEqual(hit_lines, expected_lines)
+
+    def test_breakpoint_only_mode_reinstruments_changed_functions(self):
+        current_program_state = 0
+        stopped_lines = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['def f(x):',
+                                 '    y = x + 1',
+                                 '    y = y * 2',
+                                 '    return y',
+                                 'a = f(1)',
+                                 'b = f(2)'], tempfiles[0].name)
+
+            def machine():
+                nonlocal current_program_state
+                current_program_state += 1
+                stopped_lines.append(self.debugger.get_line_number())
+                if current_program_state == 1:
+                    self.debugger.add_breakpoint(tempfiles[0].name, 2)
+                elif current_program_state == 2:
+                    # Current call of f keeps running its old code
+                    self.debugger.remove_breakpoint(tempfiles[0].name, 2)
+                    self.debugger.add_breakpoint(tempfiles[0].name, 3)
+                self.debugger.continue_until_breakpoint()
+
+            self.debugger.start_debugging(
+                machine, tempfiles[0].name, debugger.DebugMode.StepMode,
+                instrumentation_mode=debugger.InstrumentationMode
+                .BreakpointsOnly)
+        self.assertEqual(stopped_lines, [1, 2, 3])
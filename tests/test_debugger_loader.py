@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import unittest
+import tempfile
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.debuggerLoader import DebugFinder
+
+
+class DebugFinderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.finder = DebugFinder()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_file(self, *path):
+        filename = os.path.join(self.directory.name, *path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as f:
+            f.write('a = 1\n')
+        return filename
+
+    def test_modules_and_packages_are_found(self):
+        module_filename = self.create_file('module_a.py')
+        package_filename = self.create_file('package_a', '__init__.py')
+        path = [self.directory.name]
+        self.assertEqual(self.finder.find_spec('module_a', path).origin,
+                         module_filename)
+        spec = self.finder.find_spec('package_a', path)
+        self.assertEqual(spec.origin, package_filename)
+        self.assertEqual(spec.submodule_search_locations,
+                         [os.path.dirname(package_filename)])
+        self.assertIsNone(self.finder.find_spec('module_b', path))
+
+    def test_directory_cache_is_invalidated_by_mtime(self):
+        path = [self.directory.name]
+        self.assertIsNone(self.finder.find_spec('module_b', path))
+        filename = self.create_file('module_b.py')
+        stat = os.stat(self.directory.name)
+        os.utime(self.directory.name, ns=(stat.st_atime_ns,
+                                          stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.finder.find_spec('module_b', path).origin,
+                         filename)
+
+    def test_already_imported_modules_are_not_instrumented(self):
+        self.create_file('os.py')
+        self.assertIsNone(self.finder.find_spec('os', [self.directory.name]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.debugger as debugger
+import core.lineCoverage as lineCoverage
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+
+PROGRAM = ['def f(x):',
+           '    return x * 2',
+           'def never_called():',
+           '    return 0',
+           'for i in range(3):',
+           '    f(i)']
+
+
+class LineCoverageTests(unittest.TestCase):
+    def test_coverage_run_counts_line_hits(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            debugger_instance = debugger.Debugger()
+            line_coverage = debugger_instance.run_coverage(
+                tempfiles[0].name, stdout=io.StringIO())
+            file_hits = line_coverage.get_line_hits()[tempfiles[0].name]
+            self.assertEqual(file_hits, {1: 1, 2: 3, 3: 1, 5: 1, 6: 3})
+            self.assertEqual(
+                lineCoverage.get_executable_lines(tempfiles[0].name),
+                {1, 2, 3, 4, 5, 6})
+            self.assertFalse(debugger_instance.headless)
+
+    def test_coverage_is_collected_while_debugging(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            debugger_instance = debugger.Debugger()
+            debugger_instance.add_breakpoint(tempfiles[0].name, 2)
+            line_coverage = lineCoverage.LineCoverage()
+
+            def machine():
+                stops.append(debugger_instance.get_line_number())
+                debugger_instance.continue_until_breakpoint()
+
+            debugger_instance.start_debugging(
+                machine, tempfiles[0].name, debugger.DebugMode.BreakpointMode,
+                line_coverage=line_coverage)
+            file_hits = line_coverage.get_line_hits()[tempfiles[0].name]
+        self.assertEqual(stops, [1, 2, 2, 2])
+        self.assertEqual(file_hits[2], 3)
+
+    def test_reports_are_written(self):
+        with TempFiles(3) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            line_coverage = debugger.Debugger().run_coverage(
+                tempfiles[0].name, stdout=io.StringIO())
+            line_coverage.write_json(tempfiles[1].name)
+            with open(tempfiles[1].name, encoding='utf8') as file:
+                report = json.load(file)['files'][tempfiles[0].name]
+            self.assertEqual(report['hits']['2'], 3)
+            self.assertEqual(report['missing_lines'], [4])
+            line_coverage.write_coverage_data(tempfiles[2].name)
+            connection = sqlite3.connect(tempfiles[2].name)
+            try:
+                self.assertEqual(
+                    connection.execute(
+                        'SELECT version FROM coverage_schema').fetchall(),
+                    [(lineCoverage.COVERAGE_SCHEMA_VERSION,)])
+                (path, numbits), = connection.execute(
+                    'SELECT path, numbits FROM file JOIN line_bits '
+                    'ON file.id = line_bits.file_id').fetchall()
+            finally:
+                connection.close()
+            self.assertEqual(path, os.path.abspath(tempfiles[0].name))
+            self.assertEqual(numbits, lineCoverage.get_numbits([1, 2, 3, 5,
+                                                                6]))
+
+    def test_numbits_and_heat_levels(self):
+        self.assertEqual(lineCoverage.get_numbits([1, 2, 9]), b'\x06\x02')
+        self.assertEqual(
+            lineCoverage.get_heat_levels({1: 1, 2: 10, 3: 1000}, {1, 2, 3, 4},
+                                         levels=4),
+            {1: 1, 2: 2, 3: 4, 4: 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.debugger as debugger
+from core.lineProfiler import LineProfiler
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+
+PROGRAM = ['import time',
+           'def slow():',
+           '    time.sleep(0.02)',
+           '    return 1',
+           'def fib(n):',
+           '    if n < 2:',
+           '        return n',
+           '    return fib(n - 1) + fib(n - 2)',
+           'for i in range(2):',
+           '    slow()',
+           'fib(5)']
+
+
+class LineProfilerTests(unittest.TestCase):
+    def profile(self, filename):
+        return debugger.Debugger().run_profile(filename,
+                                               stdout=io.StringIO())
+
+    def test_lines_and_functions_are_timed(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            line_profiler = self.profile(tempfiles[0].name)
+            line_times = line_profiler.get_line_times()[tempfiles[0].name]
+        functions = {stats.code.co_name: stats
+                     for stats in line_profiler.get_function_stats()}
+        self.assertEqual(line_profiler.get_function_stats()[0].code.co_name,
+                         'slow')
+        self.assertGreaterEqual(line_times[3][0], 40 * 10 ** 6)
+        self.assertEqual(line_times[3][1], 2)
+        self.assertEqual((functions['slow'].calls,
+                          functions['slow'].primitive_calls), (2, 2))
+        self.assertEqual((functions['fib'].calls,
+                          functions['fib'].primitive_calls), (15, 1))
+        self.assertEqual(functions['<module>'].calls, 1)
+        module = functions['<module>']
+        self.assertGreaterEqual(module.inclusive_ns,
+                                sum(stats.exclusive_ns
+                                    for stats in functions.values()))
+        self.assertGreaterEqual(functions['slow'].inclusive_ns,
+                                functions['slow'].exclusive_ns)
+
+    def test_time_stopped_in_the_debugger_is_not_counted(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['a = 1',
+                                 'b = 2',
+                                 'c = 3'], tempfiles[0].name)
+            debugger_instance = debugger.Debugger()
+            debugger_instance.add_breakpoint(tempfiles[0].name, 2)
+            line_profiler = LineProfiler()
+
+            def machine():
+                time.sleep(0.1)
+                debugger_instance.continue_until_breakpoint()
+
+            debugger_instance.start_debugging(
+                machine, tempfiles[0].name, debugger.DebugMode.BreakpointMode,
+                line_profiler=line_profiler)
+            line_times = line_profiler.get_line_times()[tempfiles[0].name]
+        self.assertEqual(sorted(line_times), [1, 2, 3])
+        self.assertLess(sum(time_ns for time_ns, _ in line_times.values()),
+                        50 * 10 ** 6)
+
+    def test_finished_threads_are_not_timed_until_the_end(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['import threading, time',
+                                 'def work(x):',
+                                 '    return x',
+                                 'thread = threading.Thread(target=work,',
+                                 '                          args=(1,))',
+                                 'thread.start()',
+                                 'thread.join()',
+                                 'time.sleep(0.3)'], tempfiles[0].name)
+            line_profiler = self.profile(tempfiles[0].name)
+            line_times = line_profiler.get_line_times()[tempfiles[0].name]
+        functions = {stats.code.co_name: stats
+                     for stats in line_profiler.get_function_stats()}
+        self.assertGreaterEqual(line_times[8][0], 300 * 10 ** 6)
+        self.assertLess(line_times[3][0], 100 * 10 ** 6)
+        self.assertLess(functions['work'].inclusive_ns, 100 * 10 ** 6)
+
+    def test_profiles_are_exported(self):
+        with TempFiles(3) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            line_profiler = self.profile(tempfiles[0].name)
+            line_profiler.write_pstats(tempfiles[1].name)
+            stats = pstats.Stats(tempfiles[1].name).stats
+            line_profiler.write_speedscope(tempfiles[2].name)
+            with open(tempfiles[2].name, encoding='utf8') as file:
+                speedscope = json.load(file)
+        fib_key = (tempfiles[0].name, 5, 'fib')
+        self.assertEqual(stats[fib_key][:2], (1, 15))
+        self.assertEqual(stats[fib_key][4][fib_key][1], 14)
+        frames = [frame['name'] for frame in speedscope['shared']['frames']]
+        profile, = speedscope['profiles']
+        self.assertEqual(len(profile['samples']), len(profile['weights']))
+        slow_samples = [weight for sample, weight in
+                        zip(profile['samples'], profile['weights'])
+                        if frames[sample[-1]] == 'slow']
+        self.assertEqual(
+            [frames[index] for index in profile['samples'][0]],
+            ['<module>'])
+        self.assertGreaterEqual(sum(slow_samples), 40 * 10 ** 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
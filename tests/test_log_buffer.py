@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.logBuffer import LogBuffer
+
+
+class LogBufferTests(unittest.TestCase):
+    def test_messages_are_written_in_batches(self):
+        output = io.StringIO()
+        log_buffer = LogBuffer(output, batch_size=2)
+        log_buffer.append('a')
+        self.assertEqual(output.getvalue(), '')
+        log_buffer.append('b')
+        self.assertEqual(output.getvalue(), 'a\nb\n')
+        log_buffer.append('c')
+        log_buffer.flush()
+        self.assertEqual(output.getvalue(), 'a\nb\nc\n')
+
+    def test_buffer_without_output_keeps_last_messages(self):
+        log_buffer = LogBuffer(max_records=2)
+        for message in ['a', 'b', 'c']:
+            log_buffer.append(message)
+        self.assertEqual(log_buffer.get_records(), ['b', 'c'])
+        self.assertEqual(log_buffer.dropped, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
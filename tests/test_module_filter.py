@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import sys
+import sysconfig
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.moduleFilter import ModuleFilter
+
+
+class ModuleFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.stdlib_file = os.path.join(sysconfig.get_paths()['stdlib'],
+                                        'colorsys.py')
+        self.site_packages_file = os.path.join(
+            sysconfig.get_paths()['purelib'], 'package', '__init__.py')
+        self.user_file = os.path.join(os.path.dirname(__file__), 'user.py')
+
+    def test_stdlib_and_site_packages_are_skipped_by_default(self):
+        module_filter = ModuleFilter()
+        self.assertFalse(module_filter.is_included('colorsys',
+                                                   self.stdlib_file))
+        self.assertFalse(module_filter.is_included('package',
+                                                   self.site_packages_file))
+        self.assertTrue(module_filter.is_included('user', self.user_file))
+
+    def test_defaults_can_be_disabled(self):
+        module_filter = ModuleFilter(skip_stdlib=False)
+        self.assertTrue(module_filter.is_included('colorsys',
+                                                  self.stdlib_file))
+        self.assertFalse(module_filter.is_included('package',
+                                                   self.site_packages_file))
+
+    def test_patterns_match_packages_and_submodules(self):
+        module_filter = ModuleFilter(include=['package.sub*'],
+                                     exclude=['user', 'other.*'])
+        self.assertFalse(module_filter.is_included('user', self.user_file))
+        self.assertFalse(module_filter.is_included('user.module',
+                                                   self.user_file))
+        self.assertFalse(module_filter.is_included('other.module',
+                                                   self.user_file))
+        self.assertTrue(module_filter.is_included('other', self.user_file))
+        self.assertTrue(module_filter.is_included('package.submodule',
+                                                  self.site_packages_file))
+        self.assertFalse(module_filter.is_included('package',
+                                                   self.site_packages_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.outputBuffer import OutputBuffer
+from utils.tempfiles import TempFiles
+
+
+class OutputBufferTests(unittest.TestCase):
+    def test_writes_are_joined_per_stream(self):
+        chunks = []
+        output_buffer = OutputBuffer(lambda text, stream: chunks.append(
+            (text, stream)))
+        for text, stream in [('a', 'out'), ('b', 'out'), ('c', 'err'),
+                             ('d', 'out')]:
+            output_buffer.write(text, stream)
+        self.assertEqual(chunks, [])
+        output_buffer.flush()
+        self.assertEqual(chunks, [('ab', 'out'), ('c', 'err'),
+                                  ('d', 'out')])
+
+    def test_writer_flushes_at_flush_size(self):
+        chunks = []
+        output_buffer = OutputBuffer(lambda text, stream: chunks.append(text),
+                                     flush_size=4)
+        output_buffer.write('abc')
+        self.assertEqual(chunks, [])
+        output_buffer.write('de')
+        self.assertEqual(chunks, ['abcde'])
+
+    def test_full_buffer_waits_for_flushing_thread(self):
+        chunks = []
+        requests = []
+        output_buffer = OutputBuffer(
+            lambda text, stream: chunks.append(text), flush_size=2,
+            max_pending=4, on_full=lambda: requests.append(True),
+            flush_thread_id=threading.get_ident())
+
+        def write():
+            for _ in range(4):
+                output_buffer.write('ab')
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(0.2)
+        # The writer waits instead of growing the buffer past max_pending
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(chunks, [])
+        while writer.is_alive():
+            output_buffer.flush()
+            writer.join(0.01)
+        output_buffer.flush()
+        self.assertEqual(''.join(chunks), 'ab' * 4)
+
+    def test_spool_file_gets_all_output(self):
+        output_buffer = OutputBuffer(lambda text, stream: None)
+        with TempFiles(1) as tempfiles:
+            output_buffer.open_spool(tempfiles[0].name)
+            output_buffer.write('out\n', 'out')
+            output_buffer.write('err\n', 'err')
+            output_buffer.close_spool()
+            output_buffer.write('not saved\n')
+            output_buffer.flush()
+            with open(tempfiles[0].name, encoding='utf8') as spool_file:
+                self.assertEqual(spool_file.read(), 'out\nerr\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
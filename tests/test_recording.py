@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.debugger as debugger
+import core.recording as recording
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+
+PROGRAM = ['def f(n):',
+           '    total = 0',
+           '    for i in range(n):',
+           '        total += i',
+           '    return total',
+           'items = []',
+           'for k in range(4):',
+           '    items.append(f(k))',
+           'del k',
+           'result = sum(items)']
+
+
+def get_state(replay):
+    return [(frame.name, frame.line_number, dict(frame.local_reprs))
+            for frame in replay.get_stacktrace()]
+
+
+class RecordingTests(unittest.TestCase):
+    def record(self, program_file, record_file, snapshot_interval=4,
+               **options):
+        debugger_instance = debugger.Debugger()
+        stderr = io.StringIO()
+        debugger_instance.start_debugging(
+            debugger_instance.continue_until_breakpoint, program_file,
+            debugger.DebugMode.BreakpointMode, io.StringIO(), stderr,
+            record_file=record_file, snapshot_interval=snapshot_interval,
+            **options)
+        return debugger_instance, stderr.getvalue()
+
+    def test_replay_shows_recorded_lines_and_locals(self):
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            debugger_instance, errors = self.record(tempfiles[0].name,
+                                                    tempfiles[1].name)
+            self.assertEqual(errors, '')
+            replay = debugger_instance.get_replay()
+            lines = []
+            for position in range(replay.line_count):
+                frame = replay.seek(position)
+                lines.append(frame.line_number)
+                if (frame.name, frame.line_number) == ('f', 5):
+                    self.assertEqual(replay.get_stacktrace()[1].name,
+                                     '<module>')
+            self.assertEqual(lines[:6], [1, 6, 7, 8, 2, 3])
+            self.assertEqual(replay.get_frame().line_number, 10)
+            self.assertEqual(replay.get_frame().local_reprs['items'],
+                             '[0, 0, 1, 3]')
+            # k was deleted by the previous line
+            replay.step_back()
+            self.assertIn('k', replay.get_frame().local_reprs)
+            replay.step_forward()
+            self.assertNotIn('k', replay.get_frame().local_reprs)
+            self.assertIsNone(replay.step_forward())
+            replay.seek(0)
+            self.assertIsNone(replay.step_back())
+
+    def test_seeking_from_snapshots_matches_replay_from_start(self):
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            self.record(tempfiles[0].name, tempfiles[1].name)
+            replay = recording.Replay.open(tempfiles[1].name)
+            self.assertGreater(len(replay.index.snapshot_positions), 2)
+            expected = []
+            for position in range(replay.line_count):
+                replay_from_start = recording.Replay.open(tempfiles[1].name)
+                replay_from_start.index.snapshot_positions = []
+                replay_from_start.seek(position)
+                expected.append(get_state(replay_from_start))
+            for position in reversed(range(replay.line_count)):
+                replay.seek(position)
+                self.assertEqual(get_state(replay), expected[position])
+            replay.seek(0)
+            for position in range(1, replay.line_count):
+                replay.step_forward()
+                self.assertEqual(get_state(replay), expected[position])
+
+    @unittest.skipUnless(hasattr(os, 'O_NOFOLLOW'),
+                         'O_NOFOLLOW is not supported')
+    def test_recorder_does_not_follow_a_symlink(self):
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(['keep'], tempfiles[0].name)
+            link = tempfiles[0].name + '.recording'
+            os.symlink(tempfiles[0].name, link)
+            try:
+                with self.assertRaises(OSError):
+                    recording.Recorder(link)
+            finally:
+                os.remove(link)
+            with open(tempfiles[0].name, encoding='utf8') as file:
+                self.assertEqual(file.read(), 'keep\n')
+
+    def test_recording_needs_every_line(self):
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(PROGRAM, tempfiles[0].name)
+            _, errors = self.record(
+                tempfiles[0].name, tempfiles[1].name,
+                instrumentation_mode=(
+                    debugger.InstrumentationMode.BreakpointsOnly))
+            self.assertIn('need every line', errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.debugger as debugger
+import core.sampler as sampler
+from core.lineProfiler import CallNode
+from utils.tempfiles import TempFiles, print_lines_to_file
+
+
+def get_program(seconds):
+    return ['import time',
+            'def work(n):',
+            '    total = 0',
+            '    for i in range(n):',
+            '        total += i',
+            '    return total',
+            'deadline = time.perf_counter() + {}'.format(seconds),
+            'while time.perf_counter() < deadline:',
+            '    work(1000)']
+
+
+class SamplerTests(unittest.TestCase):
+    def test_stacks_of_an_uninstrumented_run_are_sampled(self):
+        with TempFiles(2) as tempfiles:
+            print_lines_to_file(get_program(0.3), tempfiles[0].name)
+            samples = debugger.Debugger().run_sampled(
+                tempfiles[0].name, stdout=io.StringIO())
+            samples.write_speedscope(tempfiles[1].name)
+            with open(tempfiles[1].name, encoding='utf8') as file:
+                speedscope = json.load(file)
+        self.assertIsNone(samples.thread)
+        self.assertEqual(samples.get_hotspots(1)[0][:2],
+                         (tempfiles[0].name, 5))
+        functions = {code.co_name: function_samples for code, function_samples
+                     in samples.get_function_samples().items()}
+        self.assertEqual(set(functions), {'<module>', 'work'})
+        self.assertGreater(functions['work'][0], functions['<module>'][0])
+        self.assertEqual(functions['<module>'][1], samples.stack_samples)
+        self.assertLess(samples.get_overhead(), sampler.MAX_OVERHEAD)
+        frames = [frame['name'] for frame in speedscope['shared']['frames']]
+        profile, = speedscope['profiles']
+        self.assertEqual(
+            [frames[index] for index in profile['samples'][0]][0],
+            '<module>')
+
+    def test_breakpoint_on_a_sampled_line_stops_the_running_program(self):
+        stops = []
+        with TempFiles(1) as tempfiles:
+            print_lines_to_file(get_program(10), tempfiles[0].name)
+            debugger_instance = debugger.Debugger()
+            samples = sampler.Sampler()
+
+            def machine():
+                stops.append((debugger_instance.get_function_name(),
+                              debugger_instance.get_line_number()))
+                debugger_instance.remove_breakpoint(tempfiles[0].name, 5)
+                debugger_instance.current_program_frame.f_globals[
+                    'deadline'] = 0
+                debugger_instance.continue_until_breakpoint()
+
+            thread = threading.Thread(
+                target=debugger_instance.start_debugging,
+                args=(machine, tempfiles[0].name,
+                      debugger.DebugMode.BreakpointMode),
+                kwargs={'stdout': io.StringIO(),
+                        'tracing_backend':
+                            debugger.TracingBackendType.Sampling,
+                        'sampler': samples})
+            thread.start()
+            while (tempfiles[0].name, 5) not in samples.line_samples:
+                time.sleep(0.01)
+            debugger_instance.add_breakpoint(tempfiles[0].name, 5)
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(stops, [('work', 5)])
+
+    def test_recursive_functions_count_once_in_the_total(self):
+        code = compile('def f(): pass', '<test>', 'exec')
+        function_code = code.co_consts[0]
+        root = CallNode(None)
+        outer = root.get_child(function_code)
+        inner = outer.get_child(function_code)
+        outer.calls = 3
+        inner.calls = 2
+        function_samples = dict()
+        sampler.add_function_samples(root, function_samples)
+        self.assertEqual(function_samples[id(function_code)][1:], [3, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
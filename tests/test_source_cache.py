@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import unittest
+import tempfile
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from core.sourceCache import SourceCache
+
+
+class SourceCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'source.py')
+        self.write('a = 1\r\nb = 2\nc = 3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text, mtime_ns=None):
+        with open(self.filename, 'w', encoding='utf8', newline='') as f:
+            f.write(text)
+        if mtime_ns is not None:
+            os.utime(self.filename, ns=(mtime_ns, mtime_ns))
+
+    def test_lines_are_read_by_number(self):
+        for cache in [SourceCache(), SourceCache(mmap_threshold=1)]:
+            self.assertEqual(cache.get_source(self.filename),
+                             'a = 1\nb = 2\nc = 3')
+            self.assertEqual(cache.get_line(self.filename, 1), 'a = 1\n')
+            self.assertEqual(cache.get_line(self.filename, 3), 'c = 3')
+            self.assertEqual(cache.get_line(self.filename, 4), '')
+            self.assertEqual(cache.get_line_count(self.filename), 3)
+            self.assertEqual(cache.files[self.filename].mapped,
+                             cache.mmap_threshold == 1)
+            cache.clear()
+
+    def test_changed_file_is_read_again(self):
+        cache = SourceCache()
+        self.write('x = 1\n', 10 ** 9)
+        self.assertEqual(cache.get_line(self.filename, 1), 'x = 1\n')
+        self.write('y = 2\n', 2 * 10 ** 9)
+        self.assertEqual(cache.get_line(self.filename, 1), 'y = 2\n')
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = SourceCache(max_size=40)
+        other = os.path.join(self.directory.name, 'other.py')
+        with open(other, 'w') as f:
+            f.write('z = 0\n' * 5)
+        cache.get_source(self.filename)
+        cache.get_source(other)
+        self.assertEqual(list(cache.files), [other])
+        self.assertEqual(cache.get_line(os.path.join(self.directory.name,
+                                                     'missing.py'), 1), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
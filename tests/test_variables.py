@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+import core.variables as variables
+
+
+class Unorderable:
+    def __lt__(self, other):
+        raise TypeError('not orderable')
+
+
+class VariablesTests(unittest.TestCase):
+    def test_repr_of_big_containers_is_bounded(self):
+        big_list = list(range(10 ** 6))
+        big_dict = dict.fromkeys(range(10 ** 6))
+        for value in (big_list, big_dict, set(big_list), 'x' * 10 ** 6):
+            text = variables.get_value_repr(value)
+            self.assertLessEqual(len(text), variables.MAX_REPR_LENGTH + 3)
+        self.assertTrue(variables.get_value_repr(big_list).startswith(
+            '[0, 1, 2'))
+
+    def test_dict_repr_keeps_insertion_order(self):
+        value = {'b': 1, 'a': 2, Unorderable(): 3}
+        text = variables.get_value_repr(value)
+        self.assertTrue(text.startswith("{'b': 1, 'a': 2, "))
+
+    def test_children_are_paged(self):
+        value = list(range(250))
+        self.assertEqual(variables.get_child_count(value), 250)
+        page = variables.get_children(value, 200, variables.PAGE_SIZE)
+        self.assertEqual(page[0], ('200', 200))
+        self.assertEqual(len(page), 50)
+        self.assertEqual(variables.get_children({'a': 1}), [("'a'", 1)])
+        self.assertFalse(variables.has_children(len))
+        self.assertFalse(variables.has_children([]))
+
+    def test_scope_names_skip_hidden_and_dunder_names(self):
+        scope = {'__name__': '__main__', 'debug': None, 'a': 1}
+        self.assertEqual(variables.get_scope_names(scope, {'debug'}), ['a'])
+
+    def test_repr_cache_computes_each_repr_once(self):
+        calls = []
+
+        class CountingRepr:
+            def __repr__(self):
+                calls.append(self)
+                return 'counted'
+
+        value = CountingRepr()
+        cache = variables.ReprCache()
+        self.assertEqual(cache.get(value), 'counted')
+        self.assertEqual(cache.get(value), 'counted')
+        self.assertEqual(len(calls), 1)
+        cache.clear()
+        cache.get(value)
+        self.assertEqual(len(calls), 2)
+
+    def test_frame_title_shows_signature(self):
+        def function(a, b, *args, **kwargs):
+            return sys._getframe()
+
+        self.assertEqual(variables.get_frame_title(function(1, 2)),
+                         'function(a, b, *args, **kwargs)')
+
+
+if __name__ == '__main__':
+    unittest.main()
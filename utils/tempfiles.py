@@ -21,3 +21,9 @@ class TempFiles:
             except OSError:
                 pass
         return False
+
+
+def print_lines_to_file(lines, filename):
+    with open(filename, 'w', encoding='utf8') as f:
+        for line in lines:
+            print(line, file=f)